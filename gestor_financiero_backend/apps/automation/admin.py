@@ -1,7 +1,8 @@
 from django.contrib import admin
-from .models import EventRule, ScheduledRule
+from .models import EventRule, ScheduledRule, ScheduledRuleExecution
 
 # Register your models here.
 
 admin.site.register(EventRule)
 admin.site.register(ScheduledRule)
+admin.site.register(ScheduledRuleExecution)
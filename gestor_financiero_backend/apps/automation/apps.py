@@ -12,3 +12,5 @@ class AutomationConfig(AppConfig):
         """
         # Esta línea importa y "registra" tu archivo signals.py
         import apps.automation.signals
+        # Y registra el chequeo de despliegue del caché compartido
+        import apps.automation.checks
@@ -0,0 +1,24 @@
+# apps/automation/checks.py
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+# Backends cuyo contenido vive en cada proceso
+LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """
+    El índice de reglas de evento se invalida en el caché: con un caché por
+    proceso, los demás procesos siguen usando la versión vieja hasta que vence.
+    """
+    if settings.CACHES['default']['BACKEND'] in LOCAL_CACHE_BACKENDS:
+        return [Warning(
+            "El caché 'default' no es compartido entre procesos.",
+            hint="Definí REDIS_URL para que las invalidaciones de reglas lleguen a todos los procesos.",
+            id='automation.W001',
+        )]
+    return []
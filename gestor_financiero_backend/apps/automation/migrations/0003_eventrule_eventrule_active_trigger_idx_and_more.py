@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:29
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('automation', '0002_scheduledrule'),
+        ('transactions', '0004_alter_transaction_date'),
+        ('users', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='eventrule',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['account', 'trigger_category', 'trigger_transaction_type'], name='eventrule_active_trigger_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='scheduledrule',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['schedule_day_of_month'], name='schedrule_active_day_idx'),
+        ),
+    ]
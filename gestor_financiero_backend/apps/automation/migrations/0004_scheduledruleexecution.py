@@ -0,0 +1,80 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:00
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_scheduled_rules(apps, schema_editor):
+    """
+    Las reglas existentes no tienen fecha de creación: se usa la de su cuenta,
+    la cota más temprana posible, para que la recuperación pueda ejecutar los
+    períodos que se perdieron antes del deploy. Los meses en que el motor
+    anterior ya ejecutó cada regla se reconstruyen desde sus transferencias
+    y quedan registrados como ejecutados, así no se repiten.
+    """
+    ScheduledRule = apps.get_model('automation', 'ScheduledRule')
+    ScheduledRuleExecution = apps.get_model('automation', 'ScheduledRuleExecution')
+    Transaction = apps.get_model('transactions', 'Transaction')
+
+    executions = []
+    for rule in ScheduledRule.objects.select_related('account').iterator():
+        ScheduledRule.objects.filter(pk=rule.pk).update(created_at=rule.account.created_at)
+        description = rule.action_description or f"Auto: {rule.name}"
+        transfers = Transaction.objects.filter(
+            account_id=rule.account_id, created_by_rule=True,
+            description=f"{description} (Salida)", transaction_type='EXPENSE',
+        ).order_by('date', 'id').values_list('date', 'amount')
+        periods = {}
+        for run_date, amount in transfers:
+            periods.setdefault(run_date.replace(day=1), (run_date, amount))
+        executions += [
+            ScheduledRuleExecution(rule_id=rule.pk, period=period, run_date=run_date,
+                                   status='EXECUTED', amount=amount)
+            for period, (run_date, amount) in periods.items()
+        ]
+    ScheduledRuleExecution.objects.bulk_create(executions, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('automation', '0003_eventrule_eventrule_active_trigger_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='scheduledrule',
+            name='schedule_day_of_month',
+            field=models.PositiveIntegerField(help_text='Día del mes (1-31) en que se ejecuta la regla. En los meses más cortos se ejecuta el último día.', validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(31)]),
+        ),
+        migrations.CreateModel(
+            name='ScheduledRuleExecution',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.DateField(help_text='Primer día del mes al que corresponde la ejecución.')),
+                ('run_date', models.DateField(help_text='Fecha programada (y de las transacciones creadas).')),
+                ('status', models.CharField(choices=[('EXECUTED', 'Ejecutada'), ('SKIPPED', 'Omitida')], max_length=10)),
+                ('amount', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('executed_at', models.DateTimeField(auto_now_add=True)),
+                ('rule', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='executions', to='automation.scheduledrule')),
+            ],
+            options={
+                'verbose_name': 'Ejecución de Regla Programada',
+                'verbose_name_plural': 'Ejecuciones de Reglas Programadas',
+                'ordering': ['-period', 'rule'],
+                'constraints': [models.UniqueConstraint(fields=('rule', 'period'), name='scheduledruleexecution_unique_period')],
+            },
+        ),
+        migrations.AddField(
+            model_name='scheduledrule',
+            name='created_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.RunPython(backfill_scheduled_rules, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='scheduledrule',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True),
+        ),
+    ]
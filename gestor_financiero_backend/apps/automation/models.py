@@ -99,6 +99,14 @@ class EventRule(models.Model):
     class Meta:
         verbose_name = "Regla de Evento"
         verbose_name_plural = "Reglas de Evento"
+        indexes = [
+            # Búsqueda de reglas en el signal post_save: solo interesan las activas
+            models.Index(
+                fields=['account', 'trigger_category', 'trigger_transaction_type'],
+                condition=models.Q(is_active=True),
+                name='eventrule_active_trigger_idx',
+            ),
+        ]
 
 
 class ScheduledRule(models.Model):
@@ -107,11 +115,13 @@ class ScheduledRule(models.Model):
     name = models.CharField(max_length=100, help_text="Nombre de la regla (ej: 'Pagar Alquiler')")
     created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, related_name='scheduled_rules')
     is_active = models.BooleanField(default=True)
+    # La recuperación de períodos perdidos no ejecuta fechas anteriores a la creación
+    created_at = models.DateTimeField(auto_now_add=True)
 
     # --- Trigger (El "SI...") ---
     schedule_day_of_month = models.PositiveIntegerField(
         validators=[MinValueValidator(1), MaxValueValidator(31)],
-        help_text="Día del mes (1-31) en que se ejecuta la regla."
+        help_text="Día del mes (1-31) en que se ejecuta la regla. En los meses más cortos se ejecuta el último día."
     )
 
     # --- Origen (El "DESDE DÓNDE...") ---
@@ -152,6 +162,43 @@ class ScheduledRule(models.Model):
         verbose_name = "Regla Programada"
         verbose_name_plural = "Reglas Programadas"
         ordering = ['schedule_day_of_month', 'name']
+        indexes = [
+            # Búsqueda diaria de reglas a ejecutar en run_scheduled_rules
+            models.Index(
+                fields=['schedule_day_of_month'],
+                condition=models.Q(is_active=True),
+                name='schedrule_active_day_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.name} (Día {self.schedule_day_of_month})"
+
+
+class ScheduledRuleExecution(models.Model):
+    """
+    Registro de ejecuciones de las reglas programadas: una fila por regla y
+    período (mes). La restricción única hace que reintentar o reejecutar la
+    tarea, o correrla en paralelo, nunca duplique una transferencia.
+    """
+    class Status(models.TextChoices):
+        EXECUTED = 'EXECUTED', 'Ejecutada'
+        SKIPPED = 'SKIPPED', 'Omitida'
+
+    rule = models.ForeignKey(ScheduledRule, on_delete=models.CASCADE, related_name='executions')
+    period = models.DateField(help_text="Primer día del mes al que corresponde la ejecución.")
+    run_date = models.DateField(help_text="Fecha programada (y de las transacciones creadas).")
+    status = models.CharField(max_length=10, choices=Status.choices)
+    amount = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    executed_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Ejecución de Regla Programada"
+        verbose_name_plural = "Ejecuciones de Reglas Programadas"
+        ordering = ['-period', 'rule']
+        constraints = [
+            models.UniqueConstraint(fields=['rule', 'period'], name='scheduledruleexecution_unique_period'),
+        ]
 
     def __str__(self):
-        return f"{self.name} (Día {self.schedule_day_of_month})"
\ No newline at end of file
+        return f"{self.rule_id} - {self.period:%Y-%m} ({self.get_status_display()})"
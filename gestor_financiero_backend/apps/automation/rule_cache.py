@@ -0,0 +1,40 @@
+# apps/automation/rule_cache.py
+from collections import defaultdict
+from django.conf import settings
+from django.core.cache import cache
+from apps.automation.models import EventRule
+
+# Se incrementa si cambia el formato de lo que guardamos en caché
+CACHE_KEY_VERSION = 1
+
+
+def _cache_key(account_id):
+    return f"automation:event_rules:v{CACHE_KEY_VERSION}:{account_id}"
+
+
+def get_event_rule_index(account_id):
+    """
+    Devuelve el índice de reglas de evento activas de una cuenta:
+    un dict {(trigger_category_id, trigger_transaction_type): [EventRule, ...]}.
+
+    Se guarda en el caché de Django (en memoria por defecto, compartido si
+    CACHES apunta a Redis/Memcached). Una cuenta sin reglas se cachea como
+    un dict vacío, así que el caso "ninguna regla coincide" no toca la base.
+    """
+    key = _cache_key(account_id)
+    index = cache.get(key)
+    if index is None:
+        index = defaultdict(list)
+        for rule in EventRule.objects.filter(account_id=account_id, is_active=True).order_by('id'):
+            index[(rule.trigger_category_id, rule.trigger_transaction_type)].append(rule)
+        index = dict(index)
+        cache.set(key, index, settings.EVENT_RULES_CACHE_TIMEOUT)
+    return index
+
+
+def get_matching_event_rules(account_id, category_id, transaction_type):
+    return get_event_rule_index(account_id).get((category_id, transaction_type), [])
+
+
+def invalidate_event_rules(account_id):
+    cache.delete(_cache_key(account_id))
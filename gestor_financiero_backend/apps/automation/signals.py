@@ -1,40 +1,83 @@
-from django.db.models.signals import post_save
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete, pre_delete
 from django.dispatch import receiver
-from apps.transactions.models import Transaction
-from apps.automation.models import EventRule, ActionType, TransactionType
+from django.db import transaction as db_transaction
+from apps.transactions.models import Category, Transaction, apply_materialized_totals
+from apps.automation.models import EventRule, ScheduledRule, ActionType, TransactionType
+from apps.users.models import AccountChange, record_changes, is_account_deletion
+from apps.automation.rule_cache import get_matching_event_rules, invalidate_event_rules
 from decimal import Decimal
 
-@receiver(post_save, sender=Transaction)
-def execute_event_rules(sender, instance, created, **kwargs):
+
+@receiver(post_save, sender=EventRule)
+@receiver(post_delete, sender=EventRule)
+def invalidate_event_rule_cache(sender, instance, **kwargs):
     """
-    Esta función se ejecuta CADA VEZ que se guarda una Transaction.
+    Cualquier alta, cambio o baja de una regla invalida el índice cacheado de su cuenta.
+    Se invalida al confirmar la transacción: si se hiciera antes, otro proceso
+    podría volver a cachear las reglas viejas mientras el cambio no es visible.
     """
-    # Solo actuar si la transacción es NUEVA (no en actualizaciones)
-    if not created:
-        return
+    account_id = instance.account_id
+    db_transaction.on_commit(lambda: invalidate_event_rules(account_id))
 
-    # Si esta transacción fue creada por otra regla, no hacer nada.
-    #    Esto evita el bucle infinito.
-    if instance.created_by_rule:
+
+RULE_CHANGE_KINDS = {
+    EventRule: AccountChange.Kind.EVENT_RULE,
+    ScheduledRule: AccountChange.Kind.SCHEDULED_RULE,
+}
+
+
+@receiver(post_save, sender=EventRule)
+@receiver(post_delete, sender=EventRule)
+@receiver(post_save, sender=ScheduledRule)
+@receiver(post_delete, sender=ScheduledRule)
+def record_rule_change(sender, instance, signal, **kwargs):
+    """
+    Registra el cambio en el log de la cuenta, lo que además incrementa su
+    versión de cambios (el ETag de los listados de reglas).
+    """
+    if signal is post_delete:
+        if is_account_deletion(kwargs.get('origin')):
+            return
+        record_changes(RULE_CHANGE_KINDS[sender], deleted=[instance])
+    else:
+        record_changes(RULE_CHANGE_KINDS[sender], [instance])
+
+
+@receiver(pre_delete, sender=Category)
+def record_scheduled_rules_losing_category(sender, instance, **kwargs):
+    """
+    Las reglas programadas quedan sin la categoría borrada (SET_NULL, sin
+    señales): se registran antes del borrado. Las reglas de evento se borran
+    en cascada y registran su baja en record_rule_change.
+    """
+    if is_account_deletion(kwargs.get('origin')):
         return
-    
-    transaction = instance
-    
+    rules = ScheduledRule.objects.filter(
+        Q(source_category=instance) | Q(action_destination_category=instance)
+    ).only('id', 'account_id')
+    record_changes(AccountChange.Kind.SCHEDULED_RULE, rules)
+
+
+def derive_rule_transactions(transaction):
+    """
+    Devuelve (sin guardar) las transacciones que las reglas de evento activas
+    generan a partir de 'transaction'. Las transacciones creadas por una regla
+    no disparan otras reglas, para evitar bucles infinitos.
+    """
+    if transaction.created_by_rule:
+        return []
+
     # Buscamos reglas activas en la misma cuenta que coincidan 
-    # con la categoría y tipo de la transacción recién creada.
-    matching_rules = EventRule.objects.filter(
-        account=transaction.account,
-        is_active=True,
-        trigger_category=transaction.category,
-        trigger_transaction_type=transaction.transaction_type
+    # con la categoría y tipo de la transacción.
+    # El índice está cacheado por cuenta: si no hay reglas, no se consulta la base.
+    matching_rules = get_matching_event_rules(
+        transaction.account_id,
+        transaction.category_id,
+        transaction.transaction_type
     )
 
-    # --- 3. Ejecutar las Acciones ---
-    
-    # Usamos un 'set' para evitar crear transacciones duplicadas
-    # si por error hubieran dos reglas idénticas.
-    new_transactions_to_create = set()
-
+    derived = []
     for rule in matching_rules:
         calculated_amount = Decimal('0.00')
 
@@ -51,43 +94,52 @@ def execute_event_rules(sender, instance, created, **kwargs):
         # Si el monto es 0, no crear nada
         if not calculated_amount or calculated_amount <= 0:
             continue
-            
-        # Añadimos los datos de la nueva transacción a nuestro 'set'
-        new_transactions_to_create.add(
-            (
-                rule.action_destination_category,
-                calculated_amount.quantize(Decimal('0.01')), # Redondear a 2 decimales
-                rule.action_transaction_type,
-                rule.action_description or f"Auto: {rule.name}"
-            )
-        )
-
-    # Creamos todas las nuevas transacciones de una vez
+
         description = rule.action_description or f"Transferencia: {rule.name}"
-        calculated_amount = calculated_amount.quantize(Decimal('0.01'))
-
-        # 1. Transacción de GASTO (Salida del origen)
-        #    La categoría de origen es la misma que disparó la regla.
-        # Transaction.objects.create(
-        #     account=transaction.account,
-        #     category=transaction.category, # <-- Categoría Origen (ej: "Sueldo")
-        #     amount=calculated_amount,
-        #     date=transaction.date,
-        #     description=f"{description} (Salida)",
-        #     transaction_type=TransactionType.EXPENSE, # <-- GASTO
-        #     created_by_rule=True 
-        # )
-        
-        # 2. Transacción de INGRESO (Entrada al destino)
-        #    La categoría de destino es la definida en la regla.
-        Transaction.objects.create(
-            account=transaction.account,
-            category=rule.action_destination_category, # <-- Categoría Destino (ej: "Ahorro")
+        calculated_amount = calculated_amount.quantize(Decimal('0.01')) # Redondear a 2 decimales
+
+        # Transacción de entrada al destino.
+        # La categoría de destino es la definida en la regla.
+        derived.append(Transaction(
+            account_id=transaction.account_id,
+            category_id=rule.action_destination_category_id, # <-- Categoría Destino (ej: "Ahorro")
             amount=calculated_amount,
             date=transaction.date,
             description=f"{description} (Entrada)",
-            transaction_type=TransactionType.EXPENSE, # <-- INGRESO
+            transaction_type=TransactionType.EXPENSE,
             created_by_rule=True
-        )
+        ))
+    return derived
+
 
+def save_rule_transactions(derived):
+    """
+    Inserta las transacciones derivadas con un único bulk_create y actualiza
+    los totales materializados y el log de cambios, todo dentro del mismo bloque atómico.
+    bulk_create no emite post_save, así que no se vuelven a evaluar reglas.
+    """
+    if not derived:
+        return []
+    with db_transaction.atomic():
+        created = Transaction.objects.bulk_create(derived)
+        apply_materialized_totals(created)
+        record_changes(AccountChange.Kind.TRANSACTION, created)
+    return created
+
+
+@receiver(post_save, sender=Transaction)
+def execute_event_rules(sender, instance, created, **kwargs):
+    """
+    Esta función se ejecuta CADA VEZ que se guarda una Transaction.
+    """
+    # Solo actuar si la transacción es NUEVA (no en actualizaciones)
+    if not created:
+        return
+
+    # Si esta transacción fue creada por otra regla, no hacer nada.
+    #    Esto evita el bucle infinito.
+    if instance.created_by_rule:
+        return
 
+    # Todas las reglas que coinciden se escriben juntas en un solo INSERT
+    save_rule_transactions(derive_rule_transactions(instance))
@@ -1,98 +1,399 @@
+import calendar
+import time
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Exists, OuterRef
 from django.utils import timezone
-from django.db.models import Sum, F, Q
+from django_q.models import Task
+from django_q.tasks import async_task, count_group, fetch_group
+from django.db import IntegrityError, transaction as db_transaction
 from decimal import Decimal
-from apps.automation.models import ScheduledRule, TransactionType, ActionType
-from apps.transactions.models import Transaction
+from apps.automation.models import ScheduledRule, ScheduledRuleExecution, TransactionType, ActionType
+from apps.transactions.models import Transaction, CategoryBalance, apply_materialized_totals
+from apps.users.models import AccountChange, record_changes
+
+# Reglas que se escriben juntas en una misma transacción de base de datos
+SCHEDULED_RULES_BATCH_SIZE = 500
+
+# Días hacia atrás que revisa por defecto la recuperación de períodos perdidos
+SCHEDULED_RULES_CATCH_UP_DAYS = 31
+
+# Rutas de las tareas del modo distribuido (django-q las recibe como texto)
+SHARD_TASK = 'apps.automation.tasks.run_scheduled_rules_shard'
+SHARD_HOOK = 'apps.automation.tasks.collect_scheduled_rules_shard'
+SUMMARY_TASK = 'apps.automation.tasks.summarize_scheduled_rules'
+# Segundos que un grupo queda marcado como 'resumen encolado'
+SUMMARY_CLAIM_TIMEOUT = 24 * 60 * 60
+
+
+def period_start(day):
+    """Período (mes) al que pertenece una fecha: su primer día."""
+    return day.replace(day=1)
+
+
+def scheduled_date(rule, period):
+    """
+    Fecha en que corresponde ejecutar la regla dentro del período. Las reglas
+    de los días 29 a 31 se ejecutan el último día de los meses más cortos.
+    """
+    last_day = calendar.monthrange(period.year, period.month)[1]
+    return period.replace(day=min(rule.schedule_day_of_month, last_day))
+
+
+def compute_rule_amount(rule, balances):
+    """
+    Calcula el monto a transferir por una regla. 'balances' es el dict
+    {(account_id, category_id): saldo} precargado para el lote.
+    Devuelve None si la regla no debe ejecutarse.
+    """
+    if rule.action_type == ActionType.FIXED:
+        amount = rule.action_fixed_amount
+    elif rule.action_type == ActionType.PERCENTAGE:
+        # Si es porcentaje, usamos el saldo actual de la categoría origen
+        if not rule.source_category_id or not rule.action_percentage:
+            return None
+        current_balance = balances.get((rule.account_id, rule.source_category_id), Decimal('0.00'))
+        if current_balance <= 0:
+            return None
+        amount = current_balance * (rule.action_percentage / Decimal('100.00'))
+    else:
+        return None
+
+    if not amount:
+        return None
+    amount = amount.quantize(Decimal('0.01'))  # Redondear a 2 decimales
+    return amount if amount > 0 else None
+
+
+def build_rule_transactions(rule, amount, run_date):
+    """
+    Devuelve (sin guardar) el par de transacciones de la transferencia:
+    el gasto en la categoría origen y el ingreso en la de destino.
+    """
+    description = rule.action_description or f"Auto: {rule.name}"
+    common = dict(account_id=rule.account_id, amount=amount, date=run_date, created_by_rule=True)
+    return [
+        Transaction(
+            category_id=rule.source_category_id,
+            description=f"{description} (Salida)",
+            transaction_type=TransactionType.EXPENSE,
+            **common
+        ),
+        Transaction(
+            category_id=rule.action_destination_category_id,
+            description=f"{description} (Entrada)",
+            transaction_type=TransactionType.INCOME,
+            **common
+        ),
+    ]
+
+
+def load_balances(rules):
+    """
+    Saldos de todas las categorías origen y destino de las reglas del lote,
+    con una única consulta. Las claves sin fila en CategoryBalance arrancan
+    en 0, así una regla que lee el saldo que dejó otra del mismo lote lo ve
+    igual que si se ejecutaran de a una.
+    """
+    balances = {
+        (rule.account_id, category_id): Decimal('0.00')
+        for rule in rules
+        for category_id in (rule.source_category_id, rule.action_destination_category_id)
+        if category_id
+    }
+    if not balances:
+        return balances
+    candidates = CategoryBalance.objects.filter(
+        account_id__in={key[0] for key in balances},
+        category_id__in={key[1] for key in balances},
+    ).values_list('account_id', 'category_id', 'income_total', 'expense_total')
+    for account_id, category_id, income, expense in candidates:
+        if (account_id, category_id) in balances:
+            balances[(account_id, category_id)] = income - expense
+    return balances
+
+
+def execute_rule_batch(rules, period):
+    """
+    Ejecuta un lote de reglas del período: calcula los montos, escribe todas las
+    transferencias con un bulk_create, registra cada regla en el historial de
+    ejecuciones y actualiza totales y log de cambios, todo en una sola
+    transacción. Si otra ejecución ya registró alguna de las reglas para el
+    período, la restricción única revierte el lote completo.
+    Devuelve (ejecutadas, omitidas, transacciones creadas).
+    """
+    balances = load_balances(rules)
+    to_create, executions, executed, skipped = [], [], 0, 0
+    for rule in rules:
+        run_date = scheduled_date(rule, period)
+        amount = compute_rule_amount(rule, balances)
+        if amount is None:
+            print(f"Regla '{rule.name}' (ID: {rule.id}) omitida (monto 0, negativo o incompleta).")
+            executions.append(ScheduledRuleExecution(
+                rule_id=rule.id, period=period, run_date=run_date, status=ScheduledRuleExecution.Status.SKIPPED,
+            ))
+            skipped += 1
+            continue
+        to_create += build_rule_transactions(rule, amount, run_date)
+        executions.append(ScheduledRuleExecution(
+            rule_id=rule.id, period=period, run_date=run_date,
+            status=ScheduledRuleExecution.Status.EXECUTED, amount=amount,
+        ))
+        executed += 1
+        # Igual que si se ejecutaran de a una: la salida descuenta del saldo que
+        # verán las reglas siguientes, y la entrada suma al destino
+        for category_id, delta in ((rule.source_category_id, -amount), (rule.action_destination_category_id, amount)):
+            if (rule.account_id, category_id) in balances:
+                balances[(rule.account_id, category_id)] += delta
+
+    created = []
+    with db_transaction.atomic():
+        # Una omisión anterior no cuenta como ejecutada: se reemplaza por el resultado de ahora
+        retried = [rule.id for rule in rules if getattr(rule, 'skipped_before', False)]
+        if retried:
+            ScheduledRuleExecution.objects.filter(
+                rule_id__in=retried, period=period, status=ScheduledRuleExecution.Status.SKIPPED,
+            ).delete()
+        ScheduledRuleExecution.objects.bulk_create(executions)
+        if to_create:
+            created = Transaction.objects.bulk_create(to_create)
+            apply_materialized_totals(created)
+            record_changes(AccountChange.Kind.TRANSACTION, created)
+    return executed, skipped, len(created)
+
+
+def execute_scheduled_rules(rules, run_date, batch_size=SCHEDULED_RULES_BATCH_SIZE):
+    """
+    Motor por lotes de las reglas programadas. Procesa 'rules' (un queryset)
+    para el período (mes) de 'run_date' en lotes de 'batch_size' y devuelve
+    métricas de la ejecución. Las reglas que ya se ejecutaron en el período no
+    se vuelven a ejecutar, así que reintentar es seguro; las que se omitieron
+    (por ejemplo, sin saldo en el origen) se vuelven a evaluar.
+    Si un lote falla, sus reglas se reintentan de a una para aislar la que falla.
+    """
+    started = time.monotonic()
+    period = period_start(run_date)
+    # Se cargan las reglas completas, pero no sus cuentas ni categorías: de esas alcanzan los ids.
+    # Dentro de cada cuenta se respeta el orden por nombre de la regla.
+    executions = ScheduledRuleExecution.objects.filter(rule=OuterRef('pk'), period=period)
+    rules = [
+        rule for rule in rules.filter(
+            ~Exists(executions.filter(status=ScheduledRuleExecution.Status.EXECUTED))
+        ).annotate(
+            skipped_before=Exists(executions.filter(status=ScheduledRuleExecution.Status.SKIPPED))
+        ).order_by('account_id', 'name', 'id')
+        # Una regla nunca se ejecuta para una fecha anterior a su creación
+        if scheduled_date(rule, period) >= rule.created_at.date()
+    ]
+    metrics = {'rules': len(rules), 'executed': 0, 'skipped': 0, 'failed': 0, 'transactions': 0, 'batches': 0}
+
+    # Los lotes no parten una cuenta: los saldos en memoria son por cuenta
+    batches, batch = [], []
+    for rule in rules:
+        if len(batch) >= batch_size and batch[-1].account_id != rule.account_id:
+            batches.append(batch)
+            batch = []
+        batch.append(rule)
+    if batch:
+        batches.append(batch)
+
+    for batch in batches:
+        metrics['batches'] += 1
+        try:
+            results = [execute_rule_batch(batch, period)]
+        except Exception as e:
+            print(f"ERROR en un lote de {len(batch)} reglas ({e}). Reintentando de a una...")
+            results = []
+            for rule in batch:
+                try:
+                    results.append(execute_rule_batch([rule], period))
+                except IntegrityError:
+                    # Otra ejecución (un reintento o un shard en paralelo) ya la registró
+                    print(f"Regla '{rule.name}' (ID: {rule.id}) ya ejecutada en el período {period:%Y-%m}.")
+                    metrics['skipped'] += 1
+                except Exception as e:
+                    # Registrar cualquier error inesperado
+                    print(f"ERROR al ejecutar regla '{rule.name}' (ID: {rule.id}): {e}")
+                    metrics['failed'] += 1
+        for executed, skipped, created in results:
+            metrics['executed'] += executed
+            metrics['skipped'] += skipped
+            metrics['transactions'] += created
+
+    metrics['seconds'] = round(time.monotonic() - started, 3)
+    metrics['rules_per_second'] = round(metrics['rules'] / metrics['seconds'], 1) if metrics['seconds'] else None
+    return metrics
+
+
+def due_rules(run_date, since=None):
+    """
+    Reglas activas programadas entre el día de 'since' (por defecto, el mismo
+    'run_date') y el de 'run_date', dentro de un mismo mes. El último día del
+    mes también incluye las reglas de los días que ese mes no tiene.
+    """
+    first_day = (since or run_date).day
+    days = {'schedule_day_of_month__gte': first_day}
+    if run_date.day < calendar.monthrange(run_date.year, run_date.month)[1]:
+        days['schedule_day_of_month__lte'] = run_date.day
+    return ScheduledRule.objects.filter(is_active=True, **days)
+
+
+def format_metrics(metrics):
+    return (
+        f"Procesadas {metrics['rules']} reglas. Ejecutadas exitosamente: {metrics['executed']}. "
+        f"Omitidas: {metrics['skipped']}. Con error: {metrics['failed']}. "
+        f"Transacciones creadas: {metrics['transactions']} en {metrics['batches']} lotes, "
+        f"{metrics['seconds']} s ({metrics['rules_per_second']} reglas/s)."
+    )
+
 
 def run_scheduled_rules():
     """
     Esta es la función de tarea que django-q ejecutará.
     Busca y procesa todas las reglas programadas para el día actual.
     """
-    
     # 1. Obtener el día actual y las reglas correspondientes
-    today = timezone.now().day
-    
-    rules_to_run = ScheduledRule.objects.filter(
-        is_active=True,
-        schedule_day_of_month=today
-    )
-    
-    print(f"[{timezone.now()}] Tarea 'run_scheduled_rules' iniciada...")
-    print(f"Día actual: {today}. Reglas encontradas: {rules_to_run.count()}")
-
-    executed_count = 0
-
-    # 2. Iterar sobre cada regla y procesarla
-    for rule in rules_to_run:
-        calculated_amount = Decimal('0.00')
-
-        # 3. Calcular el monto de la transferencia
-        if rule.action_type == ActionType.FIXED:
-            calculated_amount = rule.action_fixed_amount
-        
-        elif rule.action_type == ActionType.PERCENTAGE:
-            # Si es porcentaje, calculamos el balance actual de la categoría origen
-            if not rule.source_category or not rule.action_percentage:
-                print(f"Regla '{rule.name}' (ID: {rule.id}) omitida: Falta categoría origen o porcentaje.")
-                continue
-
-            # Calcular balance: (Suma de Ingresos) - (Suma de Gastos) en la categoría origen
-            balance_info = Transaction.objects.filter(
-                account=rule.account,
-                category=rule.source_category
-            ).aggregate(
-                income_total=Sum('amount', filter=Q(transaction_type=TransactionType.INCOME)),
-                expense_total=Sum('amount', filter=Q(transaction_type=TransactionType.EXPENSE))
-            )
-            
-            income = balance_info.get('income_total') or Decimal('0.00')
-            expense = balance_info.get('expense_total') or Decimal('0.00')
-            current_balance = income - expense
-            
-            if current_balance > 0:
-                percentage = rule.action_percentage / Decimal('100.00')
-                calculated_amount = current_balance * percentage
-
-        # 4. Validar monto y crear las transacciones de transferencia
-        if not calculated_amount or calculated_amount <= 0:
-            print(f"Regla '{rule.name}' (ID: {rule.id}) omitida (monto 0 o negativo).")
-            continue
+    run_date = timezone.now().date()
+    rules_to_run = due_rules(run_date)
 
-        description = rule.action_description or f"Auto: {rule.name}"
-        calculated_amount = calculated_amount.quantize(Decimal('0.01')) # Redondear a 2 decimales
+    print(f"[{timezone.now()}] Tarea 'run_scheduled_rules' iniciada. Día actual: {run_date.day}.")
 
-        try:
-            # Gasto (Salida de la categoría origen)
-            Transaction.objects.create(
-                account=rule.account,
-                category=rule.source_category,
-                amount=calculated_amount,
-                date=timezone.now().date(),
-                description=f"{description} (Salida)",
-                transaction_type=TransactionType.EXPENSE,
-                created_by_rule=True # Marcar como automática
-            )
-            
-            # Ingreso (Entrada a la categoría destino)
-            Transaction.objects.create(
-                account=rule.account,
-                category=rule.action_destination_category,
-                amount=calculated_amount,
-                date=timezone.now().date(),
-                description=f"{description} (Entrada)",
-                transaction_type=TransactionType.INCOME,
-                created_by_rule=True # Marcar como automática
-            )
-            
-            print(f"Regla '{rule.name}' (ID: {rule.id}) ejecutada exitosamente (Monto: {calculated_amount}).")
-            executed_count += 1
-
-        except Exception as e:
-            # Registrar cualquier error inesperado
-            print(f"ERROR al ejecutar regla '{rule.name}' (ID: {rule.id}): {e}")
+    # 2. Procesar las reglas por lotes
+    metrics = execute_scheduled_rules(rules_to_run, run_date)
 
-    result_message = f"Procesadas {rules_to_run.count()} reglas. Ejecutadas exitosamente: {executed_count}."
+    result_message = format_metrics(metrics)
     print(f"[{timezone.now()}] Tarea 'run_scheduled_rules' finalizada. {result_message}")
     return result_message
 
+
+def catch_up_scheduled_rules(since=None, until=None):
+    """
+    Tarea de recuperación: ejecuta las reglas de los días entre 'since' y
+    'until' (por defecto, los últimos SCHEDULED_RULES_CATCH_UP_DAYS días
+    hasta hoy) que no tengan una ejecución registrada, por ejemplo después de
+    que el cluster estuvo apagado (Q_CLUSTER usa catch_up: False).
+    Se procesa un período (mes) por vez, con una sola pasada del motor por lotes;
+    las transacciones llevan la fecha en que debió ejecutarse cada regla.
+    """
+    until = until or timezone.now().date()
+    since = since or until - timedelta(days=SCHEDULED_RULES_CATCH_UP_DAYS)
+    print(f"[{timezone.now()}] Tarea 'catch_up_scheduled_rules' iniciada. Desde {since} hasta {until}.")
+
+    totals = {'rules': 0, 'executed': 0, 'skipped': 0, 'failed': 0, 'transactions': 0, 'batches': 0, 'seconds': 0}
+    periods, window_start = 0, since
+    while window_start <= until:
+        last_day = calendar.monthrange(window_start.year, window_start.month)[1]
+        window_end = min(until, window_start.replace(day=last_day))
+        metrics = execute_scheduled_rules(due_rules(window_end, since=window_start), window_end)
+        for key in totals:
+            totals[key] += metrics[key]
+        periods += 1
+        window_start = window_end + timedelta(days=1)
+    totals['rules_per_second'] = round(totals['rules'] / totals['seconds'], 1) if totals['seconds'] else None
+
+    result_message = f"{periods} períodos. {format_metrics(totals)}"
+    print(f"[{timezone.now()}] Tarea 'catch_up_scheduled_rules' finalizada. {result_message}")
+    return result_message
+
+
+# --- Modo distribuido: un shard de cuentas por worker de django-q ---
+
+def partition_accounts(rule_counts, shards):
+    """
+    Reparte las cuentas en 'shards' grupos equilibrando la cantidad de reglas
+    (la cuenta más cargada va al shard más liviano). 'rule_counts' es
+    {account_id: reglas}. Una cuenta nunca se reparte entre dos shards.
+    """
+    buckets = [[] for _ in range(max(1, min(shards, len(rule_counts))))]
+    loads = [0] * len(buckets)
+    for account_id, count in sorted(rule_counts.items(), key=lambda item: (-item[1], item[0])):
+        lightest = loads.index(min(loads))
+        buckets[lightest].append(account_id)
+        loads[lightest] += count
+    return [bucket for bucket in buckets if bucket]
+
+
+def run_scheduled_rules_sharded(shards=None, run_date=None):
+    """
+    Tarea de django-q que reparte las reglas del día por cuenta y encola una
+    tarea por shard con async_task, todas en el mismo grupo. Cuando termina el
+    último shard, el hook encola la tarea de resumen. Un shard que falla no
+    detiene a los demás: queda registrado como fallido en el resumen.
+    Por defecto se usa un shard por worker del cluster.
+    """
+    run_date = run_date or timezone.now().date()
+    shards = shards or settings.Q_CLUSTER.get('workers', 1)
+    rule_counts = dict(
+        due_rules(run_date).values_list('account_id').annotate(count=Count('id')).order_by()
+    )
+    if not rule_counts:
+        return f"No hay reglas programadas para el día {run_date.day}."
+
+    partitions = partition_accounts(rule_counts, shards)
+    group = f"reglas-programadas-{run_date.isoformat()}-{uuid.uuid4().hex[:8]}"
+    print(f"[{timezone.now()}] Distribuyendo {sum(rule_counts.values())} reglas de "
+          f"{len(rule_counts)} cuentas en {len(partitions)} shards (grupo {group}).")
+    for index, account_ids in enumerate(partitions):
+        async_task(
+            SHARD_TASK, account_ids, run_date,
+            shard=index, shards=len(partitions),
+            group=group, hook=SHARD_HOOK,
+            task_name=f"{group}-shard-{index}",
+        )
+    return group
+
+
+def run_scheduled_rules_shard(account_ids, run_date, shard=0, shards=1):
+    """
+    Ejecuta las reglas del día de las cuentas de un shard con el motor por lotes.
+    Devuelve las métricas, que django-q guarda como resultado de la tarea.
+    """
+    rules = due_rules(run_date).filter(account_id__in=account_ids)
+    metrics = execute_scheduled_rules(rules, run_date)
+    print(f"[{timezone.now()}] Shard {shard + 1}/{shards}: {format_metrics(metrics)}")
+    return metrics
+
+
+def collect_scheduled_rules_shard(task):
+    """
+    Hook de cada shard. El monitor de django-q ejecuta los hooks de a uno,
+    así que solo el hook del último shard en terminar encola el resumen.
+    El hook puede repetirse (un shard reintentado vuelve a guardarse), así
+    que el resumen se encola una sola vez por grupo.
+    """
+    # count_group cuenta todas las tareas del grupo, exitosas o no
+    if count_group(task.group) != task.kwargs['shards']:
+        return
+    summary_name = f"{task.group}-resumen"
+    # La tabla de tareas cubre el resumen que ya corrió; el caché, el que sigue en la cola
+    if Task.objects.filter(name=summary_name).exists():
+        return
+    if not cache.add(f"automation:{summary_name}", True, SUMMARY_CLAIM_TIMEOUT):
+        return
+    async_task(SUMMARY_TASK, task.group, task_name=summary_name)
+
+
+def summarize_scheduled_rules(group):
+    """
+    Tarea de resumen: suma las métricas de todos los shards del grupo.
+    """
+    totals = {'rules': 0, 'executed': 0, 'skipped': 0, 'failed': 0, 'transactions': 0, 'batches': 0, 'seconds': 0}
+    tasks = fetch_group(group, failures=True) or []
+    failed_shards = []
+    for task in tasks:
+        if not task.success:
+            failed_shards.append(task.kwargs.get('shard'))
+            continue
+        for key in totals:
+            totals[key] += task.result[key]
+    # Los shards corren en paralelo: el tiempo total es el del más lento
+    totals['seconds'] = max((task.result['seconds'] for task in tasks if task.success), default=0)
+    totals['rules_per_second'] = round(totals['rules'] / totals['seconds'], 1) if totals['seconds'] else None
+
+    result_message = f"{len(tasks)} shards. {format_metrics(totals)}"
+    if failed_shards:
+        result_message += f" Shards con error: {sorted(failed_shards)}."
+    print(f"[{timezone.now()}] Resumen de '{group}'. {result_message}")
+    return result_message
@@ -1,3 +1,434 @@
-from django.test import TestCase
+from datetime import date, datetime, timezone as dt_timezone
+from decimal import Decimal
+from importlib import import_module
+import uuid
+from unittest import mock
+from django.apps import apps as django_apps
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from django_q.conf import Conf
+from django_q.models import Task
+from django_q.tasks import async_task
+from apps.users.models import CustomUser, Account
+from apps.transactions.models import Category, CategoryBalance, Transaction
+from .models import EventRule, ScheduledRule, ScheduledRuleExecution, ActionType, TransactionType
+from . import tasks
+from .checks import check_shared_cache
+from .rule_cache import get_event_rule_index, get_matching_event_rules
+from .tasks import (
+    build_rule_transactions, catch_up_scheduled_rules, due_rules, execute_scheduled_rules, partition_accounts,
+    run_scheduled_rules_sharded,
+)
 
-# Create your tests here.
+RUN_DATE = date(2025, 3, 5)
+CREATED_AT = datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+
+
+class ScheduledRuleTestCase(TestCase):
+    """
+    Datos comunes: una cuenta con saldo en 'Sueldo' y reglas de transferencia.
+    """
+
+    def setUp(self):
+        # Los índices de reglas cacheados sobreviven al rollback de otros tests
+        cache.clear()
+        self.user = CustomUser.objects.create_user('owner@test.com', 'secret', first_name='Owner')
+        self.account = Account.objects.create(name='Cuenta', owner=self.user)
+        self.salary = Category.objects.create(name='Sueldo')
+        self.savings = Category.objects.create(name='Ahorro')
+        self.rent = Category.objects.create(name='Alquiler')
+        Transaction.objects.create(
+            account=self.account, category=self.salary, amount=Decimal('1000.00'),
+            description='Sueldo', date=RUN_DATE, transaction_type=TransactionType.INCOME,
+        )
+
+    def create_rule(self, name, account=None, **kwargs):
+        defaults = dict(
+            schedule_day_of_month=RUN_DATE.day, source_category=self.salary,
+            action_destination_category=self.savings, action_type=ActionType.FIXED,
+            action_fixed_amount=Decimal('100.00'),
+        )
+        created_at = kwargs.pop('created_at', CREATED_AT)
+        defaults.update(kwargs)
+        rule = ScheduledRule.objects.create(account=account or self.account, name=name, created_by=self.user, **defaults)
+        # auto_now_add ignora el valor al crear: las reglas de los tests existen desde antes de RUN_DATE
+        ScheduledRule.objects.filter(pk=rule.pk).update(created_at=created_at)
+        rule.created_at = created_at
+        return rule
+
+    def run_rules(self, **kwargs):
+        return execute_scheduled_rules(ScheduledRule.objects.filter(is_active=True), RUN_DATE, **kwargs)
+
+
+class ScheduledRuleEngineTests(ScheduledRuleTestCase):
+    """
+    El motor por lotes de reglas programadas.
+    """
+
+    def test_fixed_and_percentage_rules_create_transfer_pairs(self):
+        self.create_rule('A fijo')
+        self.create_rule('B porcentaje', action_type=ActionType.PERCENTAGE,
+                         action_fixed_amount=None, action_percentage=Decimal('10.00'))
+        metrics = self.run_rules()
+
+        self.assertEqual((metrics['executed'], metrics['transactions'], metrics['failed']), (2, 4, 0))
+        transfers = Transaction.objects.filter(created_by_rule=True)
+        # La regla de porcentaje ve el saldo ya descontado por la regla anterior: 10% de 900
+        self.assertEqual(
+            sorted((t.description, t.amount) for t in transfers),
+            [('Auto: A fijo (Entrada)', Decimal('100.00')), ('Auto: A fijo (Salida)', Decimal('100.00')),
+             ('Auto: B porcentaje (Entrada)', Decimal('90.00')), ('Auto: B porcentaje (Salida)', Decimal('90.00'))]
+        )
+        balance = CategoryBalance.objects.get(account=self.account, category=self.salary)
+        self.assertEqual(balance.balance, Decimal('810.00'))
+
+    def test_chained_rules_see_balances_created_in_the_same_batch(self):
+        middle = Category.objects.create(name='Medio')
+        # 'Medio' todavía no tiene fila en CategoryBalance
+        self.create_rule('A llenar medio', action_destination_category=middle, action_fixed_amount=Decimal('500.00'))
+        self.create_rule('B mitad de medio', source_category=middle, action_type=ActionType.PERCENTAGE,
+                         action_fixed_amount=None, action_percentage=Decimal('50.00'))
+        metrics = self.run_rules()
+
+        self.assertEqual((metrics['executed'], metrics['skipped']), (2, 0))
+        self.assertEqual(
+            Transaction.objects.get(description='Auto: B mitad de medio (Salida)').amount, Decimal('250.00')
+        )
+        balance = CategoryBalance.objects.get(account=self.account, category=middle)
+        self.assertEqual(balance.balance, Decimal('250.00'))
+
+    def test_rules_without_amount_are_skipped(self):
+        self.create_rule('Sin saldo', source_category=self.rent, action_type=ActionType.PERCENTAGE,
+                         action_fixed_amount=None, action_percentage=Decimal('10.00'))
+        metrics = self.run_rules()
+        self.assertEqual((metrics['executed'], metrics['skipped']), (0, 1))
+        self.assertFalse(Transaction.objects.filter(created_by_rule=True).exists())
+
+    def test_query_count_does_not_grow_with_rules(self):
+        for i in range(3):
+            account = Account.objects.create(name=f'Cuenta {i}', owner=self.user)
+            for n in range(10):
+                self.create_rule(f'Regla {n}', account=account, action_type=ActionType.PERCENTAGE,
+                                 action_fixed_amount=None, action_percentage=Decimal('5.00'))
+                self.create_rule(f'Fija {n}', account=account)
+        # reglas, saldos, historial, insert, totales materializados y log de cambios:
+        # siempre las mismas consultas
+        with self.assertNumQueries(21):
+            metrics = self.run_rules(batch_size=1000)
+        self.assertEqual(metrics['executed'], 30)
+        self.assertEqual(metrics['batches'], 1)
+
+
+class ScheduledRuleExecutionLedgerTests(ScheduledRuleTestCase):
+    """
+    El historial de ejecuciones: reintentos idempotentes y recuperación de períodos.
+    """
+
+    def transfers(self):
+        return Transaction.objects.filter(created_by_rule=True)
+
+    def test_rerun_in_the_same_period_does_not_duplicate_transfers(self):
+        rule = self.create_rule('Ahorro')
+        self.create_rule('Sin saldo', source_category=self.rent, action_type=ActionType.PERCENTAGE,
+                         action_fixed_amount=None, action_percentage=Decimal('10.00'))
+        self.run_rules()
+        metrics = self.run_rules()
+
+        # Solo la omitida se vuelve a evaluar, y sigue sin saldo
+        self.assertEqual((metrics['rules'], metrics['executed'], metrics['skipped']), (1, 0, 1))
+        self.assertEqual(self.transfers().count(), 2)
+        self.assertEqual(
+            sorted(ScheduledRuleExecution.objects.values_list('status', 'period')),
+            [('EXECUTED', date(2025, 3, 1)), ('SKIPPED', date(2025, 3, 1))],
+        )
+        self.assertEqual(ScheduledRuleExecution.objects.get(status='EXECUTED').rule, rule)
+        # El mes siguiente la regla vuelve a ejecutarse
+        execute_scheduled_rules(ScheduledRule.objects.filter(pk=rule.pk), date(2025, 4, 5))
+        self.assertEqual(self.transfers().count(), 4)
+
+    def test_concurrent_run_that_already_registered_the_rule_is_rolled_back(self):
+        self.create_rule('A primera')
+        second = self.create_rule('B segunda')
+        load_balances = tasks.load_balances
+
+        def register_concurrently(rules):
+            # Un shard en paralelo registra la segunda regla después de que este la leyó
+            ScheduledRuleExecution.objects.get_or_create(
+                rule=second, period=date(2025, 3, 1),
+                defaults={'run_date': RUN_DATE, 'status': ScheduledRuleExecution.Status.EXECUTED},
+            )
+            return load_balances(rules)
+
+        with mock.patch.object(tasks, 'load_balances', side_effect=register_concurrently):
+            metrics = self.run_rules()
+
+        self.assertEqual((metrics['executed'], metrics['skipped'], metrics['failed']), (1, 1, 0))
+        self.assertEqual(set(self.transfers().values_list('description', flat=True)),
+                         {'Auto: A primera (Salida)', 'Auto: A primera (Entrada)'})
+
+    def test_days_missing_in_short_months_run_on_the_last_day(self):
+        for day in (28, 29, 30, 31):
+            self.create_rule(f'Día {day}', schedule_day_of_month=day)
+        self.assertEqual(due_rules(date(2025, 2, 27)).count(), 0)
+        self.assertEqual(due_rules(date(2025, 2, 28)).count(), 4)
+        self.assertEqual(due_rules(date(2025, 4, 30)).count(), 2)
+
+        execute_scheduled_rules(due_rules(date(2025, 2, 28)), date(2025, 2, 28))
+        self.assertEqual(set(self.transfers().values_list('date', flat=True)), {date(2025, 2, 28)})
+        self.assertEqual(self.transfers().count(), 8)
+
+    def test_catch_up_runs_missed_periods_once(self):
+        self.create_rule('Día 5')
+        self.create_rule('Día 31', schedule_day_of_month=31)
+        # Reglas creadas después de la fecha a recuperar no se ejecutan retroactivamente
+        self.create_rule('Nueva', created_at=datetime(2025, 3, 20, tzinfo=dt_timezone.utc))
+
+        result = catch_up_scheduled_rules(since=date(2025, 2, 1), until=date(2025, 3, 10))
+        self.assertIn('2 períodos', result)
+        self.assertEqual(
+            sorted(self.transfers().filter(transaction_type=TransactionType.EXPENSE).values_list('date', flat=True)),
+            [date(2025, 2, 5), date(2025, 2, 28), date(2025, 3, 5)],
+        )
+        # Recuperar de nuevo el mismo rango no crea nada
+        catch_up_scheduled_rules(since=date(2025, 2, 1), until=date(2025, 3, 10))
+        self.assertEqual(self.transfers().count(), 6)
+
+    def test_catch_up_retries_rules_that_were_skipped(self):
+        self.create_rule('Alquiler', source_category=self.rent, action_type=ActionType.PERCENTAGE,
+                         action_fixed_amount=None, action_percentage=Decimal('50.00'))
+        self.run_rules()
+        self.assertEqual(ScheduledRuleExecution.objects.get().status, 'SKIPPED')
+
+        Transaction.objects.create(
+            account=self.account, category=self.rent, amount=Decimal('300.00'),
+            description='Reintegro', date=RUN_DATE, transaction_type=TransactionType.INCOME,
+        )
+        catch_up_scheduled_rules(since=date(2025, 3, 1), until=date(2025, 3, 10))
+        execution = ScheduledRuleExecution.objects.get()
+        self.assertEqual((execution.status, execution.amount), ('EXECUTED', Decimal('150.00')))
+        self.assertEqual(self.transfers().filter(date=RUN_DATE).count(), 2)
+
+        catch_up_scheduled_rules(since=date(2025, 3, 1), until=date(2025, 3, 10))
+        self.assertEqual(self.transfers().count(), 2)
+
+    def test_migration_backfills_creation_and_previous_runs(self):
+        backfill = import_module('apps.automation.migrations.0004_scheduledruleexecution').backfill_scheduled_rules
+        Account.objects.filter(pk=self.account.pk).update(created_at=datetime(2024, 12, 1, tzinfo=dt_timezone.utc))
+        self.account.refresh_from_db()
+        ran = self.create_rule('Ahorro', created_at=timezone.now())
+        never_ran = self.create_rule('Nueva', schedule_day_of_month=20, created_at=timezone.now())
+        # Transferencias que dejó el motor anterior, sin historial de ejecuciones
+        for day in (date(2025, 1, 5), date(2025, 2, 5)):
+            Transaction.objects.bulk_create(build_rule_transactions(ran, Decimal('100.00'), day))
+
+        backfill(django_apps, None)
+        for rule in (ran, never_ran):
+            rule.refresh_from_db()
+            self.assertEqual(rule.created_at, self.account.created_at)
+        self.assertEqual(
+            list(ScheduledRuleExecution.objects.order_by('period').values_list('rule', 'period', 'status')),
+            [(ran.id, date(2025, 1, 1), 'EXECUTED'), (ran.id, date(2025, 2, 1), 'EXECUTED')],
+        )
+
+        # La recuperación ejecuta lo que se perdió antes del deploy, sin repetir lo ya hecho
+        catch_up_scheduled_rules(since=date(2025, 2, 1), until=date(2025, 3, 20))
+        self.assertEqual(
+            sorted(self.transfers().filter(transaction_type=TransactionType.EXPENSE).values_list('description', 'date')),
+            [('Auto: Ahorro (Salida)', date(2025, 1, 5)), ('Auto: Ahorro (Salida)', date(2025, 2, 5)),
+             ('Auto: Ahorro (Salida)', date(2025, 3, 5)),
+             ('Auto: Nueva (Salida)', date(2025, 2, 20)), ('Auto: Nueva (Salida)', date(2025, 3, 20))],
+        )
+
+class ShardedScheduledRulesTests(ScheduledRuleTestCase):
+    """
+    El modo distribuido, con django-q en modo sync (cada tarea corre en el acto).
+    """
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(Conf, 'SYNC', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.accounts = [self.account] + [
+            Account.objects.create(name=f'Cuenta {i}', owner=self.user) for i in range(3)
+        ]
+        for account in self.accounts:
+            self.create_rule('Ahorro', account=account)
+
+    def test_partition_balances_rules_without_splitting_accounts(self):
+        shards = partition_accounts({1: 5, 2: 3, 3: 2, 4: 1}, 2)
+        self.assertEqual(shards, [[1, 4], [2, 3]])
+        self.assertEqual(partition_accounts({1: 5}, 4), [[1]])
+
+    def test_fan_out_runs_one_task_per_shard_and_a_summary(self):
+        group = run_scheduled_rules_sharded(shards=2, run_date=RUN_DATE)
+
+        shard_tasks = Task.objects.filter(group=group)
+        self.assertEqual(shard_tasks.count(), 2)
+        self.assertEqual(sum(task.result['executed'] for task in shard_tasks), 4)
+        summary = Task.objects.get(name=f"{group}-resumen")
+        self.assertTrue(summary.success)
+        self.assertIn('Ejecutadas exitosamente: 4.', summary.result)
+        self.assertEqual(Transaction.objects.filter(created_by_rule=True).count(), 8)
+
+    def test_failing_shard_does_not_abort_the_others(self):
+        # En modo sync django-q relanza la excepción de la tarea, así que el
+        # shard caído se simula con el registro que dejaría el cluster
+        group = 'reglas-programadas-test'
+        other_accounts = [account.id for account in self.accounts[1:]]
+        async_task(tasks.SHARD_TASK, other_accounts, RUN_DATE, shard=1, shards=2,
+                   group=group, hook=tasks.SHARD_HOOK)
+        self.assertFalse(Task.objects.filter(name=f"{group}-resumen").exists())
+
+        Task.objects.create(
+            id=uuid.uuid4().hex, name=f"{group}-shard-0", func=tasks.SHARD_TASK, group=group,
+            args=([self.account.id], RUN_DATE), kwargs={'shard': 0, 'shards': 2}, hook=tasks.SHARD_HOOK,
+            result='RuntimeError: shard caído', success=False, started=timezone.now(), stopped=timezone.now(),
+        )
+
+        summary = Task.objects.get(name=f"{group}-resumen")
+        self.assertIn('Ejecutadas exitosamente: 3.', summary.result)
+        self.assertIn('Shards con error: [0].', summary.result)
+        self.assertEqual(Transaction.objects.filter(created_by_rule=True).count(), 6)
+
+
+    def test_repeated_hooks_enqueue_a_single_summary(self):
+        group = run_scheduled_rules_sharded(shards=2, run_date=RUN_DATE)
+        # Un shard reintentado vuelve a disparar el hook después del resumen
+        tasks.collect_scheduled_rules_shard(Task.objects.filter(group=group).first())
+        self.assertEqual(Task.objects.filter(name=f"{group}-resumen").count(), 1)
+
+        # Con el cluster real el resumen queda en la cola hasta que un worker lo toma.
+        # Los registros se crean sin hook para llamarlo a mano, dos veces
+        group = 'reglas-programadas-cola'
+        for shard in range(2):
+            Task.objects.create(
+                id=uuid.uuid4().hex, name=f"{group}-shard-{shard}", func=tasks.SHARD_TASK, group=group,
+                args=([], RUN_DATE), kwargs={'shard': shard, 'shards': 2},
+                result={}, success=True, started=timezone.now(), stopped=timezone.now(),
+            )
+        with mock.patch.object(tasks, 'async_task') as enqueue:
+            for task in Task.objects.filter(group=group):
+                tasks.collect_scheduled_rules_shard(task)
+        enqueue.assert_called_once_with(tasks.SUMMARY_TASK, group, task_name=f"{group}-resumen")
+
+
+class EventRuleCacheTests(TestCase):
+    """
+    El índice de reglas de evento cacheado por cuenta y su invalidación.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user('owner@test.com', 'secret', first_name='Owner')
+        self.account = Account.objects.create(name='Cuenta', owner=self.user)
+        self.salary = Category.objects.create(name='Sueldo')
+        self.savings = Category.objects.create(name='Ahorro')
+
+    def create_rule(self):
+        return EventRule.objects.create(
+            account=self.account, name='Ahorro', created_by=self.user,
+            trigger_category=self.salary, trigger_transaction_type=TransactionType.INCOME,
+            action_type=ActionType.PERCENTAGE, action_destination_category=self.savings,
+            action_percentage=Decimal('10.00'),
+        )
+
+    def test_rule_writes_invalidate_the_index_on_commit(self):
+        self.assertEqual(get_event_rule_index(self.account.id), {})
+        with self.captureOnCommitCallbacks() as callbacks:
+            rule = self.create_rule()
+        # Antes del commit el índice cacheado no cambia: otro proceso no podría
+        # volver a cachear las reglas viejas después de la invalidación
+        self.assertEqual(get_event_rule_index(self.account.id), {})
+
+        for callback in callbacks:
+            callback()
+        self.assertEqual(get_matching_event_rules(self.account.id, self.salary.id, TransactionType.INCOME), [rule])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            rule.is_active = False
+            rule.save()
+        self.assertEqual(get_event_rule_index(self.account.id), {})
+
+    def test_deploy_check_requires_a_shared_cache(self):
+        self.assertEqual([warning.id for warning in check_shared_cache(None)], ['automation.W001'])
+        redis = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://cache:6379'}}
+        with override_settings(CACHES=redis):
+            self.assertEqual(check_shared_cache(None), [])
+
+
+class EventRuleExecutionTests(TestCase):
+    """
+    Una transacción que dispara varias reglas de evento escribe todas las
+    transacciones derivadas con un solo INSERT.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user('owner@test.com', 'secret', first_name='Owner')
+        self.account = Account.objects.create(name='Cuenta', owner=self.user)
+        self.salary = Category.objects.create(name='Sueldo')
+        self.savings = Category.objects.create(name='Ahorro')
+        self.taxes = Category.objects.create(name='Impuestos')
+
+    def create_rule(self, name, destination, **kwargs):
+        defaults = dict(
+            trigger_category=self.salary, trigger_transaction_type=TransactionType.INCOME,
+            action_type=ActionType.PERCENTAGE, action_percentage=Decimal('10.00'),
+        )
+        defaults.update(kwargs)
+        return EventRule.objects.create(
+            account=self.account, name=name, created_by=self.user,
+            action_destination_category=destination, **defaults
+        )
+
+    def create_salary(self, amount='1000.00'):
+        return Transaction.objects.create(
+            account=self.account, category=self.salary, amount=Decimal(amount),
+            description='Sueldo', date=RUN_DATE, transaction_type=TransactionType.INCOME,
+        )
+
+    def assertDerivedWithOneInsert(self, expected_queries):
+        # Índice de reglas ya cacheado, como en régimen
+        get_event_rule_index(self.account.id)
+        with self.assertNumQueries(expected_queries) as queries:
+            salary = self.create_salary()
+        inserts = [q['sql'] for q in queries.captured_queries
+                   if q['sql'].startswith('INSERT INTO "transactions_transaction"')]
+        self.assertEqual(len(inserts), 2, inserts)
+        return salary
+
+    def test_matching_rules_are_written_with_one_bulk_create(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_rule('Ahorro', self.savings)
+            self.create_rule('Impuestos', self.taxes, action_type=ActionType.FIXED,
+                             action_percentage=None, action_fixed_amount=Decimal('55.55'))
+            self.create_rule('Redondeo', self.savings, action_percentage=Decimal('0.05'))
+            # No coinciden: otro tipo, inactiva, monto cero
+            self.create_rule('Gasto', self.savings, trigger_transaction_type=TransactionType.EXPENSE)
+            self.create_rule('Inactiva', self.savings, is_active=False)
+            self.create_rule('Cero', self.savings, action_percentage=Decimal('0.00'))
+        salary = self.assertDerivedWithOneInsert(36)
+
+        derived = Transaction.objects.filter(created_by_rule=True).order_by('id')
+        self.assertEqual(
+            list(derived.values_list('category', 'amount', 'transaction_type', 'date', 'description')),
+            [
+                (self.savings.id, Decimal('100.00'), 'EXPENSE', RUN_DATE, 'Transferencia: Ahorro (Entrada)'),
+                (self.taxes.id, Decimal('55.55'), 'EXPENSE', RUN_DATE, 'Transferencia: Impuestos (Entrada)'),
+                (self.savings.id, Decimal('0.50'), 'EXPENSE', RUN_DATE, 'Transferencia: Redondeo (Entrada)'),
+            ],
+        )
+        self.assertTrue(all(t.account_id == salary.account_id for t in derived))
+        self.assertEqual(
+            dict(CategoryBalance.objects.filter(account=self.account).values_list('category', 'expense_total')),
+            {self.salary.id: Decimal('0.00'), self.savings.id: Decimal('100.50'), self.taxes.id: Decimal('55.55')},
+        )
+
+        # Con las filas de totales ya creadas, una regla más no agrega consultas
+        self.assertDerivedWithOneInsert(24)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_rule('Otra', self.taxes)
+        self.assertDerivedWithOneInsert(24)
+        self.assertEqual(Transaction.objects.filter(created_by_rule=True).count(), 10)
@@ -1,3 +1,4 @@
+from functools import partial
 from rest_framework import viewsets
 from .models import EventRule, ScheduledRule
 from .serializers import EventRuleSerializer, ScheduledRuleSerializer
@@ -23,6 +24,12 @@ class EventRuleViewSet(viewsets.ModelViewSet, AccountNestedViewMixin):
         account = self.get_account_object()
         return EventRule.objects.filter(account=account).order_by('name')
 
+    def list(self, request, *args, **kwargs):
+        """
+        Listado con ETag: responde 304 si las reglas de la cuenta no cambiaron.
+        """
+        return self.conditional_response(partial(super().list, request, *args, **kwargs))
+
     def perform_create(self, serializer):
         """
         Inyecta la cuenta (de la URL) y el creador (usuario logueado).
@@ -46,7 +53,16 @@ class ScheduledRuleViewSet(viewsets.ModelViewSet, AccountNestedViewMixin):
         Devuelve solo las reglas de la cuenta especificada en la URL.
         """
         account = self.get_account_object()
-        return ScheduledRule.objects.filter(account=account).order_by('name')
+        # 'account' y 'created_by' se serializan como texto: los traemos en la misma consulta
+        return ScheduledRule.objects.filter(account=account).select_related(
+            'account', 'created_by'
+        ).order_by('name')
+
+    def list(self, request, *args, **kwargs):
+        """
+        Listado con ETag: responde 304 si las reglas de la cuenta no cambiaron.
+        """
+        return self.conditional_response(partial(super().list, request, *args, **kwargs))
 
     def perform_create(self, serializer):
         """
@@ -1,10 +1,16 @@
 # apps/insights/admin.py
 from django.contrib import admin
-from .models import FinancialInsight
+from .models import FinancialInsight, InsightBatch
 
 @admin.register(FinancialInsight)
 class FinancialInsightAdmin(admin.ModelAdmin):
     list_display = ('user', 'title', 'generated_at', 'is_read')
     list_filter = ('is_read', 'generated_at')
     search_fields = ('user__email', 'title', 'message')
-    readonly_fields = ('user', 'title', 'message', 'generated_at')
\ No newline at end of file
+    readonly_fields = ('user', 'title', 'message', 'generated_at', 'fingerprint')
+
+@admin.register(InsightBatch)
+class InsightBatchAdmin(admin.ModelAdmin):
+    list_display = ('batch_id', 'status', 'created_at', 'completed_at', 'insights_created')
+    list_filter = ('status',)
+    readonly_fields = ('batch_id', 'fingerprints', 'created_at', 'completed_at', 'insights_created', 'error')
@@ -0,0 +1,180 @@
+# apps/insights/llm.py
+"""
+Llamadas concurrentes a la API de OpenAI para generar consejos: un pool de
+hilos acotado, un token bucket que limita las solicitudes por minuto y
+reintentos con backoff exponencial ante errores transitorios.
+
+Los hilos solo hacen las solicitudes HTTP; quien consume los resultados
+(la tarea) es el único que toca la base de datos.
+
+También arma y lee los archivos JSONL del modo por lotes (Batch API).
+"""
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import openai
+from django.conf import settings
+from openai import OpenAI
+
+# Errores que vale la pena reintentar: límite de uso, red, timeouts y 5xx
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.InternalServerError,
+)
+MAX_RETRY_DELAY = 60
+
+BATCH_ENDPOINT = '/v1/chat/completions'
+# Estados finales de un lote; 'expired' puede traer resultados parciales
+BATCH_FINISHED = ('completed', 'expired', 'failed', 'cancelled')
+
+
+class TokenBucket:
+    """
+    Limitador de tasa compartido por los hilos: se recargan 'rate' fichas por
+    segundo hasta 'capacity' y cada solicitud consume una.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Bloquea hasta que haya una ficha disponible."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def build_client():
+    """
+    Cliente de OpenAI según la configuración. Los reintentos los maneja
+    request_insight, así que se desactivan los del cliente.
+    """
+    return OpenAI(
+        api_key=settings.OPENAI_API_KEY,
+        base_url=settings.OPENAI_BASE_URL or None,
+        timeout=settings.INSIGHTS_REQUEST_TIMEOUT,
+        max_retries=0,
+    )
+
+
+def retry_delay(attempt, error):
+    """
+    Espera antes del reintento 'attempt' (desde 0): respeta el Retry-After
+    del servidor si lo envía; si no, backoff exponencial con jitter.
+    """
+    response = getattr(error, 'response', None)
+    retry_after = response.headers.get('retry-after') if response is not None else None
+    try:
+        if retry_after is not None:
+            return min(MAX_RETRY_DELAY, float(retry_after))
+    except ValueError:
+        pass
+    delay = settings.INSIGHTS_RETRY_BASE_DELAY * (2 ** attempt)
+    return min(MAX_RETRY_DELAY, delay * random.uniform(0.5, 1.5))
+
+
+def chat_body(messages, model=None):
+    """Cuerpo de la solicitud de chat, igual en el modo directo y por lotes."""
+    return {
+        "model": model or settings.INSIGHTS_MODEL,
+        "response_format": {"type": "json_object"},
+        "messages": messages,
+    }
+
+
+def request_insight(client, bucket, messages, model=None, max_retries=None):
+    """
+    Pide un consejo al modelo y devuelve el JSON de la respuesta como dict.
+    Cada intento (incluidos los reintentos) pasa por el token bucket.
+    """
+    max_retries = settings.INSIGHTS_MAX_RETRIES if max_retries is None else max_retries
+    for attempt in range(max_retries + 1):
+        bucket.acquire()
+        try:
+            response = client.chat.completions.create(**chat_body(messages, model))
+            return json.loads(response.choices[0].message.content)
+        except RETRYABLE_ERRORS as e:
+            if attempt == max_retries:
+                raise
+            time.sleep(retry_delay(attempt, e))
+
+
+def generate_insights(prompts, client=None, concurrency=None, requests_per_minute=None, max_retries=None):
+    """
+    Ejecuta las solicitudes de 'prompts' ({clave: mensajes}) con a lo sumo
+    'concurrency' en vuelo y respetando 'requests_per_minute'.
+    Genera (clave, dict del consejo, error) a medida que terminan; un error
+    en una solicitud no detiene a las demás.
+    """
+    client = client or build_client()
+    concurrency = concurrency or settings.INSIGHTS_CONCURRENCY
+    requests_per_minute = requests_per_minute or settings.INSIGHTS_REQUESTS_PER_MINUTE
+    # Ráfaga máxima: una ficha por hilo, para no saturar la API al arrancar
+    bucket = TokenBucket(requests_per_minute / 60, capacity=concurrency)
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='insights') as pool:
+        futures = {
+            pool.submit(request_insight, client, bucket, messages, max_retries=max_retries): key
+            for key, messages in prompts.items()
+        }
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                yield key, future.result(), None
+            except Exception as e:
+                yield key, None, e
+
+
+# --- Modo por lotes (Batch API) ---
+
+def build_batch_file(prompts):
+    """JSONL de la Batch API: una solicitud por línea, con la clave como custom_id."""
+    lines = [
+        json.dumps({"custom_id": str(key), "method": "POST", "url": BATCH_ENDPOINT, "body": chat_body(messages)})
+        for key, messages in prompts.items()
+    ]
+    return ("\n".join(lines) + "\n").encode()
+
+
+def submit_batch(client, prompts):
+    """Sube el JSONL y crea el lote. Devuelve el lote de OpenAI."""
+    input_file = client.files.create(file=('insights.jsonl', build_batch_file(prompts)), purpose='batch')
+    return client.batches.create(input_file_id=input_file.id, endpoint=BATCH_ENDPOINT, completion_window='24h')
+
+
+def read_batch_results(client, batch):
+    """
+    Genera (custom_id, dict del consejo, error) por cada línea de los
+    archivos de resultados y de errores de un lote terminado.
+    """
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+        for line in client.files.content(file_id).text.splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            response = record.get('response') or {}
+            if record.get('error') or response.get('status_code') != 200:
+                yield record['custom_id'], None, record.get('error') or response.get('body')
+                continue
+            try:
+                yield record['custom_id'], json.loads(response['body']['choices'][0]['message']['content']), None
+            except (KeyError, IndexError, TypeError, ValueError) as e:
+                yield record['custom_id'], None, e
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('insights', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='financialinsight',
+            name='fingerprint',
+            field=models.CharField(blank=True, default='', help_text='Huella de los gastos analizados; si no cambian, no se genera otro consejo', max_length=64),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('insights', '0002_financialinsight_fingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InsightBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('batch_id', models.CharField(help_text='Identificador del lote en OpenAI', max_length=100, unique=True)),
+                ('status', models.CharField(choices=[('SUBMITTED', 'Enviado'), ('COMPLETED', 'Completado'), ('FAILED', 'Fallido')], default='SUBMITTED', max_length=10)),
+                ('fingerprints', models.JSONField(default=dict, help_text='Huella de gastos de cada usuario del lote ({user_id: huella})')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('insights_created', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+            ],
+            options={
+                'verbose_name': 'Lote de Consejos',
+                'verbose_name_plural': 'Lotes de Consejos',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
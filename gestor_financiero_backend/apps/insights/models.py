@@ -28,6 +28,12 @@ class FinancialInsight(models.Model):
         default=False,
         help_text="Indica si el usuario ya vio este consejo"
     )
+    fingerprint = models.CharField(
+        max_length=64,
+        blank=True,
+        default='',
+        help_text="Huella de los gastos analizados; si no cambian, no se genera otro consejo"
+    )
 
     class Meta:
         verbose_name = "Consejo Financiero"
@@ -35,4 +41,37 @@ class FinancialInsight(models.Model):
         ordering = ['-generated_at'] # Mostrar los más nuevos primero
 
     def __str__(self):
-        return f"Consejo para {self.user.email} - {self.title}"
\ No newline at end of file
+        return f"Consejo para {self.user.email} - {self.title}"
+
+class InsightBatch(models.Model):
+    """
+    Un lote de consejos enviado a la Batch API de OpenAI. Guarda lo necesario
+    para procesar los resultados cuando el lote termine (en otra tarea).
+    """
+    class Status(models.TextChoices):
+        SUBMITTED = 'SUBMITTED', 'Enviado'
+        COMPLETED = 'COMPLETED', 'Completado'
+        FAILED = 'FAILED', 'Fallido'
+
+    batch_id = models.CharField(
+        max_length=100,
+        unique=True,
+        help_text="Identificador del lote en OpenAI"
+    )
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.SUBMITTED)
+    fingerprints = models.JSONField(
+        default=dict,
+        help_text="Huella de gastos de cada usuario del lote ({user_id: huella})"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    insights_created = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        verbose_name = "Lote de Consejos"
+        verbose_name_plural = "Lotes de Consejos"
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Lote {self.batch_id} ({self.get_status_display()})"
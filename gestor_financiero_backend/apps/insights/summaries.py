@@ -0,0 +1,146 @@
+# apps/insights/summaries.py
+"""
+Resumen compacto de la semana de cada cuenta para el prompt del análisis:
+totales por categoría con su variación contra la semana anterior y los
+gastos más repetidos, en lugar de la lista completa de transacciones.
+El payload se recorta hasta entrar en el presupuesto de tokens configurado.
+"""
+import hashlib
+import json
+import math
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+
+# Cantidad de elementos por lista que se prueban, de mayor a menor, hasta
+# que el payload entra en el presupuesto
+ITEM_LIMITS = (10, 5, 3, 1)
+OTHER_CATEGORIES = "Otras categorías"
+
+
+class TruncationStrategy:
+    # Las categorías que no entran se suman en una fila "Otras categorías"
+    COLLAPSE = 'collapse'
+    # Las categorías que no entran se descartan
+    DROP = 'drop'
+
+
+def estimate_tokens(data):
+    """Estimación de tokens de un payload: ~4 caracteres por token."""
+    return math.ceil(len(dumps(data)) / 4)
+
+
+def dumps(data):
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+
+def as_number(amount):
+    return float(amount.quantize(Decimal('0.01')))
+
+
+def significant(amount, digits):
+    """Redondea a 'digits' cifras significativas: 1234.56 -> '1.2e+03'."""
+    return f"{float(amount):.{digits}g}"
+
+
+class AccountWeekSummary:
+    """
+    Acumula las transacciones de una cuenta de las dos últimas semanas
+    ('start_date' marca el inicio de la semana actual).
+    """
+
+    def __init__(self, start_date):
+        self.start_date = start_date
+        self.current = defaultdict(lambda: [Decimal('0'), 0])    # (categoría, tipo) -> [total, cantidad]
+        self.previous = defaultdict(Decimal)                     # (categoría, tipo) -> total
+        self.descriptions = defaultdict(lambda: [Decimal('0'), 0])  # descripción de gasto -> [total, cantidad]
+
+    def add(self, day, description, category_name, amount, transaction_type):
+        key = (category_name or "Sin Categoría", transaction_type)
+        if day < self.start_date:
+            self.previous[key] += amount
+            return
+        self.current[key][0] += amount
+        self.current[key][1] += 1
+        if transaction_type == 'EXPENSE':
+            entry = self.descriptions[description.strip().lower() or "sin descripción"]
+            entry[0] += amount
+            entry[1] += 1
+
+    def __bool__(self):
+        # Sin movimientos en la semana actual no hay nada que analizar
+        return bool(self.current)
+
+    def total(self, transaction_type, period=None):
+        totals = self.previous if period == 'previous' else {key: value[0] for key, value in self.current.items()}
+        return sum((value for (_, kind), value in totals.items() if kind == transaction_type), Decimal('0'))
+
+    def weight(self):
+        return self.total('EXPENSE') + self.total('INCOME')
+
+    def render(self, limit, strategy):
+        """Resumen como dict, con a lo sumo 'limit' categorías y gastos principales."""
+        categories = sorted(self.current.items(), key=lambda item: (-item[1][0], item[0]))
+        rows = [
+            {
+                "categoria": category, "tipo": kind, "total": as_number(total), "cantidad": count,
+                "variacion": as_number(total - self.previous.get((category, kind), Decimal('0'))),
+            }
+            for (category, kind), (total, count) in categories[:limit]
+        ]
+        if strategy == TruncationStrategy.COLLAPSE:
+            # Una fila por tipo: sumar ingresos con gastos daría un total sin sentido
+            rest = defaultdict(lambda: [Decimal('0'), 0])
+            for (_, kind), (total, count) in categories[limit:]:
+                rest[kind][0] += total
+                rest[kind][1] += count
+            rows.extend(
+                {"categoria": OTHER_CATEGORIES, "tipo": kind, "total": as_number(total), "cantidad": count}
+                for kind, (total, count) in sorted(rest.items())
+            )
+        top_expenses = sorted(self.descriptions.items(), key=lambda item: (-item[1][0], item[0]))[:limit]
+        return {
+            "ingresos": as_number(self.total('INCOME')),
+            "gastos": as_number(self.total('EXPENSE')),
+            "gastos_semana_anterior": as_number(self.total('EXPENSE', 'previous')),
+            "categorias": rows,
+            "principales_gastos": [
+                {"descripcion": description, "total": as_number(total), "cantidad": count}
+                for description, (total, count) in top_expenses
+            ],
+        }
+
+
+def fingerprint(summaries, digits=None):
+    """
+    Huella de la semana de un usuario: los totales por cuenta y categoría
+    redondeados, así una semana casi igual a otra produce la misma huella.
+    """
+    digits = digits or settings.INSIGHTS_FINGERPRINT_DIGITS
+    key = sorted(
+        [name, category, kind, significant(total, digits)]
+        for name, summary in summaries.items()
+        for (category, kind), (total, _) in summary.current.items()
+    )
+    return hashlib.sha256(dumps(key).encode()).hexdigest()
+
+
+def build_payload(summaries, token_budget=None, strategy=None):
+    """
+    Arma el payload {nombre de la cuenta: resumen} de un usuario dentro del
+    presupuesto de tokens: primero achica las listas de cada cuenta y, si aun
+    así no entra, descarta las cuentas con menos movimiento.
+    """
+    token_budget = token_budget or settings.INSIGHTS_PROMPT_TOKEN_BUDGET
+    strategy = strategy or settings.INSIGHTS_PROMPT_TRUNCATION
+    for limit in ITEM_LIMITS:
+        payload = {name: summary.render(limit, strategy) for name, summary in summaries.items()}
+        if estimate_tokens(payload) <= token_budget:
+            return payload
+
+    # La cuenta con más movimiento siempre queda, aunque exceda el presupuesto
+    ranked = sorted(summaries, key=lambda name: summaries[name].weight(), reverse=True)
+    while len(ranked) > 1 and estimate_tokens(payload) > token_budget:
+        payload.pop(ranked.pop())
+    return payload
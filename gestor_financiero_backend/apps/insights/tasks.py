@@ -1,45 +1,149 @@
 # Importaciones de sistema
 import os
-import json
+from collections import defaultdict
 from datetime import datetime, timedelta
 
 # Importaciones de Django
 from django.conf import settings
+from django.db import transaction as db_transaction
 from django.utils import timezone
-
-# Importaciones de terceros
-from openai import OpenAI
+from django_q.models import Schedule
+from django_q.tasks import schedule
 
 # Importaciones de tu proyecto
 from apps.users.models import CustomUser, Membership
-from apps.transactions.models import Transaction, Category
-from .models import FinancialInsight
+from apps.transactions.models import Transaction
+from .llm import BATCH_FINISHED, RETRYABLE_ERRORS, build_client, generate_insights, read_batch_results, submit_batch
+from .summaries import AccountWeekSummary, build_payload, dumps, fingerprint
+from .models import FinancialInsight, InsightBatch
+
+SYSTEM_PROMPT = """
+            Eres un asesor financiero experto, amigable y proactivo. Tu cliente quiere consejos 
+            accionables para ahorrar dinero basados en sus gastos de la última semana.
+            
+            Te voy a pasar un JSON donde las claves son los nombres de las cuentas del 
+            cliente (ej: "Cuenta Personal", "Ahorros") y los valores son un resumen 
+            de la semana de esa cuenta: ingresos y gastos totales, los gastos de la 
+            semana anterior, los totales por categoría (con su "variacion" respecto 
+            de la semana anterior) y los gastos que más se repiten.
+            
+            Tu trabajo es analizar estos gastos de forma HOLÍSTICA. Busca patrones 
+            *entre* las cuentas. Por ejemplo:
+            - ¿Está usando la cuenta de "Ahorros" para gastos diarios?
+            - ¿Sus gastos de "Ocio" salen de la cuenta "Hogar Compartido"?
+            - ¿Está transfiriendo mucho dinero entre cuentas sin motivo aparente?
+            
+            Encuentra UN (1) patrón o consejo accionable basado en este análisis.
+            
+            Responde ÚNICAMENTE con un objeto JSON válido que siga esta estructura:
+            {"titulo": "Tu consejo de la semana", "mensaje": "He notado que... [tu consejo aquí]..."}
+            
+            El consejo debe ser corto, fácil de entender y positivo.
+            """
+
+# -----------------------------------------------------------------
+# --- Recolección de datos y armado del prompt ---
+# -----------------------------------------------------------------
+
+def collect_insight_data(users, start_date):
+    """
+    Devuelve {user_id: {nombre de la cuenta: AccountWeekSummary}} con el
+    resumen de la semana desde 'start_date' (y la anterior, para comparar)
+    de todas las cuentas de 'users' (un queryset).
+    Son dos consultas para todo el lote, sin importar cuántos usuarios o
+    cuentas haya: las membresías (con el alias y la cuenta) y las
+    transacciones de todas esas cuentas con su categoría.
+    """
+    memberships = Membership.objects.filter(user__in=users)
+
+    # Las transacciones se acumulan por cuenta sin guardar cada fila
+    summaries_by_account = {}
+    transactions = Transaction.objects.filter(
+        account_id__in=memberships.values('account_id'),
+        date__gte=start_date - timedelta(days=7)
+    ).order_by('account_id', 'date', 'id').values_list(
+        'account_id', 'date', 'description', 'category__name', 'amount', 'transaction_type'
+    )
+    for account_id, *row in transactions:
+        if account_id not in summaries_by_account:
+            summaries_by_account[account_id] = AccountWeekSummary(start_date)
+        summaries_by_account[account_id].add(*row)
+
+    # Este diccionario guardará los datos para el JSON final de cada usuario
+    data_by_user = defaultdict(dict)
+    for membership in memberships.select_related('account').order_by('user_id', 'account_id'):
+        summary = summaries_by_account.get(membership.account_id)
+        if not summary:
+            continue # Omitir esta cuenta si no tiene transacciones en la semana
+        # Nombre de visualización (alias) de la cuenta
+        account_display_name = membership.alias or membership.account.name
+        data_by_user[membership.user_id][account_display_name] = summary
+    return data_by_user
+
+
+def recent_fingerprints(users):
+    """
+    Devuelve {user_id: huellas} de los últimos INSIGHTS_CACHE_MAX_ENTRIES
+    consejos de cada usuario generados dentro de INSIGHTS_CACHE_TTL_DAYS.
+    Antes borra las huellas vencidas, que ya no se pueden reutilizar.
+    """
+    recent = defaultdict(list)
+    if not settings.INSIGHTS_CACHE_TTL_DAYS:
+        return recent
+    cutoff = timezone.now() - timedelta(days=settings.INSIGHTS_CACHE_TTL_DAYS)
+    insights = FinancialInsight.objects.filter(user__in=users).exclude(fingerprint='')
+    insights.filter(generated_at__lt=cutoff).update(fingerprint='')
+    rows = insights.filter(generated_at__gte=cutoff).order_by('user_id', '-generated_at').values_list('user_id', 'fingerprint')
+    for user_id, user_fingerprint in rows:
+        if len(recent[user_id]) < settings.INSIGHTS_CACHE_MAX_ENTRIES:
+            recent[user_id].append(user_fingerprint)
+    return recent
+
+
+def build_messages(datos_por_cuenta):
+    """
+    Mensajes de la solicitud al modelo para los resúmenes de un usuario,
+    recortados al presupuesto de tokens (INSIGHTS_PROMPT_TOKEN_BUDGET).
+    """
+    summary_json = dumps(build_payload(datos_por_cuenta))
+    user_prompt = f"Resumen semanal agrupado por cuenta: {summary_json}"
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": user_prompt}
+    ]
+
 
 # -----------------------------------------------------------------
 # --- La Tarea Principal de Análisis ---
 # -----------------------------------------------------------------
 
-def run_openai_analysis():
+def run_openai_analysis(client=None, mode=None):
     """
     Tarea principal (llamada por django-q) para generar consejos
     financieros usando la API de OpenAI.
     
     Esta versión agrupa las transacciones por cuenta para dar
-    un contexto holístico al LLM.
+    un contexto holístico al LLM. Los datos se preparan primero y las
+    solicitudes al modelo se hacen en paralelo (ver apps.insights.llm),
+    con concurrencia, límite por minuto y reintentos configurables.
+    Con mode='batch' (o INSIGHTS_MODE) las solicitudes se envían como un
+    lote a la Batch API y poll_insight_batch guarda los resultados.
     """
+    mode = mode or settings.INSIGHTS_MODE
     print(f"[{timezone.now()}] Iniciando Tarea de Análisis Semanal de OpenAI...")
     
     # 1. Configurar el Cliente de OpenAI
-    api_key = settings.OPENAI_API_KEY
-    if not api_key:
-        print("ERROR: OPENAI_API_KEY no encontrada. Abortando tarea.")
-        return "Error: API Key no configurada."
-    
-    try:
-        client = OpenAI(api_key=api_key)
-    except Exception as e:
-        print(f"Error al inicializar el cliente de OpenAI: {e}")
-        return
+    if client is None:
+        api_key = settings.OPENAI_API_KEY
+        if not api_key:
+            print("ERROR: OPENAI_API_KEY no encontrada. Abortando tarea.")
+            return "Error: API Key no configurada."
+
+        try:
+            client = build_client()
+        except Exception as e:
+            print(f"Error al inicializar el cliente de OpenAI: {e}")
+            return
         
     # 2. Obtener los usuarios a analizar (solo Premium)
     premium_users = CustomUser.objects.filter(role=CustomUser.Role.PREMIUM)
@@ -48,107 +152,137 @@ def run_openai_analysis():
         print("No se encontraron usuarios Premium para analizar.")
         return "No hay usuarios Premium."
 
-    # 3. Procesar a cada usuario
-    insights_generados = 0
+    # 3. Recopilar datos de la última semana de todos los usuarios de una vez
+    #    y armar un prompt por usuario
+    today = timezone.now().date()
+    start_date = today - timedelta(days=7)
+    data_by_user = collect_insight_data(premium_users, start_date)
+    known_fingerprints = recent_fingerprints(premium_users)
+    users_by_id, prompts, fingerprints, sin_cambios = {}, {}, {}, 0
     for user in premium_users:
+        datos_por_cuenta = data_by_user.get(user.id)
+        # Si no hay NINGUNA transacción en NINGUNA cuenta, omitir al usuario
+        if not datos_por_cuenta:
+            print(f"Usuario {user.email} no tiene transacciones en la última semana. Omitiendo.")
+            continue
+        # Si sus gastos no cambiaron desde un consejo reciente, ese consejo sigue vigente
+        user_fingerprint = fingerprint(datos_por_cuenta)
+        if user_fingerprint in known_fingerprints.get(user.id, ()):
+            print(f"Usuario {user.email} sin cambios desde su último consejo. Omitiendo.")
+            sin_cambios += 1
+            continue
         print(f"Procesando usuario: {user.email}")
-        try:
-            # 3.1. Recopilar datos de la última semana (¡NUEVA LÓGICA DE AGRUPACIÓN!)
-            today = timezone.now().date()
-            start_date = today - timedelta(days=7)
-            
-            # Este diccionario guardará los datos para el JSON final
-            datos_por_cuenta = {}
-
-            # Iteramos por cada cuenta a la que pertenece el usuario
-            for account in user.accounts.all():
-                
-                # Obtener el nombre de visualización (alias) de la cuenta
-                try:
-                    membership = Membership.objects.get(user=user, account=account)
-                    account_display_name = membership.alias if membership.alias else account.name
-                except Membership.DoesNotExist:
-                    account_display_name = account.name # Fallback
-                
-                # Buscar transacciones de la semana SOLO para esta cuenta
-                transactions = Transaction.objects.filter(
-                    account=account,
-                    date__gte=start_date
-                )
-
-                if not transactions.exists():
-                    continue # Omitir esta cuenta si no tiene transacciones
-
-                # Formatear y Anonimizar Datos de esta cuenta
-                transaction_list = []
-                for t in transactions:
-                    transaction_list.append({
-                        "fecha": t.date.strftime('%Y-%m-%d'),
-                        "descripcion": t.description,
-                        "categoria": t.category.name if t.category else "Sin Categoría",
-                        "monto": float(t.amount), # Convertir Decimal a float para JSON
-                        "tipo": t.transaction_type # INGRESO o GASTO
-                    })
-                
-                # Añadir la lista de transacciones al diccionario principal
-                datos_por_cuenta[account_display_name] = transaction_list
-            
-            # Si no hay NINGUNA transacción en NINGUNA cuenta, omitir al usuario
-            if not datos_por_cuenta:
-                print(f"Usuario {user.email} no tiene transacciones en la última semana. Omitiendo.")
-                continue
+        users_by_id[user.id] = user
+        prompts[user.id] = build_messages(datos_por_cuenta)
+        fingerprints[user.id] = user_fingerprint
 
-            # Convertir a string JSON
-            transaction_json = json.dumps(datos_por_cuenta, indent=2)
+    if mode == 'batch':
+        return submit_insight_batch(client, prompts, fingerprints, sin_cambios)
 
-            # 3.2. Ingeniería de Prompt (¡PROMPT ACTUALIZADO!)
-            system_prompt = f"""
-            Eres un asesor financiero experto, amigable y proactivo. Tu cliente quiere consejos 
-            accionables para ahorrar dinero basados en sus gastos de la última semana.
-            
-            Te voy a pasar un JSON donde las claves son los nombres de las cuentas del 
-            cliente (ej: "Cuenta Personal", "Ahorros") y los valores son una lista 
-            de transacciones de esa cuenta.
-            
-            Tu trabajo es analizar estos gastos de forma HOLÍSTICA. Busca patrones 
-            *entre* las cuentas. Por ejemplo:
-            - ¿Está usando la cuenta de "Ahorros" para gastos diarios?
-            - ¿Sus gastos de "Ocio" salen de la cuenta "Hogar Compartido"?
-            - ¿Está transfiriendo mucho dinero entre cuentas sin motivo aparente?
-            
-            Encuentra UN (1) patrón o consejo accionable basado en este análisis.
-            
-            Responde ÚNICAMENTE con un objeto JSON válido que siga esta estructura:
-            {{"titulo": "Tu consejo de la semana", "mensaje": "He notado que... [tu consejo aquí]..."}}
-            
-            El consejo debe ser corto, fácil de entender y positivo.
-            """
-            
-            user_prompt = f"Datos de transacciones agrupadas por cuenta: {transaction_json}"
-
-            # 3.3. Llamar a la API de OpenAI
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                response_format={"type": "json_object"},
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ]
-            )
-            
-            # 3.4. Parsear y Guardar la Respuesta
-            insight_data = json.loads(response.choices[0].message.content)
+    # 4. Llamar a la API en paralelo y guardar cada respuesta a medida que llega
+    insights_generados = 0
+    for user_id, insight_data, error in generate_insights(prompts, client=client):
+        user = users_by_id[user_id]
+        if error is not None:
+            print(f"ERROR al procesar al usuario {user.email}: {error}")
+            continue
+        FinancialInsight.objects.create(
+            user=user,
+            title=insight_data.get('titulo', 'Tu Consejo Semanal'),
+            message=insight_data.get('mensaje', 'No se pudo generar un consejo esta vez.'),
+            fingerprint=fingerprints[user_id]
+        )
+        insights_generados += 1
+        print(f"Consejo generado exitosamente para {user.email}.")
             
-            FinancialInsight.objects.create(
-                user=user,
-                title=insight_data.get('titulo', 'Tu Consejo Semanal'),
-                message=insight_data.get('mensaje', 'No se pudo generar un consejo esta vez.')
-            )
-            insights_generados += 1
-            print(f"Consejo generado exitosamente para {user.email}.")
+    print(f"[{timezone.now()}] Tarea completada. Se generaron {insights_generados} consejos "
+          f"({sin_cambios} usuarios sin cambios).")
+    return f"Se generaron {insights_generados} consejos. Sin cambios: {sin_cambios}."
 
-        except Exception as e:
-            print(f"ERROR al procesar al usuario {user.email}: {e}")
-            
-    print(f"[{timezone.now()}] Tarea completada. Se generaron {insights_generados} consejos.")
-    return f"Se generaron {insights_generados} consejos."
\ No newline at end of file
+
+# -----------------------------------------------------------------
+# --- Modo por lotes (Batch API) ---
+# -----------------------------------------------------------------
+
+def schedule_batch_poll(insight_batch):
+    """Programa una consulta del lote dentro de INSIGHTS_BATCH_POLL_INTERVAL segundos."""
+    next_run = timezone.now() + timedelta(seconds=settings.INSIGHTS_BATCH_POLL_INTERVAL)
+    # schedule() exige nombres únicos: cada consulta lleva su horario
+    schedule(
+        'apps.insights.tasks.poll_insight_batch',
+        insight_batch.pk,
+        name=f"Consultar lote {insight_batch.batch_id} {next_run:%Y-%m-%d %H:%M:%S.%f}",
+        schedule_type=Schedule.ONCE,
+        next_run=next_run,
+    )
+
+
+def submit_insight_batch(client, prompts, fingerprints, sin_cambios=0):
+    """
+    Envía todos los prompts como un único lote y programa la tarea que lo
+    consulta. El tiempo de la tarea ya no depende de la latencia de cada solicitud.
+    """
+    if not prompts:
+        return f"No hay consejos para generar. Sin cambios: {sin_cambios}."
+    batch = submit_batch(client, prompts)
+    insight_batch = InsightBatch.objects.create(
+        batch_id=batch.id,
+        fingerprints={str(user_id): fingerprints[user_id] for user_id in prompts},
+    )
+    schedule_batch_poll(insight_batch)
+    print(f"[{timezone.now()}] Lote {batch.id} enviado con {len(prompts)} solicitudes.")
+    return f"Lote {batch.id} enviado con {len(prompts)} solicitudes. Sin cambios: {sin_cambios}."
+
+
+def poll_insight_batch(insight_batch_id, client=None):
+    """
+    Tarea de django-q que consulta un lote enviado. Si todavía no terminó o
+    la API respondió con un error transitorio, se vuelve a programar; si terminó, guarda todos los consejos con un
+    bulk_create. Procesar dos veces el mismo lote no duplica consejos.
+    """
+    insight_batch = InsightBatch.objects.get(pk=insight_batch_id)
+    if insight_batch.status != InsightBatch.Status.SUBMITTED:
+        return f"Lote {insight_batch.batch_id} ya procesado."
+
+    client = client or build_client()
+    try:
+        batch = client.batches.retrieve(insight_batch.batch_id)
+        if batch.status not in BATCH_FINISHED:
+            schedule_batch_poll(insight_batch)
+            return f"Lote {batch.id} en curso ({batch.status})."
+        results = list(read_batch_results(client, batch))
+    except RETRYABLE_ERRORS as e:
+        # Un 429, 5xx o corte de red no debe cortar la cadena de consultas
+        print(f"ERROR transitorio al consultar el lote {insight_batch.batch_id}: {e}")
+        schedule_batch_poll(insight_batch)
+        return f"Lote {insight_batch.batch_id}: error transitorio, se vuelve a consultar."
+
+    insights, errors = [], 0
+    for custom_id, insight_data, error in results:
+        if error is not None or custom_id not in insight_batch.fingerprints:
+            print(f"ERROR en el lote {batch.id} para el usuario {custom_id}: {error}")
+            errors += 1
+            continue
+        insights.append(FinancialInsight(
+            user_id=int(custom_id),
+            title=insight_data.get('titulo', 'Tu Consejo Semanal'),
+            message=insight_data.get('mensaje', 'No se pudo generar un consejo esta vez.'),
+            fingerprint=insight_batch.fingerprints[custom_id]
+        ))
+    # Los usuarios borrados mientras el lote corría se descartan
+    existing = set(CustomUser.objects.filter(id__in=[i.user_id for i in insights]).values_list('id', flat=True))
+    insights = [insight for insight in insights if insight.user_id in existing]
+
+    status = InsightBatch.Status.COMPLETED if batch.status in ('completed', 'expired') else InsightBatch.Status.FAILED
+    with db_transaction.atomic():
+        # La actualización condicionada evita que dos consultas guarden el mismo lote
+        claimed = InsightBatch.objects.filter(pk=insight_batch.pk, status=InsightBatch.Status.SUBMITTED).update(
+            status=status, completed_at=timezone.now(), insights_created=len(insights),
+            error=f"{batch.status}: {errors} solicitudes con error" if errors or status == InsightBatch.Status.FAILED else '',
+        )
+        if not claimed:
+            return f"Lote {batch.id} ya procesado."
+        FinancialInsight.objects.bulk_create(insights)
+
+    print(f"[{timezone.now()}] Lote {batch.id} {batch.status}. Se generaron {len(insights)} consejos ({errors} con error).")
+    return f"Lote {batch.id}: se generaron {len(insights)} consejos. Con error: {errors}."
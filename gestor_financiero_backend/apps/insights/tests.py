@@ -1,3 +1,402 @@
-from django.test import TestCase
+import json
+import threading
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
-# Create your tests here.
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from django_q.models import Schedule
+from openai import OpenAI
+
+from apps.users.models import CustomUser, Account, Membership
+from apps.transactions.models import Category, Transaction
+from .llm import TokenBucket
+from .models import FinancialInsight, InsightBatch
+from .summaries import AccountWeekSummary, build_payload, estimate_tokens
+from .tasks import collect_insight_data, poll_insight_batch, run_openai_analysis
+
+
+class StubLLMServer(ThreadingHTTPServer):
+    """
+    Servidor local que imita /v1/chat/completions y la Batch API (archivos y
+    lotes). Registra cuántas solicitudes hubo y cuántas estuvieron en vuelo
+    a la vez. 'failures' es una lista de códigos HTTP a devolver en las
+    primeras solicitudes; los prompts que contienen 'Falla' responden siempre 500.
+    Un lote queda 'in_progress' en la primera consulta y termina en la segunda.
+    """
+    daemon_threads = True
+
+    def __init__(self, delay=0.0, failures=()):
+        super().__init__(('127.0.0.1', 0), StubLLMHandler)
+        self.delay = delay
+        self.failures = list(failures)
+        self.lock = threading.Lock()
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.files = {}
+        self.batches = {}
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+    def client(self):
+        return OpenAI(api_key='test', base_url=f'http://127.0.0.1:{self.server_port}/v1', max_retries=0)
+
+
+class StubLLMHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def complete(self, request):
+        """Respuesta (código, cuerpo) de una solicitud de chat."""
+        prompt = request['messages'][-1]['content']
+        if 'Falla' in prompt:
+            return 500, {'error': {'message': 'stub', 'type': 'stub'}}
+        content = json.dumps({'titulo': 'Consejo', 'mensaje': f'{len(prompt)} caracteres analizados'})
+        return 200, {
+            'id': 'chatcmpl-stub', 'object': 'chat.completion', 'created': 0, 'model': request['model'],
+            'choices': [{'index': 0, 'finish_reason': 'stop',
+                         'message': {'role': 'assistant', 'content': content}}],
+        }
+
+    def upload_file(self, body):
+        message = BytesParser().parsebytes(
+            f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body
+        )
+        content = next(part.get_payload(decode=True) for part in message.get_payload() if part.get_filename())
+        file_id = f'file-{len(self.server.files)}'
+        self.server.files[file_id] = content.decode()
+        self.send_json(200, {'id': file_id, 'object': 'file', 'bytes': len(content), 'created_at': 0,
+                             'filename': 'insights.jsonl', 'purpose': 'batch', 'status': 'processed'})
+
+    def batch_json(self, batch_id):
+        return {'object': 'batch', 'completion_window': '24h', 'created_at': 0,
+                'endpoint': '/v1/chat/completions', **self.server.batches[batch_id]}
+
+    def create_batch(self, request):
+        batch_id = f'batch-{len(self.server.batches)}'
+        self.server.batches[batch_id] = {
+            'id': batch_id, 'input_file_id': request['input_file_id'], 'status': 'validating', 'polls': 0,
+        }
+        self.send_json(200, self.batch_json(batch_id))
+
+    def retrieve_batch(self, batch_id):
+        batch = self.server.batches[batch_id]
+        batch['polls'] += 1
+        if batch['polls'] == 1:
+            batch['status'] = 'in_progress'
+        elif batch['status'] == 'in_progress':
+            output, errors = [], []
+            for line in self.server.files[batch['input_file_id']].splitlines():
+                request = json.loads(line)
+                self.server.requests.append(request['body'])
+                status, body = self.complete(request['body'])
+                record = {'id': f"req-{request['custom_id']}", 'custom_id': request['custom_id'],
+                          'response': {'status_code': status, 'body': body}, 'error': None}
+                (output if status == 200 else errors).append(json.dumps(record))
+            batch['output_file_id'], batch['error_file_id'] = f'{batch_id}-output', f'{batch_id}-errors'
+            self.server.files[batch['output_file_id']] = '\n'.join(output)
+            self.server.files[batch['error_file_id']] = '\n'.join(errors)
+            batch['status'] = 'completed'
+        self.send_json(200, self.batch_json(batch_id))
+
+    def do_GET(self):
+        with self.server.lock:
+            status = self.server.failures.pop(0) if self.server.failures else 200
+        if status != 200:
+            return self.send_json(status, {'error': {'message': 'stub', 'type': 'stub'}}, {'retry-after': '0'})
+        parts = self.path.strip('/').split('/')  # v1/batches/{id} o v1/files/{id}/content
+        if parts[1] == 'batches':
+            return self.retrieve_batch(parts[2])
+        content = self.server.files[parts[2]].encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if self.path.endswith('/files'):
+            return self.upload_file(body)
+        if self.path.endswith('/batches'):
+            return self.create_batch(json.loads(body))
+        request = json.loads(body)
+        with server.lock:
+            server.requests.append(request)
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            status = server.failures.pop(0) if server.failures else 200
+        try:
+            time.sleep(server.delay)
+            if status == 200:
+                status, payload = self.complete(request)
+            else:
+                payload = {'error': {'message': 'stub', 'type': 'stub'}}
+            self.send_json(status, payload, {'retry-after': '0'} if status != 200 else None)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+
+@override_settings(INSIGHTS_RETRY_BASE_DELAY=0, INSIGHTS_REQUESTS_PER_MINUTE=60000)
+class InsightPipelineTests(TestCase):
+    """
+    El pipeline concurrente de run_openai_analysis contra un servidor local.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Comida')
+        cls.users = [cls.create_premium_user(f'user{i}@test.com', f'Cuenta {i}') for i in range(4)]
+
+    @classmethod
+    def create_premium_user(cls, email, account_name):
+        user = CustomUser.objects.create_user(email, 'secret', first_name='User', role=CustomUser.Role.PREMIUM)
+        account = Account.objects.create(name=account_name, owner=user)
+        Membership.objects.create(user=user, account=account)
+        Transaction.objects.create(
+            account=account, category=cls.category, amount=Decimal('12.50'), description='Almuerzo',
+            date=timezone.now().date() - timedelta(days=1), transaction_type='EXPENSE',
+        )
+        return user
+
+    @override_settings(INSIGHTS_CONCURRENCY=2)
+    def test_requests_run_concurrently_within_the_limit(self):
+        with StubLLMServer(delay=0.1) as server:
+            result = run_openai_analysis(client=server.client())
+
+        self.assertEqual(result, 'Se generaron 4 consejos. Sin cambios: 0.')
+        self.assertEqual(FinancialInsight.objects.filter(title='Consejo').count(), 4)
+        self.assertEqual(server.max_in_flight, 2)
+
+    def test_transient_errors_are_retried(self):
+        with StubLLMServer(failures=[429, 503]) as server:
+            result = run_openai_analysis(client=server.client())
+
+        self.assertEqual(result, 'Se generaron 4 consejos. Sin cambios: 0.')
+        self.assertEqual(len(server.requests), 6)
+
+    @override_settings(INSIGHTS_MAX_RETRIES=1)
+    def test_a_failing_user_does_not_stop_the_others(self):
+        failing = self.create_premium_user('falla@test.com', 'Falla')
+        with StubLLMServer() as server:
+            result = run_openai_analysis(client=server.client())
+
+        self.assertEqual(result, 'Se generaron 4 consejos. Sin cambios: 0.')
+        self.assertFalse(FinancialInsight.objects.filter(user=failing).exists())
+        # El intento original más un reintento
+        self.assertEqual(sum('Falla' in r['messages'][-1]['content'] for r in server.requests), 2)
+
+    def test_unchanged_spending_reuses_the_recent_insight(self):
+        with StubLLMServer() as server:
+            run_openai_analysis(client=server.client())
+            # Un gasto mínimo no cambia la huella; uno grande sí
+            Transaction.objects.filter(account__owner=self.users[0]).update(amount=Decimal('12.40'))
+            Transaction.objects.filter(account__owner=self.users[1]).update(amount=Decimal('80.00'))
+            result = run_openai_analysis(client=server.client())
+
+        self.assertEqual(result, 'Se generaron 1 consejos. Sin cambios: 3.')
+        self.assertEqual(len(server.requests), 5)
+        self.assertEqual(FinancialInsight.objects.filter(user=self.users[1]).count(), 2)
+
+    @override_settings(INSIGHTS_CACHE_TTL_DAYS=7)
+    def test_fingerprints_expire_after_the_ttl(self):
+        with StubLLMServer() as server:
+            run_openai_analysis(client=server.client())
+            FinancialInsight.objects.filter(user=self.users[0]).update(generated_at=timezone.now() - timedelta(days=8))
+            result = run_openai_analysis(client=server.client())
+
+        self.assertEqual(result, 'Se generaron 1 consejos. Sin cambios: 3.')
+        # La huella vencida se descarta
+        self.assertEqual(
+            list(FinancialInsight.objects.filter(user=self.users[0]).order_by('generated_at').values_list('fingerprint', flat=True))[0],
+            '',
+        )
+
+    def test_batch_mode_submits_one_batch_and_polls_until_done(self):
+        failing = self.create_premium_user('falla@test.com', 'Falla')
+        with StubLLMServer() as server:
+            client = server.client()
+            result = run_openai_analysis(client=client, mode='batch')
+            self.assertEqual(result, 'Lote batch-0 enviado con 5 solicitudes. Sin cambios: 0.')
+            insight_batch = InsightBatch.objects.get()
+            self.assertEqual(Schedule.objects.filter(func='apps.insights.tasks.poll_insight_batch').count(), 1)
+            # Un solo archivo JSONL con una línea por usuario
+            self.assertEqual(len(server.files['file-0'].splitlines()), 5)
+
+            # Primera consulta: el lote sigue en curso y se reprograma
+            self.assertEqual(poll_insight_batch(insight_batch.pk, client=client), 'Lote batch-0 en curso (in_progress).')
+            self.assertFalse(FinancialInsight.objects.exists())
+            self.assertEqual(Schedule.objects.filter(func='apps.insights.tasks.poll_insight_batch').count(), 2)
+
+            # lote, usuarios existentes, UPDATE condicionado y un solo INSERT (más el savepoint)
+            with self.assertNumQueries(6):
+                result = poll_insight_batch(insight_batch.pk, client=client)
+            self.assertEqual(result, 'Lote batch-0: se generaron 4 consejos. Con error: 1.')
+            # Consultar de nuevo un lote ya procesado no duplica consejos
+            poll_insight_batch(insight_batch.pk, client=client)
+
+        self.assertEqual(FinancialInsight.objects.count(), 4)
+        self.assertFalse(FinancialInsight.objects.filter(user=failing).exists())
+        self.assertTrue(all(FinancialInsight.objects.values_list('fingerprint', flat=True)))
+        insight_batch.refresh_from_db()
+        self.assertEqual((insight_batch.status, insight_batch.insights_created), ('COMPLETED', 4))
+
+    def test_transient_poll_errors_reschedule_the_batch(self):
+        with StubLLMServer() as server:
+            client = server.client()
+            run_openai_analysis(client=client, mode='batch')
+            insight_batch = InsightBatch.objects.get()
+
+            # La primera consulta recibe un 503: el lote sigue pendiente y se reprograma
+            server.failures = [503]
+            result = poll_insight_batch(insight_batch.pk, client=client)
+            self.assertEqual(result, 'Lote batch-0: error transitorio, se vuelve a consultar.')
+            self.assertEqual(Schedule.objects.filter(func='apps.insights.tasks.poll_insight_batch').count(), 2)
+            insight_batch.refresh_from_db()
+            self.assertEqual(insight_batch.status, 'SUBMITTED')
+
+            # Un 429 al descargar los resultados tampoco pierde el lote
+            poll_insight_batch(insight_batch.pk, client=client)
+            server.failures = [200, 429]
+            self.assertEqual(poll_insight_batch(insight_batch.pk, client=client),
+                             'Lote batch-0: error transitorio, se vuelve a consultar.')
+            self.assertFalse(FinancialInsight.objects.exists())
+
+            result = poll_insight_batch(insight_batch.pk, client=client)
+        self.assertEqual(result, 'Lote batch-0: se generaron 4 consejos. Con error: 0.')
+        self.assertEqual(FinancialInsight.objects.count(), 4)
+        self.assertEqual(Schedule.objects.filter(func='apps.insights.tasks.poll_insight_batch').count(), 4)
+
+    def test_token_bucket_limits_the_request_rate(self):
+        bucket = TokenBucket(rate=20, capacity=1)
+        started = time.monotonic()
+        for _ in range(5):
+            bucket.acquire()
+        # La primera ficha está disponible; las otras cuatro llegan cada 50 ms
+        self.assertGreaterEqual(time.monotonic() - started, 0.19)
+
+
+class InsightDataCollectionTests(TestCase):
+    """
+    La recolección de datos del análisis semanal: pocas consultas para todo el lote.
+    """
+
+    def test_collects_all_users_with_a_fixed_number_of_queries(self):
+        today = timezone.now().date()
+        food = Category.objects.create(name='Comida')
+        users = [
+            CustomUser.objects.create_user(f'user{i}@test.com', 'secret', first_name='User', role=CustomUser.Role.PREMIUM)
+            for i in range(3)
+        ]
+        shared = Account.objects.create(name='Hogar', owner=users[0])
+        for i, user in enumerate(users):
+            Membership.objects.create(user=user, account=shared, alias='Casa' if i == 1 else None)
+            own = Account.objects.create(name=f'Personal {i}', owner=user)
+            Membership.objects.create(user=user, account=own)
+            for n in range(5):
+                Transaction.objects.create(
+                    account=own, category=food if n % 2 else None, amount=Decimal('10.00'), description=f'Gasto {n}',
+                    date=today - timedelta(days=n), transaction_type='EXPENSE',
+                )
+        Transaction.objects.create(
+            account=shared, category=food, amount=Decimal('30.00'), description='Supermercado',
+            date=today, transaction_type='EXPENSE',
+        )
+        # Una transacción vieja no entra en el análisis
+        Transaction.objects.create(
+            account=shared, category=food, amount=Decimal('99.00'), description='Vieja',
+            date=today - timedelta(days=30), transaction_type='EXPENSE',
+        )
+
+        with self.assertNumQueries(2):
+            data = collect_insight_data(CustomUser.objects.filter(role=CustomUser.Role.PREMIUM), today - timedelta(days=7))
+
+        self.assertEqual(set(data), {user.id for user in users})
+        self.assertEqual(set(data[users[0].id]), {'Hogar', 'Personal 0'})
+        # El alias de la membresía reemplaza al nombre de la cuenta
+        self.assertEqual(set(data[users[1].id]), {'Casa', 'Personal 1'})
+        self.assertEqual(data[users[2].id]['Hogar'].render(10, 'collapse')['principales_gastos'],
+                         [{'descripcion': 'supermercado', 'total': 30.0, 'cantidad': 1}])
+        self.assertEqual(
+            [(row['categoria'], row['total'], row['cantidad']) for row in data[users[0].id]['Personal 0'].render(10, 'collapse')['categorias']],
+            [('Sin Categoría', 30.0, 3), ('Comida', 20.0, 2)],
+        )
+
+
+class InsightPayloadTests(TestCase):
+    """
+    El resumen compacto que va en el prompt y su presupuesto de tokens.
+    """
+    START = date(2025, 3, 10)
+
+    def summary(self, categories=3, descriptions=3):
+        summary = AccountWeekSummary(self.START)
+        summary.add(self.START - timedelta(days=3), 'Súper', 'Categoría 0', Decimal('40.00'), 'EXPENSE')
+        summary.add(self.START, 'Sueldo', 'Sueldo', Decimal('1000.00'), 'INCOME')
+        for n in range(categories):
+            for d in range(descriptions):
+                summary.add(self.START + timedelta(days=d % 7), f'Comercio {n}-{d}', f'Categoría {n}',
+                            Decimal(100 - n) + Decimal('0.25'), 'EXPENSE')
+        return summary
+
+    def test_summary_totals_counts_and_week_over_week_delta(self):
+        rendered = self.summary().render(10, 'collapse')
+        self.assertEqual((rendered['ingresos'], rendered['gastos'], rendered['gastos_semana_anterior']),
+                         (1000.0, 893.25, 40.0))
+        self.assertEqual(rendered['categorias'][1], {
+            'categoria': 'Categoría 0', 'tipo': 'EXPENSE', 'total': 300.75, 'cantidad': 3, 'variacion': 260.75,
+        })
+        self.assertEqual(len(rendered['principales_gastos']), 9)
+
+    def test_collapsed_categories_keep_income_and_expense_apart(self):
+        summary = self.summary(categories=3, descriptions=1)
+        summary.add(self.START, 'Venta', 'Ventas', Decimal('50.00'), 'INCOME')
+        summary.add(self.START, 'Regalo', 'Regalos', Decimal('20.00'), 'INCOME')
+
+        rows = summary.render(2, 'collapse')['categorias']
+        self.assertEqual(rows[2:], [
+            {'categoria': 'Otras categorías', 'tipo': 'EXPENSE', 'total': 197.5, 'cantidad': 2},
+            {'categoria': 'Otras categorías', 'tipo': 'INCOME', 'total': 70.0, 'cantidad': 2},
+        ])
+
+    def test_payload_fits_the_token_budget(self):
+        summaries = {f'Cuenta {i}': self.summary(categories=40, descriptions=5) for i in range(3)}
+        self.assertGreater(estimate_tokens({name: s.render(100, 'collapse') for name, s in summaries.items()}), 5000)
+
+        payload = build_payload(summaries, token_budget=1500, strategy='collapse')
+        self.assertLessEqual(estimate_tokens(payload), 1500)
+        # Las categorías que no entran se suman en "Otras categorías" sin perder el total
+        rows = payload['Cuenta 0']['categorias']
+        self.assertEqual(rows[-1], {**rows[-1], 'categoria': 'Otras categorías', 'tipo': 'EXPENSE'})
+        self.assertAlmostEqual(sum(row['total'] for row in rows), 1000 + payload['Cuenta 0']['gastos'], places=2)
+
+        dropped = build_payload(summaries, token_budget=1500, strategy='drop')
+        self.assertNotIn('Otras categorías', [row['categoria'] for row in dropped['Cuenta 0']['categorias']])
+
+    def test_smallest_accounts_are_dropped_when_lists_are_not_enough(self):
+        summaries = {'Grande': self.summary(categories=5), 'Chica': self.summary(categories=1)}
+        payload = build_payload(summaries, token_budget=150, strategy='collapse')
+        self.assertEqual(list(payload), ['Grande'])
@@ -1,7 +1,10 @@
 from django.contrib import admin
-from .models import Category, Transaction
+from .models import Category, Transaction, CategoryBalance, DailyRollup, MonthlyRollup
 from apps.users.models import Account, CustomUser
 # Register your models here.
 
 admin.site.register(Category)
-admin.site.register(Transaction)
\ No newline at end of file
+admin.site.register(Transaction)
+admin.site.register(CategoryBalance)
+admin.site.register(DailyRollup)
+admin.site.register(MonthlyRollup)
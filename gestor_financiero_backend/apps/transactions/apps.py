@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class TransactionsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.transactions'
+
+    def ready(self):
+        # Registra los signals que invalidan el catálogo de categorías cacheado
+        import apps.transactions.signals
@@ -0,0 +1,58 @@
+# apps/transactions/category_cache.py
+"""
+Catálogo de categorías cacheado por cuenta: las categorías globales más las
+propias de la cuenta.
+
+La versión del catálogo vive en la base (Account.category_version) y se
+incrementa en la misma transacción que escribe la categoría. Así todos los
+procesos ven la misma versión, las claves viejas dejan de usarse sin tener
+que invalidar el caché, y la versión sirve también como ETag del catálogo.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F, Q
+from apps.transactions.models import Category
+from apps.users.models import Account
+
+# Se incrementa si cambia el formato de lo que guardamos en caché
+CACHE_KEY_VERSION = 2
+
+
+def _catalog_key(account):
+    return f"transactions:categories:v{CACHE_KEY_VERSION}:catalog:{account.pk}:{account.category_version}"
+
+
+def get_category_etag(account):
+    return f'"categories-{account.pk}-{account.category_version}"'
+
+
+def get_category_catalog(account):
+    """
+    Devuelve las categorías visibles para la cuenta (globales + propias),
+    como una lista de dicts {'id', 'name', 'account'} ordenada por nombre.
+    """
+    key = _catalog_key(account)
+    catalog = cache.get(key)
+    if catalog is None:
+        categories = Category.objects.filter(Q(account__isnull=True) | Q(account=account))
+        catalog = sorted(categories.values('id', 'name', 'account'),
+                         key=lambda category: (category['name'], category['id']))
+        cache.set(key, catalog, settings.CATEGORY_CACHE_TIMEOUT)
+    return catalog
+
+
+def get_category_index(account):
+    """
+    Devuelve {id: {'id', 'name', 'account'}} con las categorías válidas para la cuenta.
+    """
+    return {category['id']: category for category in get_category_catalog(account)}
+
+
+def invalidate_categories(account_id=None):
+    """
+    Incrementa la versión del catálogo de una cuenta, o la de todas si
+    account_id es None (una categoría global aparece en todos los catálogos).
+    Se llama dentro de la transacción que escribe la categoría.
+    """
+    accounts = Account.objects.all() if account_id is None else Account.objects.filter(pk=account_id)
+    accounts.update(category_version=F('category_version') + 1)
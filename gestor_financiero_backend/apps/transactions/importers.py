@@ -0,0 +1,240 @@
+# apps/transactions/importers.py
+"""
+Importación masiva de transacciones desde extractos bancarios (CSV u OFX).
+
+Los archivos se leen como streams, fila por fila, y se insertan en lotes
+con bulk_create, así que la memoria usada no depende del tamaño del archivo.
+La vista corre todo el import en una sola transacción: si el archivo está
+roto a mitad de camino, no queda importada solo una parte.
+"""
+import codecs
+import csv
+import re
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from django.db import transaction as db_transaction
+from .models import Transaction, apply_materialized_totals
+from .category_cache import get_category_catalog
+from apps.users.models import AccountChange, record_changes
+
+IMPORT_BATCH_SIZE = 1000
+# Para no devolver respuestas gigantes si un archivo entero es inválido
+MAX_REPORTED_ERRORS = 1000
+
+MAX_AMOUNT = Decimal('99999999.99')  # max_digits=10, decimal_places=2
+DATE_FORMATS = ('%Y-%m-%d', '%d/%m/%Y')
+TRANSACTION_TYPES = {'INCOME', 'EXPENSE'}
+
+OFX_TAG_RE = re.compile(r'<(/?)([A-Za-z0-9.]+)>([^<\r\n]*)')
+
+
+class ImportRowError(Exception):
+    pass
+
+
+class ImportFileError(Exception):
+    """
+    El archivo no se puede seguir leyendo desde 'row': se aborta el import entero.
+    """
+    def __init__(self, row, message):
+        super().__init__(message)
+        self.row = row
+
+
+def iter_text_lines(binary_file):
+    """
+    Decodifica el archivo línea por línea: UTF-8 (sin BOM) y, si una línea no
+    lo es, Latin-1, la codificación de los extractos de muchos bancos.
+    """
+    for number, line in enumerate(binary_file):
+        if number == 0 and line.startswith(codecs.BOM_UTF8):
+            line = line[len(codecs.BOM_UTF8):]
+        try:
+            yield line.decode('utf-8')
+        except UnicodeDecodeError:
+            yield line.decode('latin-1')
+
+
+def iter_csv_rows(binary_file):
+    """
+    Genera (número de fila, dict) para cada fila de un CSV con cabecera.
+    Columnas: date, description, amount, category y, opcionalmente, transaction_type.
+    """
+    reader = csv.DictReader(iter_text_lines(binary_file))
+    try:
+        if not reader.fieldnames:
+            return
+        reader.fieldnames = [name.strip().lower() for name in reader.fieldnames]
+        for row in reader:
+            yield reader.line_num, row
+    except csv.Error as e:
+        # DictReader.line_num solo avanza con las filas válidas; el reader de abajo
+        # ya contó la línea que falló.
+        line = reader.reader.line_num
+        raise ImportFileError(line, f"CSV inválido en la fila {line}: {e}.")
+
+
+def iter_ofx_rows(binary_file):
+    """
+    Genera (número de transacción, dict) para cada bloque <STMTTRN> de un archivo OFX.
+    Soporta tanto el formato SGML (OFX 1.x, sin etiquetas de cierre) como XML (OFX 2.x).
+    """
+    current = None
+    number = 0
+    for line in iter_text_lines(binary_file):
+        for closing, tag, value in OFX_TAG_RE.findall(line):
+            tag = tag.upper()
+            if tag == 'STMTTRN':
+                if closing:
+                    if current is not None:
+                        yield number, _ofx_to_row(current)
+                    current = None
+                else:
+                    number += 1
+                    current = {}
+            elif current is not None and not closing:
+                current[tag] = value.strip()
+
+
+def _ofx_to_row(fields):
+    posted = fields.get('DTPOSTED', '')[:8]
+    return {
+        'date': f"{posted[:4]}-{posted[4:6]}-{posted[6:8]}" if len(posted) == 8 else posted,
+        'description': fields.get('NAME') or fields.get('MEMO') or '',
+        'amount': fields.get('TRNAMT', ''),
+        'category': '',
+        'transaction_type': '',
+    }
+
+
+PARSERS = {
+    'csv': iter_csv_rows,
+    'ofx': iter_ofx_rows,
+}
+
+
+class TransactionImporter:
+    """
+    Valida e inserta filas de un extracto para una cuenta.
+    Las categorías válidas (globales + de la cuenta) salen del catálogo cacheado.
+    """
+
+    def __init__(self, account, default_category=None, batch_size=IMPORT_BATCH_SIZE):
+        self.account = account
+        self.batch_size = batch_size
+        self.categories_by_id = {}
+        self.categories_by_name = {}
+        # Las categorías de la cuenta tienen prioridad sobre las globales con el mismo nombre
+        categories = sorted(get_category_catalog(account), key=lambda category: category['account'] is None)
+        for category in categories:
+            self.categories_by_id[category['id']] = category['id']
+            self.categories_by_name.setdefault(category['name'].strip().lower(), category['id'])
+        self.default_category = self.resolve_category(default_category) if default_category else None
+
+        self.created = 0
+        self.rules_created = 0
+        self.error_count = 0
+        self.errors = []
+
+    def resolve_category(self, value):
+        value = str(value).strip()
+        if value.isdigit() and int(value) in self.categories_by_id:
+            return int(value)
+        category_id = self.categories_by_name.get(value.lower())
+        if category_id is None:
+            raise ImportRowError(f"Categoría '{value}' no encontrada para esta cuenta.")
+        return category_id
+
+    def build_transaction(self, row):
+        raw_date = (row.get('date') or '').strip()
+        for date_format in DATE_FORMATS:
+            try:
+                date = datetime.strptime(raw_date, date_format).date()
+                break
+            except ValueError:
+                continue
+        else:
+            raise ImportRowError(f"Fecha inválida: '{raw_date}'.")
+
+        raw_amount = (row.get('amount') or '').strip().replace(',', '.')
+        try:
+            amount = Decimal(raw_amount)
+        except InvalidOperation:
+            raise ImportRowError(f"Monto inválido: '{raw_amount}'.")
+        if not amount.is_finite() or amount == 0:
+            raise ImportRowError(f"Monto inválido: '{raw_amount}'.")
+
+        transaction_type = (row.get('transaction_type') or '').strip().upper()
+        if not transaction_type:
+            # Sin tipo explícito, el signo del monto decide (como en los extractos bancarios)
+            transaction_type = 'EXPENSE' if amount < 0 else 'INCOME'
+        elif transaction_type not in TRANSACTION_TYPES:
+            raise ImportRowError(f"Tipo inválido: '{transaction_type}'. Opciones: INCOME, EXPENSE.")
+
+        amount = abs(amount).quantize(Decimal('0.01'))
+        if amount > MAX_AMOUNT:
+            raise ImportRowError(f"Monto demasiado grande: '{raw_amount}'.")
+
+        description = (row.get('description') or '').strip()
+        if not description:
+            raise ImportRowError("La descripción es obligatoria.")
+
+        raw_category = (row.get('category') or '').strip()
+        if raw_category:
+            category_id = self.resolve_category(raw_category)
+        elif self.default_category:
+            category_id = self.default_category
+        else:
+            raise ImportRowError("La categoría es obligatoria.")
+
+        return Transaction(
+            account=self.account,
+            category_id=category_id,
+            amount=amount,
+            description=description[:255],
+            date=date,
+            transaction_type=transaction_type,
+        )
+
+    def add_error(self, row_number, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': row_number, 'error': message})
+
+    def run(self, rows):
+        batch = []
+        for row_number, row in rows:
+            try:
+                batch.append(self.build_transaction(row))
+            except ImportRowError as e:
+                self.add_error(row_number, str(e))
+                continue
+            if len(batch) >= self.batch_size:
+                self.save_batch(batch)
+                batch = []
+        if batch:
+            self.save_batch(batch)
+        return self
+
+    def save_batch(self, batch):
+        # Importación diferida: automation depende de transactions, no al revés
+        from apps.automation.signals import derive_rule_transactions
+
+        with db_transaction.atomic():
+            created = Transaction.objects.bulk_create(batch)
+            # bulk_create no emite post_save: evaluamos las reglas de evento acá, en lote
+            derived = [d for t in created for d in derive_rule_transactions(t)]
+            if derived:
+                derived = Transaction.objects.bulk_create(derived)
+            apply_materialized_totals(created + derived)
+            record_changes(AccountChange.Kind.TRANSACTION, created + derived)
+        self.created += len(created)
+        self.rules_created += len(derived)
+
+    def summary(self):
+        return {
+            'created': self.created,
+            'rules_created': self.rules_created,
+            'error_count': self.error_count,
+            'errors': self.errors,
+        }
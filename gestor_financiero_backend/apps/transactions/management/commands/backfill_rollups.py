@@ -0,0 +1,73 @@
+# apps/transactions/management/commands/backfill_rollups.py
+
+from decimal import Decimal
+from django.core.management.base import BaseCommand, CommandError
+from apps.users.models import Account
+from apps.transactions.models import DailyRollup, MonthlyRollup
+
+
+class Command(BaseCommand):
+    help = (
+        'Recalcula los rollups diarios y mensuales (DailyRollup / MonthlyRollup) '
+        'a partir de las transacciones y/o los verifica contra el agregado real.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--account',
+            type=int,
+            help='Id de la cuenta a procesar. Si se omite, se procesan todas.'
+        )
+        parser.add_argument(
+            '--verify-only',
+            action='store_true',
+            help='Solo compara los rollups guardados con el agregado, sin recalcularlos.'
+        )
+
+    def handle(self, *args, **options):
+        account = None
+        if options['account'] is not None:
+            try:
+                account = Account.objects.get(pk=options['account'])
+            except Account.DoesNotExist:
+                raise CommandError(f"Cuenta con id {options['account']} no encontrada.")
+
+        mismatches = 0
+        for model in (DailyRollup, MonthlyRollup):
+            name = model._meta.verbose_name_plural
+            if not options['verify_only']:
+                self.stdout.write(f"Recalculando {name}...")
+                rebuilt = model.objects.rebuild(account=account)
+                self.stdout.write(self.style.SUCCESS(f"Se generaron {rebuilt} filas."))
+            mismatches += self.verify(model, account)
+
+        if mismatches:
+            raise CommandError(f"Se encontraron {mismatches} rollups inconsistentes.")
+
+    def verify(self, model, account):
+        self.stdout.write(f"Verificando {model._meta.verbose_name_plural}...")
+        expected = model.objects.aggregate_from_transactions(account)
+
+        stored_qs = model.objects.all()
+        if account is not None:
+            stored_qs = stored_qs.filter(account=account)
+        # Puede haber más de una fila por clave cuando la categoría es nula, así que sumamos
+        stored = {}
+        for rollup in stored_qs:
+            key = (rollup.account_id, rollup.category_id, rollup.transaction_type, rollup.period)
+            total, count = stored.get(key, (Decimal('0.00'), 0))
+            stored[key] = (total + rollup.total, count + rollup.count)
+
+        zero = (Decimal('0.00'), 0)
+        mismatches = [
+            key for key in expected.keys() | stored.keys()
+            if expected.get(key, zero) != stored.get(key, zero)
+        ]
+        for key in sorted(mismatches, key=str):
+            self.stderr.write(self.style.ERROR(
+                f"{key}: esperado {expected.get(key, zero)}, guardado {stored.get(key, zero)}"
+            ))
+
+        if not mismatches:
+            self.stdout.write(self.style.SUCCESS(f"Las {len(expected)} filas coinciden con las transacciones."))
+        return len(mismatches)
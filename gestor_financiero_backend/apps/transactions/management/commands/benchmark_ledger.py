@@ -0,0 +1,207 @@
+# apps/transactions/management/commands/benchmark_ledger.py
+
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Sum, Q
+from django.utils import timezone
+from apps.users.models import CustomUser, Account, Membership
+from apps.transactions.models import Transaction, Category, rebuild_materialized_totals
+from apps.automation.models import EventRule, ScheduledRule, TransactionType, ActionType
+
+BENCH_EMAIL = 'benchmark@gestor.local'
+
+
+class Command(BaseCommand):
+    help = (
+        'Siembra un historial grande de transacciones en una cuenta de prueba y mide '
+        'los planes de ejecución y tiempos de las consultas más usadas, '
+        'sin los índices compuestos (antes) y con ellos (después). '
+        'Por defecto corre sobre una base de prueba descartable, creada como lo hace el test runner.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000, help='Cantidad de transacciones a sembrar.')
+        parser.add_argument('--batch-size', type=int, default=10_000, help='Tamaño de cada bulk_create.')
+        parser.add_argument('--repeat', type=int, default=5, help='Repeticiones por consulta para medir el tiempo.')
+        parser.add_argument('--seed', type=int, default=42, help='Semilla para los datos aleatorios.')
+        parser.add_argument('--keep', action='store_true',
+                            help='No borrar los datos sembrados (ni la base de prueba) al terminar.')
+        parser.add_argument('--configured-database', action='store_true',
+                            help='Correr sobre la base configurada en vez de una base de prueba.')
+        parser.add_argument('--allow-schema-changes', action='store_true',
+                            help='Permite --configured-database con DEBUG apagado: el benchmark '
+                                 'borra y recrea los índices de las tablas.')
+
+    def handle(self, *args, **options):
+        if not options['configured_database']:
+            # Misma base descartable que usa `manage.py test`: los índices que se
+            # quitan y los datos sembrados nunca tocan la base real
+            old_name = connection.settings_dict['NAME']
+            connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options['keep'], serialize=False)
+            try:
+                self.run_benchmark(options)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keep'])
+            return
+
+        if not settings.DEBUG and not options['allow_schema_changes']:
+            raise CommandError(
+                "El benchmark borra y recrea índices de la base configurada. "
+                "Solo corre con DEBUG activo o con --allow-schema-changes."
+            )
+        self.run_benchmark(options)
+
+    def run_benchmark(self, options):
+        rng = random.Random(options['seed'])
+        user, account, categories = self.prepare_account()
+
+        existing = Transaction.objects.filter(account=account).count()
+        if existing < options['rows']:
+            self.seed_transactions(account, categories, options['rows'] - existing, options['batch_size'], rng)
+            rebuild_materialized_totals(account=account)
+        self.stdout.write(f"Cuenta de benchmark con {Transaction.objects.filter(account=account).count()} transacciones.")
+
+        queries = self.hot_queries(account, categories)
+        indexed_models = [Transaction, EventRule, ScheduledRule]
+
+        # --- Antes: quitamos temporalmente los índices declarados en Meta.indexes ---
+        with connection.schema_editor() as editor:
+            for model in indexed_models:
+                for index in model._meta.indexes:
+                    editor.remove_index(model, index)
+        try:
+            before = self.measure(queries, options['repeat'])
+        finally:
+            with connection.schema_editor() as editor:
+                for model in indexed_models:
+                    for index in model._meta.indexes:
+                        editor.add_index(model, index)
+
+        # --- Después: con los índices compuestos ---
+        after = self.measure(queries, options['repeat'])
+
+        self.stdout.write("")
+        self.stdout.write(f"{'Consulta':<32}{'Antes (ms)':>14}{'Después (ms)':>16}{'Mejora':>10}")
+        for name in queries:
+            speedup = before[name]['ms'] / after[name]['ms'] if after[name]['ms'] else float('inf')
+            self.stdout.write(f"{name:<32}{before[name]['ms']:>14.2f}{after[name]['ms']:>16.2f}{speedup:>9.1f}x")
+
+        for name in queries:
+            self.stdout.write("")
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write("  Antes:   " + before[name]['plan'].replace('\n', '\n           '))
+            self.stdout.write("  Después: " + after[name]['plan'].replace('\n', '\n           '))
+
+        if not options['keep']:
+            self.stdout.write("")
+            self.stdout.write("Eliminando los datos de benchmark...")
+            user.delete()
+
+        self.stdout.write(self.style.SUCCESS("¡Benchmark finalizado!"))
+
+    def prepare_account(self):
+        user, created = CustomUser.objects.get_or_create(
+            email=BENCH_EMAIL,
+            defaults={'first_name': 'Benchmark', 'role': CustomUser.Role.PREMIUM},
+        )
+        if created:
+            user.set_unusable_password()
+            user.save()
+
+        account, created = Account.objects.get_or_create(name='Benchmark', owner=user)
+        if created:
+            Membership.objects.create(user=user, account=account)
+
+        # Categorías propias de la cuenta para no ensuciar las globales
+        names = ['Sueldo', 'Alquiler', 'Comida', 'Ocio', 'Transporte', 'Ahorro']
+        categories = {
+            name: Category.objects.get_or_create(name=name, account=account)[0]
+            for name in names
+        }
+
+        if not EventRule.objects.filter(account=account).exists():
+            EventRule.objects.create(
+                account=account,
+                name='Ahorro del sueldo',
+                created_by=user,
+                trigger_category=categories['Sueldo'],
+                trigger_transaction_type=TransactionType.INCOME,
+                action_type=ActionType.PERCENTAGE,
+                action_destination_category=categories['Ahorro'],
+                action_percentage=Decimal('10.00'),
+            )
+        if not ScheduledRule.objects.filter(account=account).exists():
+            ScheduledRule.objects.create(
+                account=account,
+                name='Mover ahorro',
+                created_by=user,
+                schedule_day_of_month=1,
+                source_category=categories['Sueldo'],
+                action_type=ActionType.PERCENTAGE,
+                action_destination_category=categories['Ahorro'],
+                action_percentage=Decimal('5.00'),
+            )
+        return user, account, categories
+
+    def seed_transactions(self, account, categories, total, batch_size, rng):
+        self.stdout.write(f"Sembrando {total} transacciones en lotes de {batch_size}...")
+        today = timezone.now().date()
+        expense_categories = [categories[name] for name in ('Alquiler', 'Comida', 'Ocio', 'Transporte')]
+        days_of_history = 365 * 5
+
+        created = 0
+        while created < total:
+            batch = []
+            for _ in range(min(batch_size, total - created)):
+                is_income = rng.random() < 0.05
+                batch.append(Transaction(
+                    account=account,
+                    category=categories['Sueldo'] if is_income else rng.choice(expense_categories),
+                    amount=Decimal(rng.randint(100, 500_000)) / 100,
+                    description='Ingreso' if is_income else 'Gasto',
+                    date=today - timedelta(days=rng.randint(0, days_of_history)),
+                    transaction_type=TransactionType.INCOME if is_income else TransactionType.EXPENSE,
+                ))
+            Transaction.objects.bulk_create(batch)
+            created += len(batch)
+            self.stdout.write(f"  {created}/{total}")
+
+    def hot_queries(self, account, categories):
+        """
+        Consultas equivalentes a las de los caminos calientes de la aplicación.
+        """
+        today = timezone.now().date()
+        return {
+            'listado (primera página)': lambda: Transaction.objects.filter(
+                account=account).order_by('-date', '-id')[:50],
+            'rango semanal (insights)': lambda: Transaction.objects.filter(
+                account=account, date__gte=today - timedelta(days=7)),
+            'balance por categoría': lambda: Transaction.objects.filter(
+                account=account, category=categories['Sueldo']).values('account').annotate(
+                income_total=Sum('amount', filter=Q(transaction_type=TransactionType.INCOME)),
+                expense_total=Sum('amount', filter=Q(transaction_type=TransactionType.EXPENSE)),
+            ),
+            'reglas de evento (signal)': lambda: EventRule.objects.filter(
+                account=account, is_active=True, trigger_category=categories['Sueldo'],
+                trigger_transaction_type=TransactionType.INCOME),
+            'reglas programadas del día': lambda: ScheduledRule.objects.filter(
+                is_active=True, schedule_day_of_month=today.day),
+        }
+
+    def measure(self, queries, repeat):
+        results = {}
+        for name, build in queries.items():
+            plan = build().explain()
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                list(build())
+                timings.append((time.perf_counter() - start) * 1000)
+            timings.sort()
+            results[name] = {'plan': plan, 'ms': timings[len(timings) // 2]}
+        return results
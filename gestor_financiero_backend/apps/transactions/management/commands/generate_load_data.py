@@ -0,0 +1,264 @@
+# apps/transactions/management/commands/generate_load_data.py
+
+import multiprocessing
+import random
+from datetime import timedelta
+from decimal import Decimal
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+from apps.users.models import CustomUser, Account, Membership, AccountChange, record_changes
+from apps.transactions.models import Transaction, Category, rebuild_materialized_totals
+from apps.automation.models import EventRule, ScheduledRule, TransactionType, ActionType
+
+# Categorías globales y su perfil de gasto: (peso relativo, mediana del monto, dispersión lognormal)
+EXPENSE_PROFILE = {
+    'Comida': (40, 450, 0.6),
+    'Transporte': (25, 250, 0.5),
+    'Ocio': (15, 900, 0.8),
+    'Servicios': (8, 3500, 0.4),
+    'Salud': (5, 2000, 0.9),
+    'Alquiler': (2, 15000, 0.2),
+}
+INCOME_CATEGORY = 'Sueldo'
+SAVINGS_CATEGORY = 'Ahorro'
+DESCRIPTIONS = {
+    'Comida': ["Supermercado", "Almuerzo oficina", "Café", "Delivery", "Panadería"],
+    'Transporte': ["Boleto", "Uber", "Nafta", "Peaje", "Estacionamiento"],
+    'Ocio': ["Cine", "Salida con amigos", "Compra online", "Streaming", "Recital"],
+    'Servicios': ["Luz", "Agua", "Internet", "Celular", "Gas"],
+    'Salud': ["Farmacia", "Consulta médica", "Mutualista"],
+    'Alquiler': ["Pago Alquiler"],
+}
+INCOME_RATIO = 0.04
+
+
+def _amount(rng, median, sigma):
+    """
+    Monto lognormal redondeado a centavos, construido desde enteros
+    (mucho más barato que Decimal(float).quantize fila por fila).
+    """
+    cents = max(100, int(rng.lognormvariate(0, sigma) * median * 100))
+    return Decimal(cents).scaleb(-2)
+
+
+def generate_chunk(task):
+    """
+    Genera e inserta un bloque de transacciones de una cuenta.
+    Cada bloque usa su propia semilla derivada, así el resultado es el
+    mismo sin importar cuántos procesos lo ejecuten ni en qué orden.
+    """
+    account_id, account_rank, chunk_index, count, seed, history_days, category_ids, batch_size = task
+    # La semilla usa la posición de la cuenta y no su id, que cambia entre ejecuciones
+    rng = random.Random(f"{seed}:{account_rank}:{chunk_index}")
+    today = timezone.now().date()
+
+    expense_names = list(EXPENSE_PROFILE)
+    expense_weights = [EXPENSE_PROFILE[name][0] for name in expense_names]
+
+    batch = []
+    for _ in range(count):
+        # Más movimiento reciente que antiguo, acotado al historial pedido
+        days_ago = min(int(rng.expovariate(3 / history_days)), history_days - 1)
+        if rng.random() < INCOME_RATIO:
+            category = INCOME_CATEGORY
+            amount = _amount(rng, 50000, 0.3)
+            description = "Ingreso de Sueldo"
+            transaction_type = TransactionType.INCOME
+        else:
+            category = rng.choices(expense_names, weights=expense_weights)[0]
+            _, median, sigma = EXPENSE_PROFILE[category]
+            amount = _amount(rng, median, sigma)
+            description = rng.choice(DESCRIPTIONS[category])
+            transaction_type = TransactionType.EXPENSE
+        batch.append(Transaction(
+            account_id=account_id,
+            category_id=category_ids[category],
+            amount=amount,
+            description=description,
+            date=today - timedelta(days=days_ago),
+            transaction_type=transaction_type,
+        ))
+    created = Transaction.objects.bulk_create(batch, batch_size=batch_size)
+    record_changes(AccountChange.Kind.TRANSACTION, created)
+    return count
+
+
+def _worker_init():
+    # Los procesos hijos no deben reutilizar las conexiones heredadas del padre
+    import django
+    django.setup()
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    help = (
+        'Genera datos sintéticos a escala de producción para pruebas de carga: '
+        'usuarios, cuentas compartidas, categorías, reglas y millones de transacciones. '
+        'Complementa a seed_transactions, que solo siembra una cuenta de ejemplo.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100, help='Cantidad de usuarios a crear.')
+        parser.add_argument('--accounts', type=int, default=200, help='Cantidad de cuentas a crear.')
+        parser.add_argument('--members-per-account', type=int, default=2, help='Miembros extra por cuenta (además del dueño).')
+        parser.add_argument('--categories-per-account', type=int, default=3, help='Categorías propias por cuenta.')
+        parser.add_argument('--event-rules', type=int, default=2, help='Reglas de evento por cuenta.')
+        parser.add_argument('--scheduled-rules', type=int, default=2, help='Reglas programadas por cuenta.')
+        parser.add_argument('--transactions', type=int, default=1_000_000, help='Total de transacciones a generar.')
+        parser.add_argument('--history-days', type=int, default=730, help='Días de historial hacia atrás.')
+        parser.add_argument('--batch-size', type=int, default=10_000, help='Filas por bulk_create.')
+        parser.add_argument('--workers', type=int, default=1, help='Procesos en paralelo (usar 1 con SQLite).')
+        parser.add_argument('--seed', type=int, default=42, help='Semilla para resultados reproducibles.')
+        parser.add_argument('--prefix', type=str, default='load', help='Prefijo de los emails generados.')
+        parser.add_argument('--reset', action='store_true', help='Borra antes los datos generados con el mismo prefijo.')
+        parser.add_argument('--skip-totals', action='store_true', help='No recalcular saldos ni rollups al terminar.')
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['accounts'] < 1:
+            raise CommandError("Se necesita al menos un usuario y una cuenta.")
+        rng = random.Random(options['seed'])
+        email_domain = f"@{options['prefix']}.test"
+
+        existing = CustomUser.objects.filter(email__endswith=email_domain)
+        if existing.exists():
+            if not options['reset']:
+                raise CommandError(f"Ya existen usuarios '{email_domain}'. Use --reset para regenerarlos.")
+            self.stdout.write("Borrando datos generados anteriormente...")
+            existing.delete()
+
+        category_ids = self.prepare_global_categories()
+        users = self.create_users(options, email_domain)
+        accounts = self.create_accounts(options, users, rng)
+        self.create_custom_categories(options, accounts)
+        self.create_rules(options, accounts, category_ids, rng)
+        self.create_transactions(options, accounts, category_ids, rng)
+
+        if not options['skip_totals']:
+            self.stdout.write("Recalculando saldos y rollups...")
+            rebuild_materialized_totals()
+
+        self.stdout.write(self.style.SUCCESS("¡Datos de carga generados exitosamente!"))
+
+    def prepare_global_categories(self):
+        names = list(EXPENSE_PROFILE) + [INCOME_CATEGORY, SAVINGS_CATEGORY]
+        return {
+            name: Category.objects.get_or_create(name=name, account=None)[0].id
+            for name in names
+        }
+
+    def create_users(self, options, email_domain):
+        self.stdout.write(f"Creando {options['users']} usuarios...")
+        # Un único hash para todos: calcularlo por usuario es lo más lento de esta etapa
+        password = make_password('loadtest')
+        users = [
+            CustomUser(
+                email=f"user{i}{email_domain}",
+                first_name=f"Usuario {i}",
+                password=password,
+                role=CustomUser.Role.PREMIUM if i % 5 == 0 else CustomUser.Role.NORMAL,
+            )
+            for i in range(options['users'])
+        ]
+        CustomUser.objects.bulk_create(users, batch_size=options['batch_size'])
+        return list(CustomUser.objects.filter(email__endswith=email_domain).order_by('id'))
+
+    def create_accounts(self, options, users, rng):
+        self.stdout.write(f"Creando {options['accounts']} cuentas con sus miembros...")
+        owners = [users[i % len(users)] for i in range(options['accounts'])]
+        Account.objects.bulk_create(
+            [Account(name=f"Cuenta {i}", owner=owner) for i, owner in enumerate(owners)],
+            batch_size=options['batch_size']
+        )
+        accounts = list(Account.objects.filter(owner__in=users).order_by('id'))
+
+        memberships = []
+        extra = min(options['members_per_account'], len(users) - 1)
+        for account in accounts:
+            memberships.append(Membership(user_id=account.owner_id, account=account))
+            candidates = [u for u in rng.sample(users, min(len(users), extra + 1)) if u.id != account.owner_id]
+            for member in candidates[:extra]:
+                memberships.append(Membership(
+                    user=member,
+                    account=account,
+                    alias=f"Compartida {account.id}" if rng.random() < 0.3 else None,
+                ))
+        Membership.objects.bulk_create(memberships, batch_size=options['batch_size'])
+        return accounts
+
+    def create_custom_categories(self, options, accounts):
+        created = Category.objects.bulk_create([
+            Category(name=f"Propia {n}", account=account)
+            for account in accounts
+            for n in range(options['categories_per_account'])
+        ], batch_size=options['batch_size'])
+        record_changes(AccountChange.Kind.CATEGORY, created)
+
+    def create_rules(self, options, accounts, category_ids, rng):
+        self.stdout.write("Creando reglas de evento y programadas...")
+        event_rules, scheduled_rules = [], []
+        for account in accounts:
+            for n in range(options['event_rules']):
+                event_rules.append(EventRule(
+                    account=account,
+                    name=f"Ahorro {n}",
+                    created_by_id=account.owner_id,
+                    trigger_category_id=category_ids[INCOME_CATEGORY],
+                    trigger_transaction_type=TransactionType.INCOME,
+                    action_type=ActionType.PERCENTAGE,
+                    action_destination_category_id=category_ids[SAVINGS_CATEGORY],
+                    action_percentage=Decimal(rng.randint(5, 20)),
+                ))
+            for n in range(options['scheduled_rules']):
+                scheduled_rules.append(ScheduledRule(
+                    account=account,
+                    name=f"Programada {n}",
+                    created_by_id=account.owner_id,
+                    schedule_day_of_month=rng.randint(1, 31),
+                    source_category_id=category_ids[INCOME_CATEGORY],
+                    action_type=ActionType.FIXED,
+                    action_destination_category_id=category_ids[SAVINGS_CATEGORY],
+                    action_fixed_amount=Decimal(rng.randint(10, 500) * 100),
+                ))
+        # bulk_create no emite signals: registramos los cambios para la sincronización
+        event_rules = EventRule.objects.bulk_create(event_rules, batch_size=options['batch_size'])
+        scheduled_rules = ScheduledRule.objects.bulk_create(scheduled_rules, batch_size=options['batch_size'])
+        record_changes(AccountChange.Kind.EVENT_RULE, event_rules)
+        record_changes(AccountChange.Kind.SCHEDULED_RULE, scheduled_rules)
+
+    def create_transactions(self, options, accounts, category_ids, rng):
+        total = options['transactions']
+        batch_size = options['batch_size']
+
+        # Distribución tipo Zipf: pocas cuentas muy activas y muchas con poco movimiento
+        weights = [1 / (rank + 1) ** 1.1 for rank in range(len(accounts))]
+        scale = total / sum(weights)
+        per_account = [int(w * scale) for w in weights]
+        per_account[0] += total - sum(per_account)
+        order = list(range(len(accounts)))
+        rng.shuffle(order)
+
+        tasks = []
+        for rank, count in enumerate(per_account):
+            account_id = accounts[order[rank]].id
+            for chunk_index, start in enumerate(range(0, count, batch_size)):
+                tasks.append((
+                    account_id, rank, chunk_index, min(batch_size, count - start), options['seed'],
+                    options['history_days'], category_ids, batch_size,
+                ))
+
+        self.stdout.write(
+            f"Generando {total} transacciones en {len(tasks)} bloques con {options['workers']} proceso(s)..."
+        )
+        created = 0
+        if options['workers'] > 1:
+            connections.close_all()
+            with multiprocessing.Pool(options['workers'], initializer=_worker_init) as pool:
+                for count in pool.imap_unordered(generate_chunk, tasks):
+                    created += count
+                    self.stdout.write(f"  {created}/{total}")
+        else:
+            for task in tasks:
+                created += generate_chunk(task)
+                self.stdout.write(f"  {created}/{total}")
@@ -0,0 +1,68 @@
+# apps/transactions/management/commands/rebuild_category_balances.py
+
+from decimal import Decimal
+from django.core.management.base import BaseCommand, CommandError
+from apps.users.models import Account
+from apps.transactions.models import CategoryBalance
+
+
+class Command(BaseCommand):
+    help = (
+        'Reconstruye desde cero los saldos materializados por categoría (CategoryBalance) '
+        'y/o los verifica contra el agregado de la tabla de transacciones.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--account',
+            type=int,
+            help='Id de la cuenta a procesar. Si se omite, se procesan todas.'
+        )
+        parser.add_argument(
+            '--verify-only',
+            action='store_true',
+            help='Solo compara los saldos guardados con el agregado, sin reconstruir.'
+        )
+
+    def handle(self, *args, **options):
+        account = None
+        if options['account'] is not None:
+            try:
+                account = Account.objects.get(pk=options['account'])
+            except Account.DoesNotExist:
+                raise CommandError(f"Cuenta con id {options['account']} no encontrada.")
+
+        if not options['verify_only']:
+            self.stdout.write("Reconstruyendo saldos por categoría...")
+            rebuilt = CategoryBalance.objects.rebuild(account=account)
+            self.stdout.write(self.style.SUCCESS(f"Se reconstruyeron {rebuilt} saldos."))
+
+        self.verify(account)
+
+    def verify(self, account):
+        self.stdout.write("Verificando saldos contra el agregado de transacciones...")
+        expected = CategoryBalance.objects.aggregate_from_transactions(account)
+
+        stored_qs = CategoryBalance.objects.all()
+        if account is not None:
+            stored_qs = stored_qs.filter(account=account)
+        stored = {
+            (b.account_id, b.category_id): (b.income_total, b.expense_total)
+            for b in stored_qs
+        }
+
+        zero = (Decimal('0.00'), Decimal('0.00'))
+        mismatches = []
+        for key in expected.keys() | stored.keys():
+            if expected.get(key, zero) != stored.get(key, zero):
+                mismatches.append((key, expected.get(key, zero), stored.get(key, zero)))
+
+        for (account_id, category_id), exp, got in sorted(mismatches):
+            self.stderr.write(self.style.ERROR(
+                f"Cuenta {account_id}, categoría {category_id}: "
+                f"esperado ingresos={exp[0]} gastos={exp[1]}, guardado ingresos={got[0]} gastos={got[1]}"
+            ))
+
+        if mismatches:
+            raise CommandError(f"Se encontraron {len(mismatches)} saldos inconsistentes.")
+        self.stdout.write(self.style.SUCCESS(f"Los {len(expected)} saldos coinciden con las transacciones."))
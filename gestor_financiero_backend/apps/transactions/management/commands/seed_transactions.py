@@ -4,8 +4,8 @@ import random
 from datetime import datetime, timedelta
 from django.core.management.base import BaseCommand
 from django.utils import timezone
-from apps.users.models import CustomUser, Account
-from apps.transactions.models import Transaction, Category
+from apps.users.models import CustomUser, Account, AccountChange, record_changes
+from apps.transactions.models import Transaction, Category, rebuild_materialized_totals
 from apps.automation.models import TransactionType  # Ajusta si la importación es diferente
 from decimal import Decimal
 
@@ -43,6 +43,7 @@ class Command(BaseCommand):
         self.stdout.write(self.style.SUCCESS(f"Usuario {user.email} y Cuenta '{account.name}' encontrados. Limpiando transacciones antiguas..."))
         
         # Limpiar transacciones existentes de esta cuenta para no duplicar
+        # El borrado masivo descuenta los totales y registra las bajas en el log de cambios
         Transaction.objects.filter(account=account).delete()
 
         # --- 2. Preparar Categorías ---
@@ -118,6 +119,12 @@ class Command(BaseCommand):
 
         # --- 5. Guardar todo en la Base de Datos ---
         self.stdout.write(f"Creando {len(transactions_to_create)} transacciones en la base de datos...")
-        Transaction.objects.bulk_create(transactions_to_create)
+        created = Transaction.objects.bulk_create(transactions_to_create)
+
+        # bulk_create (y el borrado masivo) no pasan por Transaction.save(),
+        # así que recalculamos los totales materializados de la cuenta
+        # y registramos los cambios para la sincronización incremental.
+        rebuild_materialized_totals(account=account)
+        record_changes(AccountChange.Kind.TRANSACTION, created)
         
         self.stdout.write(self.style.SUCCESS("¡Historial de transacciones generado exitosamente!"))
\ No newline at end of file
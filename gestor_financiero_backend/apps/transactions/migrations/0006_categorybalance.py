@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:30
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Q, Sum
+
+
+def populate_category_balances(apps, schema_editor):
+    """
+    Calcula los saldos iniciales a partir de las transacciones existentes.
+    """
+    Transaction = apps.get_model('transactions', 'Transaction')
+    CategoryBalance = apps.get_model('transactions', 'CategoryBalance')
+
+    rows = Transaction.objects.filter(category__isnull=False).order_by().values(
+        'account_id', 'category_id'
+    ).annotate(
+        income_total=Sum('amount', filter=Q(transaction_type='INCOME')),
+        expense_total=Sum('amount', filter=Q(transaction_type='EXPENSE')),
+    )
+    CategoryBalance.objects.bulk_create([
+        CategoryBalance(
+            account_id=row['account_id'],
+            category_id=row['category_id'],
+            income_total=row['income_total'] or Decimal('0.00'),
+            expense_total=row['expense_total'] or Decimal('0.00'),
+        )
+        for row in rows
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0005_transaction_tx_account_date_id_idx_and_more'),
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('income_total', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('expense_total', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('last_updated', models.DateTimeField(auto_now=True)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='category_balances', to='users.account')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balances', to='transactions.category')),
+            ],
+            options={
+                'verbose_name': 'Saldo por Categoría',
+                'verbose_name_plural': 'Saldos por Categoría',
+                'unique_together': {('account', 'category')},
+            },
+        ),
+        migrations.RunPython(populate_category_balances, migrations.RunPython.noop),
+    ]
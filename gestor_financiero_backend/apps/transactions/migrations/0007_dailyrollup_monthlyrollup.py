@@ -0,0 +1,79 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:32
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncMonth
+
+
+def populate_rollups(apps, schema_editor):
+    """
+    Calcula los rollups diarios y mensuales a partir de las transacciones existentes.
+    """
+    Transaction = apps.get_model('transactions', 'Transaction')
+    if schema_editor.connection.vendor == 'sqlite':
+        # Cuando 'date' tenía default=timezone.now, SQLite guardó fecha y hora como
+        # texto: el ORM lee esas filas como NULL y no se podrían agrupar por día
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE "{Transaction._meta.db_table}" SET "date" = substr("date", 1, 10) WHERE length("date") > 10'
+            )
+    for model_name, period in (('DailyRollup', F('date')), ('MonthlyRollup', TruncMonth('date'))):
+        Rollup = apps.get_model('transactions', model_name)
+        rows = Transaction.objects.order_by().annotate(period=period).values(
+            'account_id', 'category_id', 'transaction_type', 'period'
+        ).annotate(total=Sum('amount'), count=Count('id'))
+        Rollup.objects.bulk_create([Rollup(**row) for row in rows], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0006_categorybalance'),
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('transaction_type', models.CharField(choices=[('INCOME', 'Ingreso'), ('EXPENSE', 'Egreso')], max_length=10)),
+                ('period', models.DateField(help_text='Primer día del período')),
+                ('total', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('count', models.IntegerField(default=0)),
+                ('last_updated', models.DateTimeField(auto_now=True)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='users.account')),
+                ('category', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='transactions.category')),
+            ],
+            options={
+                'verbose_name': 'Total Diario',
+                'verbose_name_plural': 'Totales Diarios',
+                'abstract': False,
+                'indexes': [models.Index(fields=['account', 'period'], name='dailyrollup_account_period_idx')],
+                'unique_together': {('account', 'category', 'transaction_type', 'period')},
+            },
+        ),
+        migrations.CreateModel(
+            name='MonthlyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('transaction_type', models.CharField(choices=[('INCOME', 'Ingreso'), ('EXPENSE', 'Egreso')], max_length=10)),
+                ('period', models.DateField(help_text='Primer día del período')),
+                ('total', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('count', models.IntegerField(default=0)),
+                ('last_updated', models.DateTimeField(auto_now=True)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='users.account')),
+                ('category', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='transactions.category')),
+            ],
+            options={
+                'verbose_name': 'Total Mensual',
+                'verbose_name_plural': 'Totales Mensuales',
+                'abstract': False,
+                'indexes': [models.Index(fields=['account', 'period'], name='monthlyrollup_acct_period_idx')],
+                'unique_together': {('account', 'category', 'transaction_type', 'period')},
+            },
+        ),
+        migrations.RunPython(populate_rollups, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,16 @@
 # apps/transactions/models.py
-from django.db import models
+from collections import defaultdict
+from decimal import Decimal
+from django.db import models, IntegrityError, transaction as db_transaction
+from django.db.models import F, Q, Sum, Count
+from django.db.models.functions import TruncMonth
 from django.conf import settings
-from apps.users.models import Account
+from apps.users.models import Account, AccountChange, record_changes
 from django.utils import timezone
 
+CENTS = Decimal('0.01')
+
+
 class Category(models.Model):
     name = models.CharField(max_length=100)
     # Si es nulo, es una categoría global.
@@ -24,6 +31,53 @@ class Category(models.Model):
         verbose_name_plural = "Categories"
 
 
+# Campos que alcanzan para aplicar una transacción a los totales y al log de cambios
+TOTALS_FIELDS = ('account', 'category', 'amount', 'date', 'transaction_type')
+
+
+class TransactionQuerySet(models.QuerySet):
+    """
+    Las bajas y modificaciones masivas (incluida la acción "eliminar
+    seleccionados" del admin) mantienen los totales materializados y el log
+    de cambios, igual que Transaction.save()/delete(). Con track=False quedan
+    a cargo de quien llama, como el endpoint batch, que registra todo el lote
+    bajo una sola versión.
+    """
+
+    def delete(self, *, track=True):
+        if not track:
+            return super().delete()
+        with db_transaction.atomic():
+            deleted = list(self.select_for_update().only(*TOTALS_FIELDS))
+            apply_materialized_totals(deleted, sign=-1)
+            record_changes(AccountChange.Kind.TRANSACTION, deleted=deleted)
+            return self.model._base_manager.filter(pk__in=[t.pk for t in deleted]).delete()
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+    def update(self, *, track=True, **kwargs):
+        if not track:
+            return super().update(**kwargs)
+        with db_transaction.atomic():
+            previous = list(self.select_for_update().only(*TOTALS_FIELDS))
+            rows = self.model._base_manager.filter(pk__in=[t.pk for t in previous])
+            count = rows.update(**kwargs)
+            updated = list(rows.only(*TOTALS_FIELDS))
+            apply_materialized_totals(previous, sign=-1)
+            apply_materialized_totals(updated)
+            record_changes(AccountChange.Kind.TRANSACTION, updated)
+            return count
+
+    update.alters_data = True
+
+    def bulk_update(self, objs, fields, batch_size=None):
+        # Como bulk_create, no toca los totales: quien llama aplica apply_materialized_totals
+        return self.model._base_manager.using(self.db).bulk_update(objs, fields, batch_size=batch_size)
+
+    bulk_update.alters_data = True
+
+
 class Transaction(models.Model):
     id = models.AutoField(primary_key=True)
     account = models.ForeignKey(Account, on_delete=models.CASCADE, related_name='transactions')
@@ -34,7 +88,381 @@ class Transaction(models.Model):
     transaction_type = models.CharField(max_length=10, choices=[('INCOME', 'Ingreso'), ('EXPENSE', 'Egreso')])
     created_by_rule = models.BooleanField(default=False)
 
+    objects = TransactionQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.description} - {self.amount}"
-    
-    
+
+    def save(self, *args, **kwargs):
+        """
+        Guarda la transacción y actualiza los totales materializados
+        (saldos y rollups) y el log de cambios dentro de la misma
+        transacción de base de datos.
+        """
+        with db_transaction.atomic():
+            previous = None
+            if not self._state.adding and self.pk:
+                previous = Transaction.objects.filter(pk=self.pk).only(*TOTALS_FIELDS).first()
+            super().save(*args, **kwargs)
+            if previous:
+                apply_materialized_totals([previous], sign=-1)
+            apply_materialized_totals([self])
+            record_changes(AccountChange.Kind.TRANSACTION, [self])
+
+    def delete(self, *args, **kwargs):
+        with db_transaction.atomic():
+            apply_materialized_totals([self], sign=-1)
+            record_changes(AccountChange.Kind.TRANSACTION, deleted=[self])
+            return super().delete(*args, **kwargs)
+
+    class Meta:
+        indexes = [
+            # Listado, paginación por cursor y rangos de fechas por cuenta
+            models.Index(fields=['account', '-date', '-id'], name='tx_account_date_id_idx'),
+            # Totales por categoría (resumen y balance de reglas programadas)
+            models.Index(fields=['account', 'category', 'transaction_type'], name='tx_account_cat_type_idx'),
+        ]
+
+
+def apply_materialized_totals(transactions, sign=1):
+    """
+    Aplica las transacciones dadas (sign=1 al crear, sign=-1 al borrar) a todas
+    las tablas materializadas. Las operaciones masivas que no pasan por
+    Transaction.save() (bulk_create, etc.) deben llamarlo explícitamente.
+    """
+    transactions = list(transactions)
+    CategoryBalance.objects.apply(transactions, sign=sign)
+    DailyRollup.objects.apply(transactions, sign=sign)
+    MonthlyRollup.objects.apply(transactions, sign=sign)
+
+
+def uncategorize_materialized_totals(category):
+    """
+    Antes de borrar una categoría: sus transacciones van a quedar sin categoría
+    (SET_NULL), así que sus rollups se suman a las filas sin categoría del mismo
+    período en vez de quedar como filas sueltas. Los saldos por categoría no
+    cuentan las transacciones sin categoría y se borran en cascada.
+    """
+    DailyRollup.objects.uncategorize(category)
+    MonthlyRollup.objects.uncategorize(category)
+
+
+def rebuild_materialized_totals(account=None):
+    """
+    Reconstruye desde cero todas las tablas materializadas (de una cuenta o de todas).
+    """
+    CategoryBalance.objects.rebuild(account=account)
+    DailyRollup.objects.rebuild(account=account)
+    MonthlyRollup.objects.rebuild(account=account)
+    # Se suele llamar después de escrituras masivas que no pasaron por apply_materialized_totals
+    accounts = Account.objects.all() if account is None else Account.objects.filter(pk=account.pk)
+    accounts.update(change_version=F('change_version') + 1)
+
+
+class MaterializedTotalsManager(models.Manager):
+    """
+    Base para las tablas de totales materializados. Aplica un lote de deltas
+    con un número fijo de consultas: lee las filas existentes de una vez,
+    y luego hace un bulk_update de las que ya estaban y un bulk_create de las nuevas.
+    """
+    key_fields = ()
+    value_fields = ()
+
+    def candidates(self, keys):
+        """
+        Queryset que incluye (al menos) todas las filas de las claves dadas.
+        """
+        raise NotImplementedError
+
+    def apply_deltas(self, deltas):
+        if not deltas:
+            return
+        now = timezone.now()
+        with db_transaction.atomic(savepoint=False):
+            existing = {
+                tuple(getattr(row, field) for field in self.key_fields): row
+                for row in self.candidates(deltas.keys()).select_for_update()
+            }
+            to_update, to_create = [], []
+            for key, values in deltas.items():
+                row = existing.get(key)
+                if row is None:
+                    row = self.model(**dict(zip(self.key_fields, key)))
+                    for field, value in zip(self.value_fields, values):
+                        setattr(row, field, value)
+                    to_create.append(row)
+                else:
+                    for field, value in zip(self.value_fields, values):
+                        setattr(row, field, getattr(row, field) + value)
+                    row.last_updated = now
+                    to_update.append(row)
+
+            if to_update:
+                self.bulk_update(to_update, list(self.value_fields) + ['last_updated'], batch_size=500)
+            if not to_create:
+                return
+            try:
+                with db_transaction.atomic():
+                    self.bulk_create(to_create, batch_size=500)
+            except IntegrityError:
+                # Otra transacción creó alguna de las filas en paralelo: caemos al
+                # camino fila por fila, que incrementa con F() sobre la fila existente.
+                for row in to_create:
+                    lookup = {field: getattr(row, field) for field in self.key_fields}
+                    self.get_or_create(**lookup)
+                    self.filter(**lookup).update(
+                        last_updated=now,
+                        **{field: F(field) + getattr(row, field) for field in self.value_fields}
+                    )
+
+
+class CategoryBalanceManager(MaterializedTotalsManager):
+    key_fields = ('account_id', 'category_id')
+    value_fields = ('income_total', 'expense_total')
+
+    def candidates(self, keys):
+        return self.filter(
+            account_id__in={key[0] for key in keys},
+            category_id__in={key[1] for key in keys},
+        )
+
+    def apply(self, transactions, sign=1):
+        """
+        Suma (sign=1) o resta (sign=-1) los montos de las transacciones dadas
+        a los saldos materializados.
+        """
+        deltas = defaultdict(lambda: [Decimal('0.00'), Decimal('0.00')])
+        for t in transactions:
+            if t.category_id is None:
+                continue
+            position = 0 if t.transaction_type == 'INCOME' else 1
+            deltas[(t.account_id, t.category_id)][position] += sign * _as_amount(t.amount)
+        self.apply_deltas(deltas)
+
+    def aggregate_from_transactions(self, account=None):
+        """
+        Calcula los saldos directamente desde la tabla de transacciones.
+        Devuelve un dict {(account_id, category_id): (income_total, expense_total)}.
+        """
+        queryset = Transaction.objects.filter(category__isnull=False)
+        if account is not None:
+            queryset = queryset.filter(account=account)
+        rows = queryset.order_by().values('account_id', 'category_id').annotate(
+            income_total=Sum('amount', filter=Q(transaction_type='INCOME')),
+            expense_total=Sum('amount', filter=Q(transaction_type='EXPENSE')),
+        )
+        # SQLite suma los decimales como float: redondeamos a centavos
+        return {
+            (row['account_id'], row['category_id']): (
+                (row['income_total'] or Decimal('0.00')).quantize(CENTS),
+                (row['expense_total'] or Decimal('0.00')).quantize(CENTS),
+            )
+            for row in rows
+        }
+
+    def rebuild(self, account=None):
+        """
+        Reconstruye desde cero los saldos (de una cuenta o de todas).
+        """
+        totals = self.aggregate_from_transactions(account)
+        with db_transaction.atomic():
+            existing = self.all() if account is None else self.filter(account=account)
+            existing.delete()
+            self.bulk_create([
+                CategoryBalance(
+                    account_id=account_id,
+                    category_id=category_id,
+                    income_total=income,
+                    expense_total=expense,
+                )
+                for (account_id, category_id), (income, expense) in totals.items()
+            ], batch_size=1000)
+        return len(totals)
+
+
+class CategoryBalance(models.Model):
+    """
+    Saldo materializado por cuenta y categoría. Se mantiene de forma
+    incremental en cada alta, modificación o baja de una Transaction,
+    de modo que consultar el balance de una categoría es O(1).
+    """
+    account = models.ForeignKey(Account, on_delete=models.CASCADE, related_name='category_balances')
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='balances')
+    income_total = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    expense_total = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    last_updated = models.DateTimeField(auto_now=True)
+
+    objects = CategoryBalanceManager()
+
+    class Meta:
+        unique_together = ('account', 'category')
+        verbose_name = "Saldo por Categoría"
+        verbose_name_plural = "Saldos por Categoría"
+
+    @property
+    def balance(self):
+        return self.income_total - self.expense_total
+
+    def __str__(self):
+        return f"{self.category} ({self.account}): {self.balance}"
+
+
+class RollupManager(MaterializedTotalsManager):
+    """
+    Mantiene los totales pre-agregados por (cuenta, categoría, tipo, período).
+    """
+    key_fields = ('account_id', 'category_id', 'transaction_type', 'period')
+    value_fields = ('total', 'count')
+
+    def candidates(self, keys):
+        periods = [key[3] for key in keys]
+        return self.filter(
+            account_id__in={key[0] for key in keys},
+            period__gte=min(periods),
+            period__lte=max(periods),
+        )
+
+    def apply(self, transactions, sign=1):
+        deltas = defaultdict(lambda: [Decimal('0.00'), 0])
+        for t in transactions:
+            period = self.model.period_start(t.date)
+            key = (t.account_id, t.category_id, t.transaction_type, period)
+            deltas[key][0] += sign * _as_amount(t.amount)
+            deltas[key][1] += sign
+        self.apply_deltas(deltas)
+
+    def uncategorize(self, category):
+        """
+        Mueve los totales de una categoría a las filas sin categoría.
+        """
+        rows = self.filter(category=category)
+        deltas = defaultdict(lambda: [Decimal('0.00'), 0])
+        for row in rows:
+            key = (row.account_id, None, row.transaction_type, row.period)
+            deltas[key][0] += row.total
+            deltas[key][1] += row.count
+        if not deltas:
+            return
+        with db_transaction.atomic(savepoint=False):
+            rows.delete()
+            self.apply_deltas(deltas)
+
+    def aggregate_from_transactions(self, account=None):
+        """
+        Calcula los rollups directamente desde la tabla de transacciones.
+        Devuelve un dict {(account_id, category_id, transaction_type, period): (total, count)}.
+        """
+        queryset = Transaction.objects.all()
+        if account is not None:
+            queryset = queryset.filter(account=account)
+        rows = queryset.order_by().annotate(
+            period=self.model.period_expression('date')
+        ).values('account_id', 'category_id', 'transaction_type', 'period').annotate(
+            total=Sum('amount'),
+            count=Count('id'),
+        )
+        return {
+            (row['account_id'], row['category_id'], row['transaction_type'],
+             self.model.period_start(row['period'])): (row['total'].quantize(CENTS), row['count'])
+            for row in rows
+        }
+
+    def rebuild(self, account=None):
+        totals = self.aggregate_from_transactions(account)
+        with db_transaction.atomic():
+            existing = self.all() if account is None else self.filter(account=account)
+            existing.delete()
+            self.bulk_create([
+                self.model(
+                    account_id=account_id,
+                    category_id=category_id,
+                    transaction_type=transaction_type,
+                    period=period,
+                    total=total,
+                    count=count,
+                )
+                for (account_id, category_id, transaction_type, period), (total, count) in totals.items()
+            ], batch_size=1000)
+        return len(totals)
+
+
+class Rollup(models.Model):
+    """
+    Base para las tablas de totales pre-agregados por período. Se mantienen
+    de forma incremental desde Transaction.save()/delete() y permiten armar
+    reportes históricos sin recorrer cada transacción.
+    """
+    account = models.ForeignKey(Account, on_delete=models.CASCADE, related_name='+')
+    # SET_NULL igual que Transaction.category; antes de borrar una categoría
+    # uncategorize_materialized_totals funde sus filas con las sin categoría
+    category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, related_name='+')
+    transaction_type = models.CharField(max_length=10, choices=[('INCOME', 'Ingreso'), ('EXPENSE', 'Egreso')])
+    period = models.DateField(help_text="Primer día del período")
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    count = models.IntegerField(default=0)
+    last_updated = models.DateTimeField(auto_now=True)
+
+    objects = RollupManager()
+
+    class Meta:
+        abstract = True
+        unique_together = ('account', 'category', 'transaction_type', 'period')
+
+    @staticmethod
+    def period_expression(field):
+        raise NotImplementedError
+
+    @staticmethod
+    def period_start(value):
+        raise NotImplementedError
+
+    def __str__(self):
+        return f"{self.account} {self.period} {self.category} {self.transaction_type}: {self.total}"
+
+
+def _as_date(value):
+    """
+    Fecha de una transacción tal como la guarda la base: el ORM acepta
+    date, datetime o texto ('2024-01-01') en Transaction.date.
+    """
+    return Transaction._meta.get_field('date').to_python(value)
+
+
+def _as_amount(value):
+    """
+    Monto como Decimal en centavos. Se pasa por str para que un float
+    (0.1) no arrastre su error binario a los totales.
+    """
+    return Decimal(str(value)).quantize(CENTS)
+
+
+class DailyRollup(Rollup):
+
+    class Meta(Rollup.Meta):
+        verbose_name = "Total Diario"
+        verbose_name_plural = "Totales Diarios"
+        indexes = [models.Index(fields=['account', 'period'], name='dailyrollup_account_period_idx')]
+
+    @staticmethod
+    def period_expression(field):
+        return F(field)
+
+    @staticmethod
+    def period_start(value):
+        return _as_date(value)
+
+
+class MonthlyRollup(Rollup):
+
+    class Meta(Rollup.Meta):
+        verbose_name = "Total Mensual"
+        verbose_name_plural = "Totales Mensuales"
+        indexes = [models.Index(fields=['account', 'period'], name='monthlyrollup_acct_period_idx')]
+
+    @staticmethod
+    def period_expression(field):
+        return TruncMonth(field)
+
+    @staticmethod
+    def period_start(value):
+        return _as_date(value).replace(day=1)
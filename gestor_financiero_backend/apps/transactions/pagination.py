@@ -0,0 +1,95 @@
+# apps/transactions/pagination.py
+from base64 import b64decode, b64encode
+from collections import OrderedDict
+
+from django.db.models import Q
+from django.utils.dateparse import parse_date
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class TransactionKeysetPagination(BasePagination):
+    """
+    Paginación por cursor (keyset) sobre el par (date, id), en orden descendente.
+
+    Cada página se obtiene con un 'WHERE (date, id) < (cursor)' en lugar de un
+    OFFSET, por lo que el costo es constante sin importar cuán profundo se pagine.
+
+    Es opcional: si el cliente no envía ?cursor= ni ?page_size= se devuelve la
+    lista completa como antes, para no romper a los clientes existentes.
+    """
+    page_size = 50
+    max_page_size = 500
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = 'Cursor inválido.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if self.cursor_query_param not in params and self.page_size_query_param not in params:
+            return None
+
+        self.request = request
+        self.page_size = self.get_page_size(request)
+
+        encoded = params.get(self.cursor_query_param)
+        if encoded:
+            cursor_date, cursor_id = self.decode_cursor(encoded)
+            queryset = queryset.filter(
+                Q(date__lt=cursor_date) | Q(date=cursor_date, id__lt=cursor_id)
+            )
+
+        # Pedimos un elemento extra para saber si existe una página siguiente
+        results = list(queryset.order_by('-date', '-id')[:self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def encode_cursor(self, transaction):
+        raw = f"{transaction.date.isoformat()[:10]}:{transaction.id}"
+        return b64encode(raw.encode('ascii')).decode('ascii')
+
+    def decode_cursor(self, encoded):
+        try:
+            raw_date, raw_id = b64decode(encoded.encode('ascii')).decode('ascii').split(':')
+            cursor_date = parse_date(raw_date)
+            cursor_id = int(raw_id)
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if cursor_date is None:
+            raise NotFound(self.invalid_cursor_message)
+        return cursor_date, cursor_id
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.page_size_query_param, self.page_size)
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1]))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
@@ -1,9 +1,16 @@
 from rest_framework import serializers
 from .models import Transaction, Category
+from .category_cache import get_category_index
 from apps.users.models import Account
+from django.db import IntegrityError
 from django.db.models import Q
 from datetime import datetime, date
 
+# Una petición que leyó el catálogo justo antes de que se borrara una categoría
+# la valida contra la versión anterior: la base rechaza la clave foránea
+STALE_CATEGORY_ERROR = "La categoría ya no existe. Actualizá el catálogo y reintentá."
+
+
 class SafeDateField(serializers.DateField):
     """
     Acepta tanto date como datetime al serializar.
@@ -14,9 +21,49 @@ class SafeDateField(serializers.DateField):
             value = value.date()
         return super().to_representation(value)
 
+class CategoryPrimaryKeyField(serializers.PrimaryKeyRelatedField):
+    """
+    PK de una categoría visible para la cuenta de la vista (globales + propias).
+    Valida contra el catálogo cacheado de la cuenta, sin consultar la base,
+    y devuelve una instancia de Category armada desde el caché.
+    """
+    def __init__(self, **kwargs):
+        kwargs.setdefault('queryset', Category.objects.all())
+        super().__init__(**kwargs)
+
+    def get_account(self):
+        view = self.context.get('view')
+        return view.get_account_object() if view is not None and hasattr(view, 'get_account_object') else None
+
+    def get_queryset(self):
+        # Solo se usa para armar las opciones del formulario del browsable API
+        account = self.get_account()
+        if account is None:
+            return super().get_queryset()
+        return Category.objects.filter(Q(account__isnull=True) | Q(account=account))
+
+    def to_internal_value(self, data):
+        account = self.get_account()
+        if account is None:
+            return super().to_internal_value(data)
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            pk = int(data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        category = get_category_index(account).get(pk)
+        if category is None:
+            self.fail('does_not_exist', pk_value=data)
+        return Category.from_db(
+            Category.objects.db, ['id', 'name', 'account_id'],
+            [category['id'], category['name'], category['account']]
+        )
+
+
 class TransactionSerializer(serializers.ModelSerializer):
     account = serializers.PrimaryKeyRelatedField(read_only=True)
-    category = serializers.PrimaryKeyRelatedField(queryset=Category.objects.all())
+    category = CategoryPrimaryKeyField()
     date=SafeDateField()
     class Meta:
         model = Transaction
@@ -42,13 +89,8 @@ class TransactionSerializer(serializers.ModelSerializer):
         # El usuario solo puede elegir entre las cuentas de las que es miembro
         self.fields['account'].queryset = user.accounts.all()
         
-        # 2. Filtrar el campo 'category'
-        # El usuario solo puede elegir categorías globales (account=None)
-        # O categorías que pertenezcan a las cuentas de las que es miembro
-        user_accounts = self.fields['account'].queryset
-        self.fields['category'].queryset = Category.objects.filter(
-            Q(account__isnull=True) | Q(account__in=user_accounts)
-        ).distinct()
+        # 2. El campo 'category' se filtra solo: CategoryPrimaryKeyField acepta
+        # categorías globales (account=None) o de la cuenta de la URL
 
     def validate(self, data):
         """
@@ -57,14 +99,54 @@ class TransactionSerializer(serializers.ModelSerializer):
         account = self.context['view'].get_account_object()
         category = data.get('category')
 
-        if category and category.account is not None and category.account != account:
+        if category and category.account_id is not None and category.account_id != account.id:
             raise serializers.ValidationError(
                 "Esta categoría no pertenece a la cuenta seleccionada."
             )
         
         return data
+
+    def save(self, **kwargs):
+        # Transaction.save() es atómico: si la base rechaza la categoría no queda nada escrito
+        try:
+            return super().save(**kwargs)
+        except IntegrityError:
+            raise serializers.ValidationError({'category': [STALE_CATEGORY_ERROR]})
         
+class TransactionBatchItemSerializer(TransactionSerializer):
+    """
+    Variante de TransactionSerializer para operaciones en lote.
+    La categoría se valida contra el conjunto de ids precargado en
+    context['category_ids'], así validar N ítems no hace N consultas.
+    """
+    category = serializers.IntegerField()
+
+    def validate_category(self, value):
+        if value not in self.context['category_ids']:
+            raise serializers.ValidationError("Categoría inválida para esta cuenta.")
+        return value
+
+    def validate(self, data):
+        # La pertenencia de la categoría a la cuenta ya se verificó en validate_category
+        if 'category' in data:
+            data['category_id'] = data.pop('category')
+        return data
+
 class CategorySerializer(serializers.ModelSerializer):
     class Meta:
         model = Category
-        fields = ['id', 'name', 'account']
\ No newline at end of file
+        fields = ['id', 'name', 'account']
+
+class TransactionSummarySerializer(serializers.Serializer):
+    """
+    Representa una fila del resumen agregado de transacciones.
+    'period' viene informado al agrupar por fecha; 'category' y
+    'category_name' al agrupar por categoría.
+    """
+    period = SafeDateField(required=False, allow_null=True)
+    category = serializers.IntegerField(required=False, allow_null=True)
+    category_name = serializers.CharField(required=False, allow_null=True)
+    income_total = serializers.DecimalField(max_digits=14, decimal_places=2)
+    expense_total = serializers.DecimalField(max_digits=14, decimal_places=2)
+    balance = serializers.DecimalField(max_digits=14, decimal_places=2)
+    count = serializers.IntegerField()
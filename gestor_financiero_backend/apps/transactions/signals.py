@@ -0,0 +1,70 @@
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.dispatch import receiver
+from apps.users.models import Account, AccountChange, record_changes, record_global_change, is_account_deletion
+from apps.transactions.models import Category, Transaction, uncategorize_materialized_totals
+from apps.transactions.category_cache import invalidate_categories
+
+
+def accounts_using_category(category):
+    """
+    Cuentas con datos que usan la categoría (transacciones, saldos, rollups,
+    reglas). Se recorren las relaciones de Category para no importar las apps
+    que dependen de transactions.
+    """
+    scope = Q()
+    for relation in Category._meta.related_objects:
+        model = relation.related_model
+        if any(field.name == 'account' for field in model._meta.fields):
+            scope |= Q(pk__in=model._base_manager.filter(**{relation.field.name: category}).values('account_id'))
+    return Account.objects.filter(scope) if scope else Account.objects.none()
+
+
+@receiver(pre_delete, sender=Category)
+def uncategorize_category_totals(sender, instance, **kwargs):
+    """
+    Los rollups de la categoría pasan a las filas sin categoría, igual que sus
+    transacciones. Si se borra la cuenta entera, sus rollups se borran con ella.
+    """
+    if not is_account_deletion(kwargs.get('origin')):
+        uncategorize_materialized_totals(instance)
+
+
+@receiver(pre_delete, sender=Category)
+def record_category_deletion(sender, instance, **kwargs):
+    """
+    Antes de borrar la categoría (todavía se sabe quién la usa) registra las
+    transacciones que van a quedar sin categoría y, si es global, la baja en
+    el log de las cuentas que la usan.
+    """
+    if is_account_deletion(kwargs.get('origin')):
+        return
+    if instance.account_id is None:
+        record_global_change(AccountChange.Kind.CATEGORY, instance.pk, accounts_using_category(instance), deleted=True)
+    record_changes(
+        AccountChange.Kind.TRANSACTION, Transaction.objects.filter(category=instance).only('id', 'account_id')
+    )
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def record_category_change(sender, instance, signal, **kwargs):
+    """
+    Cualquier alta, cambio o baja de una categoría incrementa la versión del
+    catálogo de su cuenta (o de todas, si la categoría es global) y queda
+    registrada en el log de cambios de la cuenta. Los cambios de una categoría
+    global solo se registran en las cuentas que la usan: las demás se enteran
+    por la versión del catálogo.
+    """
+    deleted = signal is post_delete
+    if deleted and is_account_deletion(kwargs.get('origin')):
+        return
+    invalidate_categories(instance.account_id)
+    if instance.account_id is None:
+        # La baja de una categoría global ya quedó registrada en pre_delete
+        if not deleted:
+            record_global_change(AccountChange.Kind.CATEGORY, instance.pk, accounts_using_category(instance))
+    elif deleted:
+        record_changes(AccountChange.Kind.CATEGORY, deleted=[instance])
+    else:
+        record_changes(AccountChange.Kind.CATEGORY, [instance])
@@ -1,3 +1,1379 @@
-from django.test import TestCase
+import csv
+import gc
+import json
+import os
+import random
+import time
+from base64 import b64encode
+from datetime import date, timedelta
+from decimal import Decimal
+from io import StringIO
+from math import ceil
+from unittest import mock
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.db.models import Count, F, Q, Sum
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLResolver, get_resolver
+from django.utils import timezone
+from rest_framework.test import APIClient
+from apps.users.models import AccountChange, CustomUser, Account, Membership
+from apps.transactions.models import (
+    CENTS, Category, CategoryBalance, CategoryBalanceManager, DailyRollup, MonthlyRollup, RollupManager, Transaction,
+    rebuild_materialized_totals,
+)
+from apps.automation.models import EventRule, ScheduledRule, ActionType, TransactionType
+from apps.insights.models import FinancialInsight
+from apps.transactions.category_cache import get_category_catalog
 
-# Create your tests here.
+# Tamaño del fixture y repeticiones por endpoint (se pueden ajustar por entorno).
+# Por defecto el historial es chico para que `manage.py test` sea rápido;
+# PERF_BUDGET_LARGE=1 usa el historial grande contra el que se fijaron las latencias.
+FIXTURE_TRANSACTIONS = int(os.getenv(
+    'PERF_BUDGET_TRANSACTIONS', 100_000 if os.getenv('PERF_BUDGET_LARGE') else 2_000
+))
+ITERATIONS = int(os.getenv('PERF_BUDGET_ITERATIONS', 10))
+# Multiplica los presupuestos de latencia (máquinas de CI más lentas, etc.)
+LATENCY_SCALE = float(os.getenv('PERF_BUDGET_LATENCY_SCALE', 1))
+
+FIXTURE_ACCOUNTS = 25
+MEMBERS_PER_ACCOUNT = 3
+CUSTOM_CATEGORIES_PER_ACCOUNT = 5
+RULES_PER_ACCOUNT = 3
+PASSWORD = 'secret-password'
+
+
+class Budget:
+    """
+    Presupuesto de una ruta y un método: cantidad máxima de consultas SQL por
+    petición y latencia p95 máxima (en milisegundos) sobre ITERATIONS peticiones.
+    'path' y 'data' son funciones que reciben el fixture y el número de iteración.
+    """
+    def __init__(self, route, method, path, max_queries, p95_ms, data=None, authenticate=True, data_format='json'):
+        self.route = route
+        self.method = method
+        self.path = path
+        self.max_queries = max_queries
+        self.p95_ms = p95_ms
+        self.data = data
+        self.authenticate = authenticate
+        self.data_format = data_format
+
+
+def _import_file(fx, i):
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    lines = ['date,description,amount,category,transaction_type']
+    lines += [f'2024-05-{day % 28 + 1:02d},Importado {i}-{day},{day + 1}.50,Comida,EXPENSE' for day in range(100)]
+    return {'file': SimpleUploadedFile(f'extracto{i}.csv', '\n'.join(lines).encode())}
+
+
+def _batch_operations(fx, i):
+    return {'operations': [
+        {'op': 'create', 'data': {
+            'amount': '10.00', 'date': '2024-06-01', 'description': f'Lote {i}-{n}',
+            'category': fx['categories']['Comida'].id, 'transaction_type': 'EXPENSE',
+        }}
+        for n in range(20)
+    ]}
+
+
+def _account(fx):
+    return fx['account'].id
+
+
+def _transaction_data(fx, i):
+    return {'amount': f'{i + 1}.25', 'date': '2024-06-01', 'description': f'Escritura {i}',
+            'category': fx['categories']['Comida'].id, 'transaction_type': 'EXPENSE'}
+
+
+def _event_rule_data(fx, i):
+    return {'name': f'Regla nueva {i}', 'is_active': False, 'trigger_category': fx['categories']['Sueldo'].id,
+            'trigger_transaction_type': 'INCOME', 'action_type': 'PERCENTAGE',
+            'action_destination_category': fx['categories']['Ahorro'].id, 'action_percentage': '5.00'}
+
+
+def _scheduled_rule_data(fx, i):
+    return {'name': f'Programada nueva {i}', 'schedule_day_of_month': i % 28 + 1,
+            'source_category': fx['categories']['Sueldo'].id, 'action_type': 'FIXED',
+            'action_destination_category': fx['categories']['Ahorro'].id, 'action_fixed_amount': '50.00'}
+
+
+def _nested(fx, resource, pk=None):
+    path = f"/api/accounts/{_account(fx)}/{resource}/"
+    return path if pk is None else f"{path}{pk}/"
+
+
+BUDGETS = [
+    Budget('api-root', 'get', lambda fx, i: '/api/', 0, 50, authenticate=False),
+    Budget('user-list', 'get', lambda fx, i: '/api/users/', 1, 100),
+    Budget('user-detail', 'get', lambda fx, i: f"/api/users/{fx['user'].id}/", 1, 50),
+    Budget('auth_register', 'post', lambda fx, i: '/api/auth/register/', 3, 200, authenticate=False,
+           data=lambda fx, i: {'first_name': 'Nuevo', 'last_name': 'Usuario', 'email': f'nuevo{i}@test.com',
+                               'password': PASSWORD, 'password2': PASSWORD}),
+    Budget('auth_login', 'post', lambda fx, i: '/api/auth/login/', 2, 200, authenticate=False,
+           data=lambda fx, i: {'email': fx['user'].email, 'password': PASSWORD}),
+    Budget('token_refresh', 'post', lambda fx, i: '/api/auth/token/refresh/', 1, 50, authenticate=False,
+           data=lambda fx, i: {'refresh': fx['refresh']}),
+    Budget('account-list', 'get', lambda fx, i: '/api/accounts/', 2, 250),
+    Budget('account-detail', 'get', lambda fx, i: f"/api/accounts/{_account(fx)}/", 2, 50),
+    Budget('account-members', 'get', lambda fx, i: f"/api/accounts/{_account(fx)}/members/", 3, 50),
+    Budget('account-my-membership', 'get', lambda fx, i: f"/api/accounts/{_account(fx)}/alias/", 3, 50),
+    # Con el catálogo de categorías frío se suman sus dos consultas
+    Budget('account-sync', 'get', lambda fx, i: f"/api/accounts/{_account(fx)}/sync/", 8, 250),
+    Budget('account-transactions-list', 'get',
+           lambda fx, i: f"/api/accounts/{_account(fx)}/transactions/?page_size=50", 2, 100),
+    Budget('account-transactions-detail', 'get',
+           lambda fx, i: f"/api/accounts/{_account(fx)}/transactions/{fx['transaction'].id}/", 2, 50),
+    Budget('account-transactions-summary', 'get',
+           lambda fx, i: f"/api/accounts/{_account(fx)}/transactions/summary/?group_by=month", 2, 250),
+    Budget('account-transactions-export', 'get',
+           lambda fx, i: f"/api/accounts/{_account(fx)}/transactions/export/?date_from={fx['last_month']}", 2, 500),
+    Budget('account-transactions-import-transactions', 'post',
+           lambda fx, i: f"/api/accounts/{_account(fx)}/transactions/import/", 20, 500,
+           data=_import_file, data_format='multipart'),
+    Budget('account-transactions-batch', 'post',
+           lambda fx, i: f"/api/accounts/{_account(fx)}/transactions/batch/", 20, 300,
+           data=_batch_operations),
+    # Caché frío: membresía + globales + propias; con el catálogo cacheado es solo la membresía
+    Budget('account-categories-list', 'get', lambda fx, i: f"/api/accounts/{_account(fx)}/categories/", 3, 50),
+    Budget('account-categories-detail', 'get',
+           lambda fx, i: f"/api/accounts/{_account(fx)}/categories/{fx['categories']['Comida'].id}/", 2, 50),
+    Budget('account-event-rules-list', 'get', lambda fx, i: f"/api/accounts/{_account(fx)}/event-rules/", 2, 50),
+    Budget('account-event-rules-detail', 'get',
+           lambda fx, i: f"/api/accounts/{_account(fx)}/event-rules/{fx['event_rule'].id}/", 2, 50),
+    Budget('account-scheduled-rules-list', 'get',
+           lambda fx, i: f"/api/accounts/{_account(fx)}/scheduled-rules/", 2, 50),
+    Budget('account-scheduled-rules-detail', 'get',
+           lambda fx, i: f"/api/accounts/{_account(fx)}/scheduled-rules/{fx['scheduled_rule'].id}/", 2, 50),
+    Budget('insight-list', 'get', lambda fx, i: '/api/insights/', 1, 100),
+    Budget('insight-detail', 'get', lambda fx, i: f"/api/insights/{fx['insight'].id}/", 1, 50),
+
+    # Escrituras: cada iteración borra su propio objeto descartable del fixture
+    Budget('account-list', 'post', lambda fx, i: '/api/accounts/', 5, 100,
+           data=lambda fx, i: {'name': f'Nueva {i}'}),
+    Budget('account-detail', 'put', lambda fx, i: f"/api/accounts/{_account(fx)}/", 5, 100,
+           data=lambda fx, i: {'name': f'Principal {i}'}),
+    Budget('account-detail', 'patch', lambda fx, i: f"/api/accounts/{_account(fx)}/", 5, 100,
+           data=lambda fx, i: {'name': f'Principal {i}'}),
+    Budget('account-detail', 'delete', lambda fx, i: f"/api/accounts/{fx['disposable']['accounts'][i].id}/", 30, 200),
+    Budget('account-members', 'post', lambda fx, i: f"/api/accounts/{_account(fx)}/members/", 4, 100,
+           data=lambda fx, i: {'email': fx['disposable']['guests'][i].email}),
+    Budget('account-my-membership', 'patch', lambda fx, i: f"/api/accounts/{_account(fx)}/alias/", 4, 50,
+           data=lambda fx, i: {'alias': f'Alias {i}'}),
+    # Alta: membresía, INSERT, 6 de totales (leer y escribir cada tabla) y 3 del log de cambios (+ savepoints)
+    Budget('account-transactions-list', 'post', lambda fx, i: _nested(fx, 'transactions'), 13, 100,
+           data=_transaction_data),
+    # Modificación: relee la fila y aplica a los totales la versión vieja (resta) y la nueva (suma)
+    Budget('account-transactions-detail', 'put',
+           lambda fx, i: _nested(fx, 'transactions', fx['transaction'].id), 21, 100, data=_transaction_data),
+    Budget('account-transactions-detail', 'patch',
+           lambda fx, i: _nested(fx, 'transactions', fx['transaction'].id), 21, 100,
+           data=lambda fx, i: {'amount': f'{i + 2}.75'}),
+    Budget('account-transactions-detail', 'delete',
+           lambda fx, i: _nested(fx, 'transactions', fx['disposable']['transactions'][i].id), 14, 100),
+    Budget('account-categories-list', 'post', lambda fx, i: _nested(fx, 'categories'), 8, 100,
+           data=lambda fx, i: {'name': f'Nueva {i}'}),
+    Budget('account-categories-detail', 'put',
+           lambda fx, i: _nested(fx, 'categories', fx['custom_category'].id), 8, 100,
+           data=lambda fx, i: {'name': f'Renombrada {i}'}),
+    Budget('account-categories-detail', 'patch',
+           lambda fx, i: _nested(fx, 'categories', fx['custom_category'].id), 9, 100,
+           data=lambda fx, i: {'name': f'Renombrada otra vez {i}'}),
+    Budget('account-categories-detail', 'delete',
+           lambda fx, i: _nested(fx, 'categories', fx['disposable']['categories'][i].id), 19, 100),
+    Budget('account-event-rules-list', 'post', lambda fx, i: _nested(fx, 'event-rules'), 8, 100,
+           data=_event_rule_data),
+    Budget('account-event-rules-detail', 'put',
+           lambda fx, i: _nested(fx, 'event-rules', fx['event_rule'].id), 8, 100, data=_event_rule_data),
+    Budget('account-event-rules-detail', 'patch',
+           lambda fx, i: _nested(fx, 'event-rules', fx['event_rule'].id), 8, 100,
+           data=lambda fx, i: {'name': f'Regla editada {i}'}),
+    Budget('account-event-rules-detail', 'delete',
+           lambda fx, i: _nested(fx, 'event-rules', fx['disposable']['event_rules'][i].id), 8, 100),
+    Budget('account-scheduled-rules-list', 'post', lambda fx, i: _nested(fx, 'scheduled-rules'), 8, 100,
+           data=_scheduled_rule_data),
+    Budget('account-scheduled-rules-detail', 'put',
+           lambda fx, i: _nested(fx, 'scheduled-rules', fx['scheduled_rule'].id), 8, 100,
+           data=_scheduled_rule_data),
+    Budget('account-scheduled-rules-detail', 'patch',
+           lambda fx, i: _nested(fx, 'scheduled-rules', fx['scheduled_rule'].id), 8, 100,
+           data=lambda fx, i: {'name': f'Programada editada {i}'}),
+    Budget('account-scheduled-rules-detail', 'delete',
+           lambda fx, i: _nested(fx, 'scheduled-rules', fx['disposable']['scheduled_rules'][i].id), 8, 100),
+]
+
+
+def route_methods(callback):
+    """
+    Métodos HTTP que atiende una vista: los de las acciones de un ViewSet
+    o los handlers de una APIView.
+    """
+    actions = getattr(callback, 'actions', None)
+    methods = actions or [
+        method for method in callback.view_class.http_method_names if hasattr(callback.view_class, method)
+    ]
+    # HEAD y OPTIONS los resuelve el framework a partir de GET
+    return set(methods) - {'head', 'options'}
+
+
+def registered_api_routes():
+    """
+    Pares (nombre, método) de todas las rutas registradas bajo /api/ (apps/*/urls.py).
+    """
+    def walk(patterns, prefix=''):
+        for pattern in patterns:
+            if isinstance(pattern, URLResolver):
+                yield from walk(pattern.url_patterns, prefix + str(pattern.pattern))
+            elif pattern.name:
+                yield prefix + str(pattern.pattern), pattern
+    return {
+        (pattern.name, method)
+        for path, pattern in walk(get_resolver().url_patterns) if path.startswith('api/')
+        for method in route_methods(pattern.callback)
+    }
+
+
+def seed_fixture():
+    """
+    Crea un escenario realista: un usuario Premium con muchas cuentas
+    compartidas, categorías propias, reglas, consejos y un historial grande
+    de transacciones concentrado en su cuenta principal.
+    """
+    rng = random.Random(1234)
+    today = timezone.now().date()
+
+    user = CustomUser.objects.create_user('owner@test.com', PASSWORD, first_name='Owner', role=CustomUser.Role.PREMIUM)
+    others = [
+        CustomUser.objects.create_user(f'member{i}@test.com', PASSWORD, first_name=f'Miembro {i}')
+        for i in range(MEMBERS_PER_ACCOUNT * 4)
+    ]
+
+    global_categories = {
+        name: Category.objects.create(name=name)
+        for name in ['Sueldo', 'Alquiler', 'Comida', 'Ocio', 'Transporte', 'Ahorro', 'Salud', 'Servicios']
+    }
+
+    accounts = []
+    for i in range(FIXTURE_ACCOUNTS):
+        account = Account.objects.create(name=f'Cuenta {i:02d}', owner=user)
+        Membership.objects.create(user=user, account=account, alias=f'Mi cuenta {i}' if i % 3 == 0 else None)
+        for member in rng.sample(others, MEMBERS_PER_ACCOUNT):
+            Membership.objects.create(user=member, account=account)
+        for n in range(CUSTOM_CATEGORIES_PER_ACCOUNT):
+            Category.objects.create(name=f'Propia {n}', account=account)
+        for n in range(RULES_PER_ACCOUNT):
+            EventRule.objects.create(
+                account=account, name=f'Regla {n}', created_by=user,
+                trigger_category=global_categories['Sueldo'], trigger_transaction_type=TransactionType.INCOME,
+                action_type=ActionType.PERCENTAGE, action_destination_category=global_categories['Ahorro'],
+                action_percentage=Decimal('5.00'), is_active=n == 0,
+            )
+            ScheduledRule.objects.create(
+                account=account, name=f'Programada {n}', created_by=user, schedule_day_of_month=n + 1,
+                source_category=global_categories['Sueldo'], action_type=ActionType.FIXED,
+                action_destination_category=global_categories['Ahorro'], action_fixed_amount=Decimal('100.00'),
+            )
+        accounts.append(account)
+
+    # El 90% del historial va a la cuenta principal, el resto se reparte
+    main_account = accounts[0]
+    expense_categories = [c for name, c in global_categories.items() if name not in ('Sueldo', 'Ahorro')]
+    batch = []
+    for n in range(FIXTURE_TRANSACTIONS):
+        account = main_account if rng.random() < 0.9 else rng.choice(accounts)
+        is_income = rng.random() < 0.05
+        batch.append(Transaction(
+            account=account,
+            category=global_categories['Sueldo'] if is_income else rng.choice(expense_categories),
+            amount=Decimal(rng.randint(100, 200_000)) / 100,
+            description='Sueldo' if is_income else f'Gasto {n % 50}',
+            date=today - timedelta(days=rng.randint(0, 365 * 3)),
+            transaction_type=TransactionType.INCOME if is_income else TransactionType.EXPENSE,
+        ))
+        if len(batch) == 10_000:
+            Transaction.objects.bulk_create(batch)
+            batch = []
+    Transaction.objects.bulk_create(batch)
+    rebuild_materialized_totals()
+
+    insights = [
+        FinancialInsight.objects.create(user=user, title=f'Consejo {i}', message='Ahorrá más.')
+        for i in range(20)
+    ]
+
+    # Un objeto por iteración para los presupuestos de DELETE (y usuarios para invitar)
+    disposable = {'accounts': [], 'guests': [], 'transactions': [], 'categories': [],
+                  'event_rules': [], 'scheduled_rules': []}
+    for i in range(ITERATIONS):
+        account = Account.objects.create(name=f'Descartable {i}', owner=user)
+        Membership.objects.create(user=user, account=account)
+        disposable['accounts'].append(account)
+        disposable['guests'].append(CustomUser.objects.create_user(f'invitado{i}@test.com', PASSWORD, first_name='Invitado'))
+        disposable['transactions'].append(Transaction.objects.create(
+            account=main_account, category=global_categories['Comida'], amount=Decimal('3.00'),
+            description=f'Descartable {i}', date=today, transaction_type=TransactionType.EXPENSE,
+        ))
+        disposable['categories'].append(Category.objects.create(name=f'Descartable {i}', account=main_account))
+        disposable['event_rules'].append(EventRule.objects.create(
+            account=main_account, name=f'Descartable {i}', created_by=user, is_active=False,
+            trigger_category=global_categories['Sueldo'], trigger_transaction_type=TransactionType.INCOME,
+            action_type=ActionType.FIXED, action_destination_category=global_categories['Ahorro'],
+            action_fixed_amount=Decimal('1.00'),
+        ))
+        disposable['scheduled_rules'].append(ScheduledRule.objects.create(
+            account=main_account, name=f'Descartable {i}', created_by=user, schedule_day_of_month=1,
+            source_category=global_categories['Sueldo'], action_type=ActionType.FIXED,
+            action_destination_category=global_categories['Ahorro'], action_fixed_amount=Decimal('1.00'),
+        ))
+
+    return {
+        'user': user,
+        'account': main_account,
+        'categories': global_categories,
+        'transaction': Transaction.objects.filter(account=main_account).first(),
+        'event_rule': EventRule.objects.filter(account=main_account).first(),
+        'scheduled_rule': ScheduledRule.objects.filter(account=main_account).first(),
+        'insight': insights[0],
+        'custom_category': Category.objects.filter(account=main_account).first(),
+        'last_month': (today - timedelta(days=30)).isoformat(),
+        'disposable': disposable,
+    }
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class EndpointBudgetTests(TestCase):
+    """
+    Recorre todas las rutas de la API sobre un fixture grande y falla si
+    alguna supera su presupuesto de consultas SQL o de latencia p95.
+    Detecta regresiones N+1 que de otro modo pasarían desapercibidas.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.fixture = seed_fixture()
+        cls.fixture['user'].is_staff = True  # /api/users/ es solo para administradores
+        cls.fixture['user'].save()
+
+    def setUp(self):
+        from rest_framework_simplejwt.tokens import RefreshToken
+        # Las invalidaciones esperan al commit, que nunca llega dentro de un TestCase
+        cache.clear()
+        self.fixture['refresh'] = str(RefreshToken.for_user(self.fixture['user']))
+
+    def test_every_route_has_a_budget(self):
+        missing = registered_api_routes() - {(budget.route, budget.method) for budget in BUDGETS}
+        self.assertFalse(missing, f"Rutas sin presupuesto declarado: {sorted(missing)}")
+
+    def test_endpoints_within_budget(self):
+        failures = []
+        for budget in BUDGETS:
+            client = APIClient()
+            if budget.authenticate:
+                client.force_authenticate(self.fixture['user'])
+
+            timings = []
+            max_queries = 0
+            gc.collect()
+            for i in range(ITERATIONS):
+                path = budget.path(self.fixture, i)
+                kwargs = {}
+                if budget.data:
+                    kwargs = {'data': budget.data(self.fixture, i), 'format': budget.data_format}
+                # Como timeit: una pausa del recolector de basura no es latencia del endpoint
+                gc.disable()
+                try:
+                    with CaptureQueriesContext(connection) as queries:
+                        start = time.perf_counter()
+                        response = getattr(client, budget.method)(path, **kwargs)
+                        if response.streaming:
+                            b''.join(response.streaming_content)
+                        elapsed = (time.perf_counter() - start) * 1000
+                finally:
+                    gc.enable()
+                self.assertLess(response.status_code, 400, f"{budget.route} {budget.method} respondió {response.status_code}")
+                timings.append(elapsed)
+                max_queries = max(max_queries, len(queries))
+
+            timings.sort()
+            p95 = timings[ceil(0.95 * len(timings)) - 1]
+            if max_queries > budget.max_queries:
+                failures.append(f"{budget.route} {budget.method}: {max_queries} consultas (presupuesto {budget.max_queries})")
+            if p95 > budget.p95_ms * LATENCY_SCALE:
+                failures.append(f"{budget.route} {budget.method}: p95 {p95:.1f} ms (presupuesto {budget.p95_ms * LATENCY_SCALE:.0f} ms)")
+
+        self.assertFalse(failures, "Endpoints fuera de presupuesto:\n" + "\n".join(failures))
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class CategoryCatalogCacheTests(TestCase):
+    """
+    El catálogo de categorías se sirve desde el caché, con ETag, y se
+    invalida al escribir cualquier categoría.
+    """
+
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.user = CustomUser.objects.create_user(
+            'owner@test.com', PASSWORD, first_name='Owner', role=CustomUser.Role.PREMIUM
+        )
+        self.account = Account.objects.create(name='Cuenta', owner=self.user)
+        Membership.objects.create(user=self.user, account=self.account)
+        self.other_account = Account.objects.create(name='Otra', owner=self.user)
+        self.global_category = Category.objects.create(name='Comida')
+        self.foreign_category = Category.objects.create(name='Ajena', account=self.other_account)
+        self.url = f'/api/accounts/{self.account.id}/categories/'
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_list_is_served_from_cache(self):
+        first = self.client.get(self.url)
+        # Con el catálogo cacheado solo queda la verificación de membresía
+        with self.assertNumQueries(1):
+            second = self.client.get(self.url)
+        self.assertEqual(first.json(), second.json())
+        self.assertEqual(first['ETag'], second['ETag'])
+        self.assertEqual([c['name'] for c in second.json()], ['Comida'])
+
+    def test_if_none_match_returns_304(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_category_writes_invalidate_catalog(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.post(self.url, {'name': 'Propia'}, format='json')
+        self.assertEqual(response.status_code, 201)
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual([c['name'] for c in response.json()], ['Comida', 'Propia'])
+
+        etag = response['ETag']
+        self.global_category.delete()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual([c['name'] for c in response.json()], ['Propia'])
+
+    def test_etag_survives_losing_the_cache(self):
+        # Otro proceso (o un caché local vacío) tiene que ver la misma versión
+        etag = self.client.get(self.url)['ETag']
+        cache.clear()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        Category.objects.create(name='Propia', account=self.account)
+        cache.clear()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([c['name'] for c in response.json()], ['Comida', 'Propia'])
+
+    def test_transaction_rejects_category_of_another_account(self):
+        url = f'/api/accounts/{self.account.id}/transactions/'
+        data = {'amount': '10.00', 'date': '2025-01-01', 'description': 'Almuerzo', 'transaction_type': 'EXPENSE'}
+        response = self.client.post(url, {**data, 'category': self.foreign_category.id}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('category', response.json())
+
+        response = self.client.post(url, {**data, 'category': self.global_category.id}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['category'], self.global_category.id)
+
+
+class StaleCategoryCatalogTests(TransactionTestCase):
+    """
+    Si el catálogo cacheado todavía tiene una categoría ya borrada, la base
+    rechaza la escritura y la API responde 400 en lugar de 500.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user('owner@test.com', PASSWORD, first_name='Owner')
+        self.account = Account.objects.create(name='Cuenta', owner=self.user)
+        Membership.objects.create(user=self.user, account=self.account)
+        self.category = Category.objects.create(name='Propia', account=self.account)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_deleted_category_in_stale_catalog_returns_400(self):
+        account = Account.objects.get(pk=self.account.pk)
+        get_category_catalog(account)
+        self.category.delete()
+        # Simula un proceso que todavía usa la versión anterior del catálogo
+        Account.objects.filter(pk=account.pk).update(category_version=account.category_version)
+
+        response = self.client.post(f'/api/accounts/{self.account.id}/transactions/', {
+            'amount': '10.00', 'date': '2025-01-01', 'description': 'Almuerzo',
+            'transaction_type': 'EXPENSE', 'category': self.category.id,
+        }, format='json')
+        self.assertEqual(response.status_code, 400, response.content)
+        self.assertIn('category', response.json())
+        self.assertFalse(Transaction.objects.filter(account=self.account).exists())
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ConditionalGetTests(TestCase):
+    """
+    Los listados y el resumen devuelven ETag basado en la versión de cambios
+    de la cuenta y responden 304 mientras nada cambie.
+    """
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            'owner@test.com', PASSWORD, first_name='Owner', role=CustomUser.Role.PREMIUM
+        )
+        self.account = Account.objects.create(name='Cuenta', owner=self.user)
+        Membership.objects.create(user=self.user, account=self.account)
+        self.category = Category.objects.create(name='Comida')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.base = f'/api/accounts/{self.account.id}'
+
+    def create_transaction(self):
+        return Transaction.objects.create(
+            account=self.account, category=self.category, amount=Decimal('10.00'),
+            description='Almuerzo', transaction_type=TransactionType.EXPENSE,
+        )
+
+    def test_unchanged_list_returns_304(self):
+        self.create_transaction()
+        for path in ('/transactions/', '/transactions/summary/', '/event-rules/', '/scheduled-rules/'):
+            etag = self.client.get(self.base + path)['ETag']
+            # Solo se verifica la membresía: no se consulta ni serializa el listado
+            with self.assertNumQueries(1):
+                response = self.client.get(self.base + path, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304, path)
+            self.assertEqual(response['ETag'], etag)
+
+    def test_writes_change_the_etag(self):
+        list_url = self.base + '/transactions/'
+        etag = self.client.get(list_url)['ETag']
+
+        transaction = self.create_transaction()
+        response = self.client.get(list_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 1)
+        etag = response['ETag']
+
+        transaction.delete()
+        response = self.client.get(list_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [])
+        etag = response['ETag']
+
+        Category.objects.create(name='Propia', account=self.account)
+        self.assertEqual(self.client.get(list_url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_rule_writes_change_the_etag(self):
+        rules_url = self.base + '/event-rules/'
+        etag = self.client.get(rules_url)['ETag']
+        EventRule.objects.create(
+            account=self.account, name='Ahorro', created_by=self.user,
+            trigger_category=self.category, trigger_transaction_type=TransactionType.INCOME,
+            action_type=ActionType.FIXED, action_destination_category=self.category,
+            action_fixed_amount=Decimal('5.00'),
+        )
+        response = self.client.get(rules_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 1)
+
+    def test_etag_depends_on_query_string(self):
+        url = self.base + '/transactions/summary/'
+        self.assertNotEqual(
+            self.client.get(url)['ETag'],
+            self.client.get(url + '?group_by=month')['ETag'],
+        )
+
+    def test_other_members_etag_is_not_served_to_non_members(self):
+        etag = self.client.get(self.base + '/transactions/')['ETag']
+        other = CustomUser.objects.create_user('other@test.com', PASSWORD, first_name='Otro')
+        self.client.force_authenticate(other)
+        response = self.client.get(self.base + '/transactions/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 404)
+
+
+class BenchmarkLedgerCommandTests(TestCase):
+    """
+    El benchmark quita índices: sobre la base configurada solo corre si se lo permite.
+    """
+
+    @override_settings(DEBUG=False)
+    def test_configured_database_requires_explicit_permission(self):
+        with self.assertRaisesMessage(CommandError, '--allow-schema-changes'):
+            call_command('benchmark_ledger', '--configured-database', '--rows', '1', stdout=StringIO())
+        self.assertFalse(CustomUser.objects.filter(email='benchmark@gestor.local').exists())
+
+
+class MaterializedTotalsAssertions:
+    """
+    Compara los saldos y rollups incrementales con recalcularlos desde las transacciones.
+    """
+
+    def assertTotalsMatchTransactions(self):
+        for model in (CategoryBalance, DailyRollup, MonthlyRollup):
+            keys = len(model.objects.key_fields)
+            materialized = {
+                row[:keys]: row[keys:]
+                for row in model.objects.values_list(*model.objects.key_fields, *model.objects.value_fields)
+                # Las filas que quedaron en cero equivalen a no tener fila
+                if any(row[keys:])
+            }
+            self.assertEqual(materialized, model.objects.aggregate_from_transactions(), model.__name__)
+
+
+class TransactionImportTests(MaterializedTotalsAssertions, TestCase):
+    """
+    El import de extractos CSV y OFX: filas inválidas, categoría por defecto,
+    reglas de evento y totales materializados.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user('owner@test.com', PASSWORD, first_name='Owner')
+        self.account = Account.objects.create(name='Cuenta', owner=self.user)
+        Membership.objects.create(user=self.user, account=self.account)
+        self.food = Category.objects.create(name='Comida')
+        self.salary = Category.objects.create(name='Sueldo')
+        self.savings = Category.objects.create(name='Ahorro')
+        # Una categoría propia con el mismo nombre que una global tiene prioridad
+        self.own_food = Category.objects.create(name='comida', account=self.account)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = f'/api/accounts/{self.account.id}/transactions/import/'
+
+    def upload(self, content, name='extracto.csv', **data):
+        upload = SimpleUploadedFile(name, content.encode())
+        return self.client.post(self.url, {'file': upload, **data}, format='multipart')
+
+    def test_csv_rows_are_imported(self):
+        response = self.upload(
+            '\ufeffDate,Description,Amount,Category,Transaction_Type\n'
+            '2024-06-01,Supermercado,-1500.50,Comida,\n'
+            '02/06/2024,Sueldo,"250000,00",Sueldo,\n'
+            f'2024-06-03,Reintegro,20,{self.food.id},INCOME\n'
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.json(), {'created': 3, 'rules_created': 0, 'error_count': 0, 'errors': []})
+        self.assertEqual(
+            list(Transaction.objects.order_by('date').values_list('date', 'category', 'amount', 'transaction_type')),
+            [
+                (date(2024, 6, 1), self.own_food.id, Decimal('1500.50'), 'EXPENSE'),
+                (date(2024, 6, 2), self.salary.id, Decimal('250000.00'), 'INCOME'),
+                (date(2024, 6, 3), self.food.id, Decimal('20.00'), 'INCOME'),
+            ],
+        )
+        self.assertTotalsMatchTransactions()
+
+    def test_bad_rows_are_reported_and_the_rest_imported(self):
+        response = self.upload(
+            'date,description,amount,category\n'
+            '2024-13-01,Fecha mala,10,Comida\n'
+            '2024-06-01,Monto malo,diez,Comida\n'
+            '2024-06-01,Monto cero,0,Comida\n'
+            '2024-06-01,,10,Comida\n'
+            '2024-06-01,Sin categoría,10,\n'
+            '2024-06-01,Categoría ajena,10,Inexistente\n'
+            '2024-06-01,Enorme,100000000,Comida\n'
+            '2024-06-01,Válida,10,Comida\n'
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        result = response.json()
+        self.assertEqual((result['created'], result['error_count']), (1, 7))
+        self.assertEqual([error['row'] for error in result['errors']], [2, 3, 4, 5, 6, 7, 8])
+        self.assertEqual(result['errors'][1]['error'], "Monto inválido: 'diez'.")
+        self.assertEqual(Transaction.objects.get().description, 'Válida')
+
+        response = self.upload('date,description,amount,category\n2024-06-01,Mala,x,Comida\n')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['created'], 0)
+
+    def test_latin1_rows_are_decoded(self):
+        rows = ''.join(f'2024-06-01,Compra {n},-1,Comida\n' for n in range(1500))
+        content = ('date,description,amount,category\n' + rows).encode() + '2024-06-02,Panadería,-2,Comida\n'.encode('latin-1')
+        upload = SimpleUploadedFile('extracto.csv', content)
+        response = self.client.post(self.url, {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.json()['created'], 1501)
+        self.assertTrue(Transaction.objects.filter(description='Panadería').exists())
+        self.assertTotalsMatchTransactions()
+
+    def test_unreadable_csv_is_rejected_without_partial_import(self):
+        rows = ''.join(f'2024-06-01,Compra {n},-1,Comida\n' for n in range(1500))
+        broken = '2024-06-02,"' + 'x' * 200_000 + '",-2,Comida\n'
+        response = self.upload('date,description,amount,category\n' + rows + broken)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['row'], 1502)
+        self.assertIn('CSV inválido en la fila 1502', response.json()['error'])
+        self.assertFalse(Transaction.objects.exists())
+        self.assertFalse(CategoryBalance.objects.filter(expense_total__gt=0).exists())
+
+    def test_default_category_fills_rows_without_one(self):
+        response = self.upload(
+            'date,description,amount,category\n'
+            '2024-06-01,Sin categoría,-10,\n'
+            '2024-06-01,Con categoría,-10,Sueldo\n',
+            category='Ahorro',
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(
+            dict(Transaction.objects.values_list('description', 'category')),
+            {'Sin categoría': self.savings.id, 'Con categoría': self.salary.id},
+        )
+
+        response = self.upload('date,description,amount,category\n', category='Inexistente')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': "Categoría 'Inexistente' no encontrada para esta cuenta."})
+
+    def test_ofx_sgml_and_xml(self):
+        sgml = (
+            'OFXHEADER:100\nDATA:OFXSGML\n\n<OFX>\n<BANKMSGSRSV1>\n<STMTTRNRS>\n<STMTRS>\n<BANKTRANLIST>\n'
+            '<STMTTRN>\n<TRNTYPE>DEBIT\n<DTPOSTED>20240601120000[-3:ART]\n<TRNAMT>-45.10\n<NAME>Farmacia\n</STMTTRN>\n'
+            '<STMTTRN>\n<TRNTYPE>CREDIT\n<DTPOSTED>20240602\n<TRNAMT>900.00\n<MEMO>Transferencia\n</STMTTRN>\n'
+            '<STMTTRN>\n<TRNTYPE>DEBIT\n<DTPOSTED>fecha\n<TRNAMT>-1\n<NAME>Mala\n</STMTTRN>\n'
+            '</BANKTRANLIST>\n</STMTRS>\n</STMTTRNRS>\n</BANKMSGSRSV1>\n</OFX>\n'
+        )
+        response = self.upload(sgml, name='extracto.ofx', category='Comida')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual((response.json()['created'], response.json()['errors']),
+                         (2, [{'row': 3, 'error': "Fecha inválida: 'fecha'."}]))
+
+        xml = (
+            '<?xml version="1.0" encoding="UTF-8"?>\n<?OFX OFXHEADER="200" VERSION="220"?>\n'
+            '<OFX><BANKMSGSRSV1><STMTTRNRS><STMTRS><BANKTRANLIST>'
+            '<STMTTRN><TRNTYPE>DEBIT</TRNTYPE><DTPOSTED>20240603</DTPOSTED><TRNAMT>-12.00</TRNAMT>'
+            '<NAME>Kiosco</NAME></STMTTRN>'
+            '</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>'
+        )
+        response = self.upload(xml, name='extracto.xml', format='ofx', category='Comida')
+        self.assertEqual(response.status_code, 201, response.content)
+
+        self.assertEqual(
+            list(Transaction.objects.order_by('date').values_list('date', 'description', 'amount', 'transaction_type')),
+            [
+                (date(2024, 6, 1), 'Farmacia', Decimal('45.10'), 'EXPENSE'),
+                (date(2024, 6, 2), 'Transferencia', Decimal('900.00'), 'INCOME'),
+                (date(2024, 6, 3), 'Kiosco', Decimal('12.00'), 'EXPENSE'),
+            ],
+        )
+        self.assertTotalsMatchTransactions()
+
+    def test_unknown_format_is_rejected(self):
+        response = self.upload('date,description\n', name='extracto.xls')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_event_rules_derive_rows_and_totals_stay_consistent(self):
+        EventRule.objects.create(
+            account=self.account, name='Ahorro', created_by=self.user,
+            trigger_category=self.salary, trigger_transaction_type=TransactionType.INCOME,
+            action_type=ActionType.PERCENTAGE, action_destination_category=self.savings,
+            action_percentage=Decimal('10.00'),
+        )
+        rows = ''.join(f'2024-06-{day:02d},Sueldo {day},1000,Sueldo\n' for day in range(1, 6))
+        response = self.upload('date,description,amount,category\n' + rows + '2024-06-06,Café,-3,Comida\n')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual((response.json()['created'], response.json()['rules_created']), (6, 5))
+
+        derived = Transaction.objects.filter(created_by_rule=True)
+        self.assertEqual(derived.count(), 5)
+        self.assertTrue(all(t.category_id == self.savings.id and t.amount == Decimal('100.00') for t in derived))
+        self.assertEqual(
+            CategoryBalance.objects.get(account=self.account, category=self.savings).expense_total, Decimal('500.00')
+        )
+        self.assertTotalsMatchTransactions()
+        # Cada fila (importada o derivada) queda en el log de cambios de la cuenta
+        self.assertEqual(self.account.changes.filter(kind=AccountChange.Kind.TRANSACTION).count(), 11)
+
+
+class TransactionBatchTests(MaterializedTotalsAssertions, TestCase):
+    """
+    El endpoint batch: todo o nada, validación por ítem y totales materializados.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user('owner@test.com', PASSWORD, first_name='Owner')
+        self.account = Account.objects.create(name='Cuenta', owner=self.user)
+        Membership.objects.create(user=self.user, account=self.account)
+        self.category = Category.objects.create(name='Comida')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = f'/api/accounts/{self.account.id}/transactions/batch/'
+
+    def create_transaction(self, amount='10.00', account=None):
+        return Transaction.objects.create(
+            account=account or self.account, category=self.category, amount=Decimal(amount),
+            description='Almuerzo', transaction_type=TransactionType.EXPENSE,
+        )
+
+    def post(self, operations):
+        return self.client.post(self.url, {'operations': operations}, format='json')
+
+    def test_malformed_ids_are_reported_per_item(self):
+        transaction = self.create_transaction()
+        response = self.post([
+            {'op': 'delete', 'id': [transaction.id]},
+            {'op': 'update', 'id': {'pk': transaction.id}, 'data': {'description': 'X'}},
+            {'op': 'delete', 'id': True},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            [result['errors'] for result in response.json()['results']],
+            [{'id': "Debe ser el id numérico de una transacción."}] * 3,
+        )
+        self.assertTrue(Transaction.objects.filter(pk=transaction.pk).exists())
+
+    def test_numeric_string_ids_are_accepted(self):
+        transaction = self.create_transaction()
+        response = self.post([{'op': 'delete', 'id': str(transaction.id)}])
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Transaction.objects.filter(pk=transaction.pk).exists())
+
+    def test_one_invalid_item_rejects_the_whole_batch(self):
+        to_update, to_delete = self.create_transaction(), self.create_transaction()
+        version = Account.objects.get(pk=self.account.pk).change_version
+        response = self.post([
+            {'op': 'create', 'data': {'amount': '5.00', 'date': '2024-06-01', 'description': 'Café',
+                                      'category': self.category.id, 'transaction_type': 'EXPENSE'}},
+            {'op': 'update', 'id': to_update.id, 'data': {'amount': '99.00'}},
+            {'op': 'delete', 'id': to_delete.id},
+            {'op': 'create', 'data': {'amount': '5.00', 'date': 'ayer', 'description': 'Mala',
+                                      'category': self.category.id, 'transaction_type': 'EXPENSE'}},
+            {'op': 'move', 'id': to_delete.id},
+        ])
+        self.assertEqual(response.status_code, 400)
+        results = response.json()['results']
+        self.assertEqual([index for index, result in enumerate(results) if 'errors' in result], [3, 4])
+        self.assertIn('date', results[3]['errors'])
+
+        # Nada se aplicó: ni el alta válida, ni el cambio, ni la baja
+        self.assertEqual(Transaction.objects.count(), 2)
+        to_update.refresh_from_db()
+        self.assertEqual(to_update.amount, Decimal('10.00'))
+        self.assertEqual(CategoryBalance.objects.get().expense_total, Decimal('20.00'))
+        self.assertEqual(Account.objects.get(pk=self.account.pk).change_version, version)
+
+    def test_duplicate_ids_are_rejected(self):
+        transaction = self.create_transaction()
+        response = self.post([
+            {'op': 'update', 'id': transaction.id, 'data': {'amount': '20.00'}},
+            {'op': 'delete', 'id': str(transaction.id)},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['results'][1]['errors'], {'id': "Hay más de una operación sobre esta transacción."})
+        self.assertTrue(Transaction.objects.filter(pk=transaction.pk, amount=Decimal('10.00')).exists())
+
+    def test_transactions_of_another_account_are_not_found(self):
+        other_account = Account.objects.create(name='Ajena', owner=self.user)
+        foreign = self.create_transaction(account=other_account)
+        foreign_category = Category.objects.create(name='Propia', account=other_account)
+        response = self.post([
+            {'op': 'update', 'id': foreign.id, 'data': {'amount': '1.00'}},
+            {'op': 'delete', 'id': foreign.id + 1000},
+            {'op': 'create', 'data': {'amount': '5.00', 'date': '2024-06-01', 'description': 'Café',
+                                      'category': foreign_category.id, 'transaction_type': 'EXPENSE'}},
+        ])
+        self.assertEqual(response.status_code, 400)
+        results = response.json()['results']
+        self.assertEqual([result['errors'].get('id') for result in results[:2]],
+                         ["Transacción no encontrada en esta cuenta."] * 2)
+        self.assertIn('category', results[2]['errors'])
+
+        response = self.post([{'op': 'delete', 'id': foreign.id}])
+        self.assertEqual(response.status_code, 400)
+        foreign.refresh_from_db()
+        self.assertEqual(foreign.amount, Decimal('10.00'))
+
+    def test_mixed_batch_keeps_materialized_totals_consistent(self):
+        salary = Category.objects.create(name='Sueldo')
+        savings = Category.objects.create(name='Ahorro')
+        EventRule.objects.create(
+            account=self.account, name='Ahorro', created_by=self.user,
+            trigger_category=salary, trigger_transaction_type=TransactionType.INCOME,
+            action_type=ActionType.PERCENTAGE, action_destination_category=savings,
+            action_percentage=Decimal('10.00'),
+        )
+        to_update, to_move, to_delete = (self.create_transaction() for _ in range(3))
+        version = Account.objects.get(pk=self.account.pk).change_version
+
+        response = self.post([
+            {'op': 'create', 'data': {'amount': '1000.00', 'date': '2024-06-01', 'description': 'Sueldo',
+                                      'category': salary.id, 'transaction_type': 'INCOME'}},
+            {'op': 'create', 'data': {'amount': '4.50', 'date': '2024-06-02', 'description': 'Café',
+                                      'category': self.category.id, 'transaction_type': 'EXPENSE'}},
+            {'op': 'update', 'id': to_update.id, 'data': {'amount': '12.25', 'date': '2024-05-31'}},
+            {'op': 'update', 'id': to_move.id, 'data': {'category': salary.id, 'transaction_type': 'INCOME'}},
+            {'op': 'delete', 'id': to_delete.id},
+        ])
+        self.assertEqual(response.status_code, 200, response.content)
+        results = response.json()['results']
+        self.assertEqual(results[0]['data']['amount'], '1000.00')
+        self.assertEqual(results[2]['data']['date'], '2024-05-31')
+
+        self.assertEqual(Transaction.objects.filter(created_by_rule=True).get().amount, Decimal('100.00'))
+        self.assertEqual(
+            dict(CategoryBalance.objects.values_list('category', 'expense_total')),
+            {self.category.id: Decimal('16.75'), salary.id: Decimal('0.00'), savings.id: Decimal('100.00')},
+        )
+        self.assertTotalsMatchTransactions()
+
+        # Todo el lote (incluida la fila derivada y la baja) comparte una sola versión nueva
+        self.assertEqual(Account.objects.get(pk=self.account.pk).change_version, version + 1)
+        self.assertEqual(self.account.changes.filter(version=version + 1).count(), 6)
+        self.assertTrue(self.account.changes.get(kind=AccountChange.Kind.TRANSACTION, object_id=to_delete.id).deleted)
+
+
+class MaterializedTotalsTests(MaterializedTotalsAssertions, TestCase):
+    """
+    Los saldos y rollups incrementales coinciden con recalcularlos desde las transacciones.
+    """
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user('owner@test.com', PASSWORD, first_name='Owner')
+        self.account = Account.objects.create(name='Cuenta', owner=self.user)
+        self.food = Category.objects.create(name='Comida')
+        self.salary = Category.objects.create(name='Sueldo')
+
+    def test_string_dates_and_float_amounts_are_normalized(self):
+        Transaction.objects.create(
+            account=self.account, category=self.food, amount=0.1, description='Caramelo',
+            date='2024-01-31', transaction_type=TransactionType.EXPENSE,
+        )
+        Transaction.objects.create(
+            account=self.account, category=self.food, amount=0.2, description='Chicle',
+            date='2024-01-31', transaction_type=TransactionType.EXPENSE,
+        )
+        self.assertEqual(DailyRollup.objects.get().period, date(2024, 1, 31))
+        self.assertEqual(MonthlyRollup.objects.get().period, date(2024, 1, 1))
+        self.assertEqual(CategoryBalance.objects.get().expense_total, Decimal('0.30'))
+        self.assertTotalsMatchTransactions()
+
+    def create(self, amount, category=None, transaction_type=TransactionType.EXPENSE, day=date(2024, 3, 15)):
+        return Transaction.objects.create(
+            account=self.account, category=category or self.food, amount=Decimal(amount),
+            description='Movimiento', date=day, transaction_type=transaction_type,
+        )
+
+    def test_create_update_and_delete_keep_totals_in_sync(self):
+        lunch = self.create('12.50')
+        salary = self.create('1000.00', self.salary, TransactionType.INCOME, date(2024, 3, 1))
+        self.create('7.25', day=date(2024, 4, 2))
+        self.assertTotalsMatchTransactions()
+
+        lunch.amount = Decimal('15.00')
+        lunch.save()
+        self.assertTotalsMatchTransactions()
+        # Cambiar categoría, tipo y mes mueve el monto entre filas
+        lunch.category, lunch.transaction_type, lunch.date = self.salary, TransactionType.INCOME, date(2024, 5, 31)
+        lunch.save()
+        self.assertTotalsMatchTransactions()
+        self.assertEqual(CategoryBalance.objects.get(category=self.salary).income_total, Decimal('1015.00'))
+
+        salary.delete()
+        lunch.delete()
+        self.assertTotalsMatchTransactions()
+        self.assertEqual(CategoryBalance.objects.get(category=self.food).expense_total, Decimal('7.25'))
+        self.assertEqual(CategoryBalance.objects.get(category=self.salary).income_total, Decimal('0.00'))
+
+    def assertBalancesSurviveRebuild(self):
+        """
+        Los saldos incrementales son exactamente los que deja rebuild_category_balances.
+        """
+        incremental = {
+            row[:2]: row[2:]
+            for row in CategoryBalance.objects.values_list('account', 'category', 'income_total', 'expense_total')
+            if any(row[2:])
+        }
+        call_command('rebuild_category_balances', stdout=StringIO())
+        rebuilt = set(CategoryBalance.objects.values_list('account', 'category', 'income_total', 'expense_total'))
+        self.assertEqual({key + values for key, values in incremental.items()}, rebuilt)
+
+    def test_queryset_writes_keep_totals_in_sync(self):
+        self.create('12.50')
+        self.create('7.25', day=date(2024, 4, 2))
+        self.create('1000.00', self.salary, TransactionType.INCOME, date(2024, 3, 1))
+        version = Account.objects.get(pk=self.account.pk).change_version
+
+        updated = Transaction.objects.filter(category=self.food).update(amount=F('amount') * 2, date=date(2024, 5, 1))
+        self.assertEqual(updated, 2)
+        self.assertTotalsMatchTransactions()
+        self.assertEqual(CategoryBalance.objects.get(category=self.food).expense_total, Decimal('39.50'))
+
+        self.assertEqual(Transaction.objects.filter(amount__gt=100).delete()[0], 1)
+        self.assertTotalsMatchTransactions()
+        self.assertBalancesSurviveRebuild()
+        self.assertEqual(Account.objects.get(pk=self.account.pk).change_version, version + 2)
+        self.assertEqual(self.account.changes.filter(deleted=True).count(), 1)
+
+    def test_admin_bulk_delete_keeps_totals_in_sync(self):
+        from django.contrib import admin
+        self.create('12.50')
+        self.create('7.25', self.salary)
+        model_admin = admin.site._registry[Transaction]
+        model_admin.delete_queryset(None, Transaction.objects.filter(category=self.food))
+        self.assertTotalsMatchTransactions()
+        self.assertEqual(CategoryBalance.objects.get(category=self.food).expense_total, Decimal('0.00'))
+        self.assertBalancesSurviveRebuild()
+
+    def test_category_and_account_cascades_keep_totals_in_sync(self):
+        self.create('12.50')
+        self.create('1000.00', self.salary, TransactionType.INCOME)
+        other_account = Account.objects.create(name='Otra', owner=self.user)
+        Transaction.objects.create(
+            account=other_account, category=self.food, amount=Decimal('3.00'), description='Otra',
+            date=date(2024, 3, 15), transaction_type=TransactionType.EXPENSE,
+        )
+
+        # Las transacciones quedan sin categoría y su saldo desaparece con la categoría
+        self.food.delete()
+        self.assertTrue(Transaction.objects.filter(category__isnull=True).exists())
+        self.assertBalancesSurviveRebuild()
+
+        other_account.delete()
+        self.assertBalancesSurviveRebuild()
+        self.assertEqual(list(CategoryBalance.objects.values_list('account', 'category')),
+                         [(self.account.id, self.salary.id)])
+
+    def test_category_delete_merges_rollups_into_uncategorized_rows(self):
+        Membership.objects.create(user=self.user, account=self.account)
+        client = APIClient()
+        client.force_authenticate(self.user)
+        uncategorized = dict(account=self.account, description='Sin categoría', transaction_type=TransactionType.EXPENSE)
+        Transaction.objects.create(category=None, amount=Decimal('1.00'), date=date(2024, 3, 15), **uncategorized)
+        self.create('12.50')
+        self.create('7.25', day=date(2024, 4, 2))
+        self.create('1000.00', self.salary, TransactionType.INCOME)
+
+        self.food.delete()
+        Transaction.objects.create(category=None, amount=Decimal('2.00'), date=date(2024, 3, 15), **uncategorized)
+        self.assertTotalsMatchTransactions()
+        self.assertEqual(DailyRollup.objects.filter(category__isnull=True, period=date(2024, 3, 15)).count(), 1)
+
+        url = f'/api/accounts/{self.account.id}/transactions/summary/'
+        for params in ({}, {'date_from': '2024-03-10', 'date_to': '2024-03-20'}):
+            data = client.get(url, params).json()
+            rows = {row['category']: row for row in data['results']}
+            expected = Transaction.objects.filter(category__isnull=True, **{
+                'date__gte': params.get('date_from', '2000-01-01'), 'date__lte': params.get('date_to', '2100-01-01'),
+            }).aggregate(total=Sum('amount'), count=Count('id'))
+            self.assertEqual(Decimal(rows[None]['expense_total']), expected['total'], params)
+            self.assertEqual(rows[None]['count'], expected['count'], params)
+            self.assertEqual(Decimal(rows[self.salary.id]['income_total']), Decimal('1000.00'), params)
+
+    def test_rebuild_command_verifies_and_repairs_balances(self):
+        self.create('10.00')
+        self.create('500.00', self.salary, TransactionType.INCOME)
+        other_account = Account.objects.create(name='Otra', owner=self.user)
+        Transaction.objects.create(
+            account=other_account, category=self.food, amount=Decimal('3.00'), description='Otra',
+            date=date(2024, 3, 15), transaction_type=TransactionType.EXPENSE,
+        )
+        # Una escritura que no pasó por Transaction.save() deja los saldos desfasados
+        CategoryBalance.objects.filter(account=self.account, category=self.food).update(expense_total=Decimal('99.00'))
+
+        out, err = StringIO(), StringIO()
+        with self.assertRaisesMessage(CommandError, 'Se encontraron 1 saldos inconsistentes.'):
+            call_command('rebuild_category_balances', '--verify-only', stdout=out, stderr=err)
+        self.assertIn(f"Cuenta {self.account.id}, categoría {self.food.id}", err.getvalue())
+        # Verificar otra cuenta no mira la desfasada
+        call_command('rebuild_category_balances', '--verify-only', '--account', str(other_account.id), stdout=out)
+
+        call_command('rebuild_category_balances', '--account', str(self.account.id), stdout=out)
+        self.assertIn('Los 2 saldos coinciden con las transacciones.', out.getvalue())
+        self.assertEqual(
+            CategoryBalance.objects.get(account=self.account, category=self.food).expense_total, Decimal('10.00')
+        )
+        self.assertTotalsMatchTransactions()
+
+        with self.assertRaisesMessage(CommandError, 'Cuenta con id 0 no encontrada.'):
+            call_command('rebuild_category_balances', '--account', '0', stdout=out)
+
+    def test_concurrently_created_rows_fall_back_to_incremental_updates(self):
+        self.create('10.00')
+        # Simula otra transacción que creó las filas después de que las leímos:
+        # bulk_create choca con unique_together y se suma sobre la fila existente
+        not_found = lambda manager, keys: manager.none()
+        with mock.patch.object(CategoryBalanceManager, 'candidates', not_found), \
+                mock.patch.object(RollupManager, 'candidates', not_found):
+            self.create('5.50')
+
+        self.assertEqual(CategoryBalance.objects.get().expense_total, Decimal('15.50'))
+        self.assertEqual(MonthlyRollup.objects.get().count, 2)
+        self.assertTotalsMatchTransactions()
+
+
+class TransactionSummaryTests(TestCase):
+    """
+    El resumen sale de los rollups (mensuales si el rango son meses completos,
+    diarios si no) y coincide con sumar las transacciones del mismo rango.
+    """
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            'owner@test.com', PASSWORD, first_name='Owner', role=CustomUser.Role.PREMIUM
+        )
+        self.account = Account.objects.create(name='Cuenta', owner=self.user)
+        Membership.objects.create(user=self.user, account=self.account)
+        other_account = Account.objects.create(name='Otra', owner=self.user)
+        self.food = Category.objects.create(name='Comida')
+        self.salary = Category.objects.create(name='Sueldo')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = f'/api/accounts/{self.account.id}/transactions/summary/'
+
+        # Movimientos justo antes, en y después de cada borde de mes (2024 es bisiesto)
+        days = [date(2024, 1, 31), date(2024, 2, 1), date(2024, 2, 15), date(2024, 2, 29),
+                date(2024, 3, 1), date(2024, 3, 31), date(2024, 4, 1)]
+        for n, day in enumerate(days):
+            for account in (self.account, other_account):
+                Transaction.objects.create(
+                    account=account, category=self.food, amount=Decimal('10.10') + n, description='Gasto',
+                    date=day, transaction_type=TransactionType.EXPENSE,
+                )
+            Transaction.objects.create(
+                account=self.account, category=self.salary if n % 2 else None, amount=Decimal('500.05') * (n + 1),
+                description='Ingreso', date=day, transaction_type=TransactionType.INCOME,
+            )
+
+    def expected(self, group, date_from=None, date_to=None):
+        queryset = Transaction.objects.filter(account=self.account)
+        if date_from:
+            queryset = queryset.filter(date__gte=date_from)
+        if date_to:
+            queryset = queryset.filter(date__lte=date_to)
+        rows = queryset.order_by().values(group).annotate(
+            income=Sum('amount', filter=Q(transaction_type='INCOME')),
+            expense=Sum('amount', filter=Q(transaction_type='EXPENSE')),
+            total=Count('id'),
+        )
+        return {
+            row[group]: (
+                (row['income'] or Decimal('0')).quantize(CENTS),
+                (row['expense'] or Decimal('0')).quantize(CENTS),
+                row['total'],
+            )
+            for row in rows
+        }
+
+    def get_summary(self, rollup_table, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertTrue(any(rollup_table in query['sql'] for query in queries), params)
+        return response.json()
+
+    def assertSummaryMatches(self, data, expected, key):
+        self.assertEqual(
+            {row[key]: (Decimal(row['income_total']), Decimal(row['expense_total']), row['count'])
+             for row in data['results']},
+            expected,
+        )
+        self.assertEqual(Decimal(data['income_total']), sum(income for income, _, _ in expected.values()))
+        self.assertEqual(Decimal(data['expense_total']), sum(expense for _, expense, _ in expected.values()))
+
+    def test_whole_months_use_monthly_rollups(self):
+        for date_from, date_to in (('2024-02-01', '2024-02-29'), ('2024-01-01', '2024-03-31'), (None, None)):
+            params = {key: value for key, value in (('date_from', date_from), ('date_to', date_to)) if value}
+            data = self.get_summary('monthlyrollup', **params)
+            self.assertSummaryMatches(data, self.expected('category', date_from, date_to), 'category')
+
+    def test_partial_ranges_use_daily_rollups(self):
+        ranges = (
+            ('2024-01-31', '2024-03-01'),  # un día a cada lado de febrero
+            ('2024-02-01', '2024-02-28'),  # febrero sin su último día
+            ('2024-02-29', '2024-02-29'),
+            ('2024-03-31', None),
+        )
+        for date_from, date_to in ranges:
+            params = {key: value for key, value in (('date_from', date_from), ('date_to', date_to)) if value}
+            data = self.get_summary('dailyrollup', **params)
+            self.assertSummaryMatches(data, self.expected('category', date_from, date_to), 'category')
+
+    def test_group_by_month_on_a_partial_range(self):
+        # Enero y marzo aportan un solo día cada uno: los meses salen de los rollups diarios
+        data = self.get_summary('dailyrollup', group_by='month', date_from='2024-01-31', date_to='2024-03-01')
+        expected = {}
+        for day, (income, expense, count) in self.expected('date', '2024-01-31', '2024-03-01').items():
+            month = day.replace(day=1).isoformat()
+            totals = expected.get(month, (Decimal('0.00'), Decimal('0.00'), 0))
+            expected[month] = (totals[0] + income, totals[1] + expense, totals[2] + count)
+        self.assertEqual(sorted(expected), ['2024-01-01', '2024-02-01', '2024-03-01'])
+        self.assertSummaryMatches(data, expected, 'period')
+
+
+class TransactionKeysetPaginationTests(TestCase):
+    """
+    Recorrer la cadena de cursores 'next' devuelve cada transacción una sola
+    vez, en orden (-date, -id), aunque se inserten filas entre página y página.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user('owner@test.com', PASSWORD, first_name='Owner')
+        self.account = Account.objects.create(name='Cuenta', owner=self.user)
+        Membership.objects.create(user=self.user, account=self.account)
+        self.food = Category.objects.create(name='Comida')
+        self.salary = Category.objects.create(name='Sueldo')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = f'/api/accounts/{self.account.id}/transactions/'
+        # Varias transacciones por día, para que el desempate por id importe
+        for n in range(23):
+            self.create(date(2024, 3, 1) + timedelta(days=n // 4), self.salary if n % 3 == 0 else self.food)
+
+    def create(self, day, category=None, transaction_type=TransactionType.EXPENSE):
+        return Transaction.objects.create(
+            account=self.account, category=category or self.food, amount=Decimal('10.00'),
+            description='Movimiento', date=day, transaction_type=transaction_type,
+        )
+
+    def walk(self, url, on_page=None):
+        ids, pages = [], 0
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, response.content)
+            data = response.json()
+            ids += [row['id'] for row in data['results']]
+            url = data['next']
+            pages += 1
+            if on_page:
+                on_page(pages)
+        return ids, pages
+
+    def expected_ids(self, queryset):
+        return list(queryset.order_by('-date', '-id').values_list('id', flat=True))
+
+    def test_next_chain_has_no_duplicates_or_gaps(self):
+        ids, pages = self.walk(self.url + '?page_size=5')
+        self.assertEqual(ids, self.expected_ids(Transaction.objects.all()))
+        self.assertEqual(len(set(ids)), 23)
+        self.assertEqual(pages, 5)
+
+        # Una página exacta no deja un 'next' que apunte a una página vacía
+        ids, pages = self.walk(self.url + '?page_size=23')
+        self.assertEqual((len(ids), pages), (23, 1))
+
+    def test_rows_inserted_between_pages_do_not_shift_the_walk(self):
+        original = self.expected_ids(Transaction.objects.all())
+        inserted = {}
+
+        def insert(page):
+            if page == 2:
+                # Una más nueva que el cursor (no debe aparecer) y una más vieja (sí)
+                inserted['newer'] = self.create(date(2024, 3, 31)).id
+                inserted['older'] = self.create(date(2024, 2, 1)).id
+
+        ids, _ = self.walk(self.url + '?page_size=5', on_page=insert)
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertNotIn(inserted['newer'], ids)
+        self.assertEqual(ids, original + [inserted['older']])
+
+    def test_filters_are_kept_along_the_cursor_chain(self):
+        self.create(date(2024, 3, 2), transaction_type=TransactionType.INCOME)
+        query = f'?page_size=3&category={self.food.id}&transaction_type=EXPENSE&date_from=2024-03-02&date_to=2024-03-05'
+        ids, pages = self.walk(self.url + query)
+        expected = self.expected_ids(Transaction.objects.filter(
+            category=self.food, transaction_type=TransactionType.EXPENSE,
+            date__range=(date(2024, 3, 2), date(2024, 3, 5)),
+        ))
+        self.assertEqual(ids, expected)
+        self.assertEqual(pages, ceil(len(expected) / 3))
+
+    def test_tampered_cursor_is_not_found(self):
+        cursors = ['%%%', b64encode(b'sin-separador').decode(), b64encode(b'2024-13-01:5').decode(),
+                   b64encode(b'2024-03-01:cinco').decode(), b64encode('2024-03-01:5é'.encode()).decode()]
+        for cursor in cursors:
+            response = self.client.get(self.url, {'cursor': cursor})
+            self.assertEqual(response.status_code, 404, cursor)
+            self.assertEqual(response.json(), {'detail': 'Cursor inválido.'})
+
+
+class TransactionExportTests(TestCase):
+    """
+    La exportación CSV/NDJSON se consume como stream y reproduce las filas
+    de la base con los filtros del listado aplicados.
+    """
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user('owner@test.com', PASSWORD, first_name='Owner')
+        self.account = Account.objects.create(name='Cuenta', owner=self.user)
+        Membership.objects.create(user=self.user, account=self.account)
+        other_account = Account.objects.create(name='Otra', owner=self.user)
+        self.food = Category.objects.create(name='Comida, "rápida"')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = f'/api/accounts/{self.account.id}/transactions/export/'
+
+        self.create('1234.5', 'Almuerzo, con "comillas"', date(2024, 3, 1))
+        self.create('0.1', 'Dos\nlíneas', date(2024, 3, 2), category=None)
+        self.create('99999.99', 'Sueldo', date(2024, 3, 3), transaction_type=TransactionType.INCOME)
+        self.create('7', 'Ñandú', date(2024, 4, 1))
+        Transaction.objects.create(
+            account=other_account, category=self.food, amount=Decimal('5.00'), description='Ajena',
+            date=date(2024, 3, 1), transaction_type=TransactionType.EXPENSE,
+        )
+
+    def create(self, amount, description, day, category=False, transaction_type=TransactionType.EXPENSE):
+        return Transaction.objects.create(
+            account=self.account, category=self.food if category is False else category, amount=Decimal(amount),
+            description=description, date=day, transaction_type=transaction_type,
+        )
+
+    def export(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content).decode('utf-8')
+
+    def expected_rows(self, queryset):
+        return [
+            [str(t.id), t.date.isoformat(), t.description, str(t.category_id or ''),
+             t.category.name if t.category else '', f"{t.amount:.2f}", t.transaction_type, str(t.created_by_rule)]
+            for t in queryset.select_related('category').order_by('-date', '-id')
+        ]
+
+    def test_csv_stream_matches_the_database(self):
+        response, content = self.export()
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertEqual(
+            response['Content-Disposition'], f'attachment; filename="transacciones_cuenta_{self.account.id}.csv"'
+        )
+        rows = list(csv.reader(StringIO(content)))
+        self.assertEqual(rows[0], ['id', 'date', 'description', 'category', 'category_name',
+                                   'amount', 'transaction_type', 'created_by_rule'])
+        self.assertEqual(rows[1:], self.expected_rows(Transaction.objects.filter(account=self.account)))
+        # Decimales con dos cifras y campos con comas, comillas y saltos de línea entre comillas
+        self.assertIn('"Almuerzo, con ""comillas"""', content)
+        self.assertIn('"Dos\nlíneas"', content)
+        self.assertIn(',1234.50,', content)
+        self.assertIn(',0.10,', content)
+
+    def test_ndjson_stream_applies_filters(self):
+        response, content = self.export(
+            export_format='ndjson', transaction_type='EXPENSE', date_from='2024-03-01', date_to='2024-03-31'
+        )
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        self.assertTrue(content.endswith('\n'))
+        lines = [json.loads(line) for line in content.splitlines()]
+        expected = Transaction.objects.filter(
+            account=self.account, transaction_type='EXPENSE', date__range=(date(2024, 3, 1), date(2024, 3, 31))
+        ).order_by('-date', '-id')
+        self.assertEqual(lines, [
+            {'id': t.id, 'date': t.date.isoformat(), 'description': t.description, 'category': t.category_id,
+             'category_name': t.category.name if t.category else None, 'amount': f"{t.amount:.2f}",
+             'transaction_type': t.transaction_type, 'created_by_rule': t.created_by_rule}
+            for t in expected
+        ])
+        self.assertEqual([line['description'] for line in lines], ['Dos\nlíneas', 'Almuerzo, con "comillas"'])
+
+        _, content = self.export(export_format='csv', category=str(self.food.id))
+        self.assertEqual(list(csv.reader(StringIO(content)))[1:],
+                         self.expected_rows(Transaction.objects.filter(account=self.account, category=self.food)))
+
+    def test_invalid_format_or_filter_is_rejected(self):
+        self.assertEqual(self.client.get(self.url, {'export_format': 'xml'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'date_from': '2024-13-01'}).status_code, 400)
@@ -1,10 +1,88 @@
 # apps/transactions/views.py
-from rest_framework import viewsets, permissions
-from .models import Category, Transaction
-from .serializers import CategorySerializer, TransactionSerializer
+import copy
+import csv
+import json
+from datetime import timedelta
+from functools import partial
+from decimal import Decimal
+from rest_framework import viewsets, permissions, status
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import MultiPartParser
+from rest_framework.response import Response
+from .models import Category, Transaction, DailyRollup, MonthlyRollup, apply_materialized_totals
+from .serializers import (
+    CategorySerializer, TransactionSerializer, TransactionSummarySerializer, TransactionBatchItemSerializer,
+    STALE_CATEGORY_ERROR,
+)
+from .pagination import TransactionKeysetPagination
+from .importers import PARSERS, TransactionImporter, ImportFileError, ImportRowError
+from .category_cache import get_category_catalog, get_category_etag, get_category_index
 from apps.users.permissions import IsPremiumUser 
-from django.db.models import Q
+from django.db import IntegrityError, transaction as db_transaction
+from django.http import StreamingHttpResponse
+from django.db.models import Q, F, Sum
+from django.db.models.functions import TruncDay, TruncWeek, TruncMonth
+from django.utils.dateparse import parse_date
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
 from apps.users.mixins import AccountNestedViewMixin
+from apps.users.models import AccountChange, record_changes
+
+# Agrupaciones temporales admitidas por el endpoint de resumen
+SUMMARY_PERIODS = {
+    'day': TruncDay,
+    'week': TruncWeek,
+    'month': TruncMonth,
+}
+
+# Máximo de operaciones aceptadas en una sola petición al endpoint batch
+MAX_BATCH_OPERATIONS = 1000
+
+# Columnas del export, en el orden en que se escriben
+EXPORT_FIELDS = ['id', 'date', 'description', 'category', 'category_name', 'amount', 'transaction_type', 'created_by_rule']
+EXPORT_CHUNK_SIZE = 2000
+
+TRANSACTION_TYPES = {choice for choice, _ in Transaction._meta.get_field('transaction_type').choices}
+
+class Echo:
+    """
+    Pseudo-buffer para csv.writer: devuelve la línea en lugar de guardarla,
+    así cada fila se envía apenas se genera.
+    """
+    def write(self, value):
+        return value
+
+
+def _operation_id(op):
+    """
+    Id de una operación del batch como entero, o None si no es un id válido
+    (listas, objetos, booleanos o textos no numéricos).
+    """
+    value = op.get('id')
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    return None
+
+
+def _prepend(first, iterable):
+    yield first
+    yield from iterable
+
+
+def _export_row(row):
+    """
+    Convierte una fila de values_list a tipos simples (fecha ISO, monto como texto).
+    """
+    row = list(row)
+    row[1] = row[1].isoformat()[:10]
+    row[5] = f"{row[5]:.2f}"
+    return row
+
 
 class CategoryViewSet(viewsets.ModelViewSet, AccountNestedViewMixin):
     serializer_class = CategorySerializer
@@ -34,6 +112,24 @@ class CategoryViewSet(viewsets.ModelViewSet, AccountNestedViewMixin):
             ).order_by('name')
         return Category.objects.filter(account=account).order_by('name')
 
+    def list(self, request, *args, **kwargs):
+        """
+        Devuelve el catálogo (globales + propias) desde el caché, con ETag.
+        Si el cliente manda If-None-Match con el ETag vigente se responde
+        304 sin cuerpo y sin consultar las categorías.
+        """
+        account = self.get_account_object()
+        etag = get_category_etag(account)
+        if_none_match = parse_etags(request.headers.get('If-None-Match', ''))
+        if etag in if_none_match or '*' in if_none_match:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(get_category_catalog(account))
+        response['ETag'] = etag
+        # El cliente puede guardar la respuesta, pero debe revalidarla cada vez
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
     def perform_create(self, serializer):
         """
         Al crear una categoría, la asignamos a la cuenta correcta.
@@ -41,12 +137,23 @@ class CategoryViewSet(viewsets.ModelViewSet, AccountNestedViewMixin):
         account = self.get_account_object()
         # La validación de permiso ya se hizo, aquí solo guardamos
         serializer.save(account=account)
+
+    def perform_update(self, serializer):
+        """
+        La categoría sigue siendo de la cuenta: sin esto, un PUT sin 'account'
+        la convertiría en global (el serializer completa el campo con None).
+        """
+        serializer.save(account=self.get_account_object())
         
 class TransactionViewSet(viewsets.ModelViewSet, AccountNestedViewMixin):
     """
     ViewSet para manejar el CRUD de Transacciones.
+
+    El listado admite los filtros ?date_from=, ?date_to=, ?category= y
+    ?transaction_type=, y paginación por cursor con ?page_size= / ?cursor=.
     """
     serializer_class = TransactionSerializer
+    pagination_class = TransactionKeysetPagination
 
     def get_queryset(self):
         """
@@ -55,7 +162,14 @@ class TransactionViewSet(viewsets.ModelViewSet, AccountNestedViewMixin):
         """
         # 1. Obtenemos la cuenta (la función helper ya valida el permiso)
         account = self.get_account_object()
-        return Transaction.objects.filter(account=account).order_by('-date')
+        return Transaction.objects.filter(account=account).order_by('-date', '-id')
+
+    def list(self, request, *args, **kwargs):
+        """
+        Listado con ETag: si nada cambió en la cuenta desde la última vez,
+        responde 304 sin consultar ni serializar las transacciones.
+        """
+        return self.conditional_response(partial(super().list, request, *args, **kwargs))
     
     def perform_create(self, serializer):
         """
@@ -64,4 +178,330 @@ class TransactionViewSet(viewsets.ModelViewSet, AccountNestedViewMixin):
         """
         account = self.get_account_object()
         serializer.save(account=account)
-        
\ No newline at end of file
+
+    def get_ledger_filters(self):
+        """
+        Valida los filtros opcionales de la query string:
+        - date_from / date_to: rango de fechas inclusivo (YYYY-MM-DD).
+        - category: id de la categoría.
+        - transaction_type: INCOME o EXPENSE.
+        """
+        params = self.request.query_params
+        filters = {}
+
+        for param in ('date_from', 'date_to'):
+            raw_value = params.get(param)
+            if not raw_value:
+                continue
+            try:
+                value = parse_date(raw_value)
+            except ValueError:
+                value = None
+            if value is None:
+                raise ValidationError({param: "Formato de fecha inválido. Use YYYY-MM-DD."})
+            filters[param] = value
+
+        category = params.get('category')
+        if category:
+            if not category.isdigit():
+                raise ValidationError({'category': "Debe ser el id numérico de una categoría."})
+            filters['category'] = int(category)
+
+        transaction_type = params.get('transaction_type')
+        if transaction_type:
+            if transaction_type not in TRANSACTION_TYPES:
+                raise ValidationError({'transaction_type': "Valor inválido. Opciones: INCOME, EXPENSE."})
+            filters['transaction_type'] = transaction_type
+
+        return filters
+
+    def apply_ledger_filters(self, queryset, filters, date_field='date'):
+        if 'date_from' in filters:
+            queryset = queryset.filter(**{f'{date_field}__gte': filters['date_from']})
+        if 'date_to' in filters:
+            queryset = queryset.filter(**{f'{date_field}__lte': filters['date_to']})
+        if 'category' in filters:
+            queryset = queryset.filter(category_id=filters['category'])
+        if 'transaction_type' in filters:
+            queryset = queryset.filter(transaction_type=filters['transaction_type'])
+        return queryset
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        return self.apply_ledger_filters(queryset, self.get_ledger_filters())
+
+    @action(detail=False, methods=['get'], url_path='summary')
+    def summary(self, request, account_pk=None):
+        """
+        Devuelve los totales de ingresos y gastos de la cuenta agrupados con
+        un único GROUP BY sobre los rollups pre-agregados (diarios o mensuales),
+        sin recorrer las transacciones individuales.
+        URL: GET /api/accounts/{id}/transactions/summary/
+        Parámetros:
+        - group_by: 'category' (por defecto), 'day', 'week' o 'month'.
+        - Acepta los mismos filtros que el listado (date_from, date_to, category, transaction_type).
+        Devuelve ETag y responde 304 si el cliente ya tiene la versión vigente.
+        """
+        group_by = request.query_params.get('group_by', 'category')
+        if group_by != 'category' and group_by not in SUMMARY_PERIODS:
+            raise ValidationError(
+                {'group_by': "Valor inválido. Opciones: category, day, week, month."}
+            )
+        return self.conditional_response(lambda: Response(self.get_summary_data(group_by)))
+
+    def get_summary_data(self, group_by):
+        account = self.get_account_object()
+        filters = self.get_ledger_filters()
+
+        # Los rollups mensuales solo sirven si el rango coincide con meses completos
+        date_from, date_to = filters.get('date_from'), filters.get('date_to')
+        whole_months = (
+            (date_from is None or date_from.day == 1)
+            and (date_to is None or (date_to + timedelta(days=1)).day == 1)
+        )
+        rollup_model = MonthlyRollup if group_by in ('category', 'month') and whole_months else DailyRollup
+
+        queryset = self.apply_ledger_filters(
+            rollup_model.objects.filter(account=account), filters, date_field='period'
+        ).order_by()
+
+        if group_by == 'category':
+            queryset = queryset.values('category', category_name=F('category__name'))
+            ordering = ['category_name']
+        else:
+            queryset = queryset.annotate(period_start=SUMMARY_PERIODS[group_by]('period')).values('period_start')
+            ordering = ['period_start']
+
+        rows = queryset.annotate(
+            income_total=Sum('total', filter=Q(transaction_type='INCOME')),
+            expense_total=Sum('total', filter=Q(transaction_type='EXPENSE')),
+            transaction_count=Sum('count'),
+        ).order_by(*ordering)
+
+        # Los totales generales salen de las mismas filas agrupadas, sin otra consulta
+        results = []
+        income = expense = Decimal('0.00')
+        for row in rows:
+            if not row['transaction_count']:
+                continue
+            row['period'] = row.pop('period_start', None)
+            row['count'] = row.pop('transaction_count')
+            row['income_total'] = row['income_total'] or Decimal('0.00')
+            row['expense_total'] = row['expense_total'] or Decimal('0.00')
+            row['balance'] = row['income_total'] - row['expense_total']
+            income += row['income_total']
+            expense += row['expense_total']
+            results.append(row)
+
+        return {
+            'group_by': group_by,
+            'income_total': f"{income:.2f}",
+            'expense_total': f"{expense:.2f}",
+            'balance': f"{income - expense:.2f}",
+            'results': TransactionSummarySerializer(results, many=True).data,
+        }
+
+    @action(detail=False, methods=['post'], url_path='import', parser_classes=[MultiPartParser])
+    def import_transactions(self, request, account_pk=None):
+        """
+        Importa un extracto bancario completo en una sola petición.
+        URL: POST /api/accounts/{id}/transactions/import/ (multipart/form-data)
+        Campos:
+        - file: archivo CSV (columnas date, description, amount, category
+          y opcionalmente transaction_type) u OFX.
+        - format: 'csv' u 'ofx'. Si se omite, se deduce de la extensión.
+        - category: categoría por defecto (id o nombre) para filas sin categoría,
+          necesaria en OFX porque el formato no la incluye.
+        Devuelve la cantidad de filas creadas y los errores por fila. Las filas
+        inválidas se saltean; si el archivo no se puede leer hasta el final no
+        se importa nada (todo corre en una sola transacción).
+        """
+        upload = request.FILES.get('file')
+        if not upload:
+            return Response({'error': 'Debe adjuntar un archivo en el campo "file".'}, status=status.HTTP_400_BAD_REQUEST)
+
+        file_format = (request.data.get('format') or upload.name.rsplit('.', 1)[-1]).lower()
+        if file_format not in PARSERS:
+            return Response({'error': 'Formato no soportado. Use csv u ofx.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        account = self.get_account_object()
+        try:
+            importer = TransactionImporter(account, default_category=request.data.get('category'))
+        except ImportRowError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            with db_transaction.atomic():
+                importer.run(PARSERS[file_format](upload.file))
+        except ImportFileError as e:
+            return Response({'error': str(e), 'row': e.row}, status=status.HTTP_400_BAD_REQUEST)
+        except IntegrityError:
+            return Response({'error': STALE_CATEGORY_ERROR}, status=status.HTTP_400_BAD_REQUEST)
+        result = importer.summary()
+        response_status = status.HTTP_201_CREATED if result['created'] else status.HTTP_400_BAD_REQUEST
+        return Response(result, status=response_status)
+
+    @action(detail=False, methods=['post'], url_path='batch')
+    def batch(self, request, account_pk=None):
+        """
+        Aplica varias altas, modificaciones y bajas en una sola petición.
+        URL: POST /api/accounts/{id}/transactions/batch/
+        Body: {"operations": [
+            {"op": "create", "data": {...}},
+            {"op": "update", "id": 12, "data": {...}},   (parcial, como PATCH)
+            {"op": "delete", "id": 13}
+        ]}
+        Todas las operaciones se validan juntas. Si alguna es inválida no se
+        aplica ninguna y se devuelve el error de cada ítem; si todas son
+        válidas se escriben con bulk_create / bulk_update / un único DELETE
+        dentro de la misma transacción de base de datos.
+        """
+        # Importación diferida: automation depende de transactions, no al revés
+        from apps.automation.signals import derive_rule_transactions
+
+        operations = request.data.get('operations') if isinstance(request.data, dict) else None
+        if not isinstance(operations, list) or not operations:
+            return Response({'error': 'Debe enviar una lista "operations" no vacía.'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(operations) > MAX_BATCH_OPERATIONS:
+            return Response(
+                {'error': f'Se admiten como máximo {MAX_BATCH_OPERATIONS} operaciones por petición.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        account = self.get_account_object()
+        context = {'category_ids': set(get_category_index(account))}
+        target_ids = {
+            _operation_id(op) for op in operations if isinstance(op, dict) and op.get('op') in ('update', 'delete')
+        }
+        target_ids.discard(None)
+        existing = Transaction.objects.filter(account=account, id__in=target_ids).in_bulk()
+
+        results = []
+        to_create, to_update, to_delete = [], [], []
+        seen_ids = set()
+        has_errors = False
+        for index, op in enumerate(operations):
+            kind = op.get('op') if isinstance(op, dict) else None
+            result = {'index': index, 'op': kind}
+            results.append(result)
+
+            if kind not in ('create', 'update', 'delete'):
+                result['errors'] = {'op': "Operación inválida. Opciones: create, update, delete."}
+                has_errors = True
+                continue
+
+            instance = None
+            if kind in ('update', 'delete'):
+                operation_id = _operation_id(op)
+                result['id'] = op.get('id')
+                if operation_id is None:
+                    result['errors'] = {'id': "Debe ser el id numérico de una transacción."}
+                    has_errors = True
+                    continue
+                instance = existing.get(operation_id)
+                if instance is None:
+                    result['errors'] = {'id': "Transacción no encontrada en esta cuenta."}
+                    has_errors = True
+                    continue
+                if instance.pk in seen_ids:
+                    result['errors'] = {'id': "Hay más de una operación sobre esta transacción."}
+                    has_errors = True
+                    continue
+                seen_ids.add(instance.pk)
+
+            if kind == 'delete':
+                to_delete.append(instance)
+                continue
+
+            serializer = TransactionBatchItemSerializer(
+                instance, data=op.get('data') or {}, partial=(kind == 'update'), context=context
+            )
+            if not serializer.is_valid():
+                result['errors'] = serializer.errors
+                has_errors = True
+                continue
+
+            if kind == 'create':
+                to_create.append((result, Transaction(account=account, **serializer.validated_data)))
+            else:
+                previous = copy.copy(instance)
+                for field, value in serializer.validated_data.items():
+                    setattr(instance, field, value)
+                to_update.append((result, previous, instance))
+
+        if has_errors:
+            return Response({'results': results}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            with db_transaction.atomic():
+                changed = []
+                if to_delete:
+                    Transaction.objects.filter(id__in=[t.id for t in to_delete]).delete(track=False)
+                    apply_materialized_totals(to_delete, sign=-1)
+
+                if to_update:
+                    updated = [instance for _, _, instance in to_update]
+                    Transaction.objects.bulk_update(
+                        updated, ['amount', 'date', 'description', 'category', 'transaction_type']
+                    )
+                    apply_materialized_totals([previous for _, previous, _ in to_update], sign=-1)
+                    apply_materialized_totals(updated)
+                    changed += updated
+
+                if to_create:
+                    created = Transaction.objects.bulk_create([t for _, t in to_create])
+                    # bulk_create no emite post_save: evaluamos las reglas de evento acá, en lote
+                    derived = [d for t in created for d in derive_rule_transactions(t)]
+                    if derived:
+                        derived = Transaction.objects.bulk_create(derived)
+                    apply_materialized_totals(created + derived)
+                    changed += created + derived
+
+                # Todo el lote queda registrado bajo una única versión de la cuenta
+                record_changes(AccountChange.Kind.TRANSACTION, changed, deleted=to_delete)
+        except IntegrityError:
+            return Response({'error': STALE_CATEGORY_ERROR}, status=status.HTTP_400_BAD_REQUEST)
+
+        for result, instance in to_create:
+            result['data'] = TransactionSerializer(instance).data
+        for result, _, instance in to_update:
+            result['data'] = TransactionSerializer(instance).data
+
+        return Response({'results': results}, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'], url_path='export')
+    def export(self, request, account_pk=None):
+        """
+        Descarga el historial completo de la cuenta como un stream.
+        URL: GET /api/accounts/{id}/transactions/export/?export_format=csv|ndjson
+        Acepta los mismos filtros que el listado. Las filas se leen de a
+        bloques con .iterator() y se escriben una por una, así la memoria
+        del servidor no crece con el tamaño del historial.
+        """
+        export_format = request.query_params.get('export_format', 'csv')
+        if export_format not in ('csv', 'ndjson'):
+            raise ValidationError({'export_format': "Valor inválido. Opciones: csv, ndjson."})
+
+        account = self.get_account_object()
+        rows = self.filter_queryset(self.get_queryset()).values_list(
+            'id', 'date', 'description', 'category_id', 'category__name',
+            'amount', 'transaction_type', 'created_by_rule'
+        ).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+        if export_format == 'csv':
+            writer = csv.writer(Echo())
+            content = (
+                writer.writerow(row)
+                for row in _prepend(EXPORT_FIELDS, (_export_row(row) for row in rows))
+            )
+            content_type = 'text/csv; charset=utf-8'
+        else:
+            content = (
+                json.dumps(dict(zip(EXPORT_FIELDS, _export_row(row))), ensure_ascii=False) + '\n'
+                for row in rows
+            )
+            content_type = 'application/x-ndjson; charset=utf-8'
+
+        response = StreamingHttpResponse(content, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="transacciones_cuenta_{account.pk}.{export_format}"'
+        return response
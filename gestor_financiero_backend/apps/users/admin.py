@@ -1,7 +1,8 @@
 from django.contrib import admin
-from .models import Account, CustomUser, Membership
+from .models import Account, AccountChange, CustomUser, Membership
 
 # Register your models here.
 admin.site.register(Account)
 admin.site.register(CustomUser)
-admin.site.register(Membership)
\ No newline at end of file
+admin.site.register(Membership)
+admin.site.register(AccountChange)
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='change_version',
+            field=models.PositiveBigIntegerField(default=0, help_text='Se incrementa con cada escritura en transacciones, categorías o reglas de la cuenta.'),
+        ),
+    ]
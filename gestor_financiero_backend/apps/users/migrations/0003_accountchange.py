@@ -0,0 +1,73 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import F
+
+BATCH_SIZE = 2000
+
+
+def populate_change_log(apps, schema_editor):
+    """
+    Registra todos los objetos existentes en el log de cambios, para que una
+    sincronización desde cero (sin token) devuelva la cuenta completa.
+    Las categorías globales no hacen falta: la sincronización inicial las
+    incluye siempre desde el catálogo.
+    """
+    Account = apps.get_model('users', 'Account')
+    AccountChange = apps.get_model('users', 'AccountChange')
+
+    Account.objects.update(change_version=F('change_version') + 1)
+    versions = dict(Account.objects.values_list('id', 'change_version'))
+
+    def rows():
+        for kind, model in (
+            ('transaction', apps.get_model('transactions', 'Transaction')),
+            ('category', apps.get_model('transactions', 'Category')),
+            ('event_rule', apps.get_model('automation', 'EventRule')),
+            ('scheduled_rule', apps.get_model('automation', 'ScheduledRule')),
+        ):
+            objects = model.objects.filter(account__isnull=False).order_by().values_list('account_id', 'id')
+            for account_id, object_id in objects.iterator(chunk_size=BATCH_SIZE):
+                yield account_id, kind, object_id
+
+    batch = []
+    for account_id, kind, object_id in rows():
+        batch.append(AccountChange(
+            account_id=account_id, kind=kind, object_id=object_id, version=versions[account_id]
+        ))
+        if len(batch) >= BATCH_SIZE:
+            AccountChange.objects.bulk_create(batch)
+            batch = []
+    AccountChange.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_account_change_version'),
+        ('transactions', '0007_dailyrollup_monthlyrollup'),
+        ('automation', '0003_eventrule_eventrule_active_trigger_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('transaction', 'Transacción'), ('category', 'Categoría'), ('event_rule', 'Regla de Evento'), ('scheduled_rule', 'Regla Programada')], max_length=20)),
+                ('object_id', models.PositiveBigIntegerField()),
+                ('version', models.PositiveBigIntegerField()),
+                ('deleted', models.BooleanField(default=False)),
+                ('changed_at', models.DateTimeField(auto_now=True)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='changes', to='users.account')),
+            ],
+            options={
+                'verbose_name': 'Cambio de Cuenta',
+                'verbose_name_plural': 'Cambios de Cuenta',
+                'indexes': [models.Index(fields=['account', 'version', 'id'], name='accountchange_sync_idx')],
+                'constraints': [models.UniqueConstraint(fields=('account', 'kind', 'object_id'), name='accountchange_unique_object')],
+            },
+        ),
+        migrations.RunPython(populate_change_log, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_accountchange'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='category_version',
+            field=models.PositiveBigIntegerField(default=0, help_text='Versión del catálogo de categorías (globales + propias) de la cuenta.'),
+        ),
+    ]
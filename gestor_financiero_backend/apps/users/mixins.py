@@ -1,18 +1,59 @@
+import hashlib
 from django.shortcuts import get_object_or_404
-from rest_framework import permissions
-from .models import Account
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
+from rest_framework import permissions, status
+from rest_framework.response import Response
+from .models import Membership
 
 class AccountNestedViewMixin:
     permission_classes = [permissions.IsAuthenticated]
 
+    def get_membership(self):
+        """
+        Obtiene la membresía del usuario en la cuenta de la URL (junto con la cuenta).
+        DRF crea una instancia de la vista por request, así que se resuelve una sola
+        vez por request aunque la llamen la vista y los serializers varias veces.
+        """
+        if not hasattr(self, '_membership'):
+            # 1. Obtenemos el 'account_pk' de los kwargs de la URL
+            account_pk = self.kwargs.get('account_pk')
+            self._membership = get_object_or_404(
+                Membership.objects.select_related('account'),
+                user=self.request.user,
+                account_id=account_pk
+            )
+        return self._membership
+
     def get_account_object(self):
         """
         Obtiene el objeto Account basado en la URL y verifica que el usuario sea miembro.
         """
-        # 1. Obtenemos el 'account_pk' de los kwargs de la URL
-        account_pk = self.kwargs.get('account_pk')
-        account = get_object_or_404(
-            self.request.user.accounts.all(), 
-            pk=account_pk
-        )
-        return account
\ No newline at end of file
+        return self.get_membership().account
+
+    def get_account_etag(self):
+        """
+        ETag de la respuesta: la versión de cambios de la cuenta más la URL
+        (filtros, cursor) y el formato pedido, que también cambian el contenido.
+        """
+        account = self.get_account_object()
+        variant = f"{self.request.get_full_path()}|{self.request.accepted_renderer.format}"
+        digest = hashlib.md5(variant.encode()).hexdigest()[:16]
+        return f'"{account.id}-{account.change_version}-{digest}"'
+
+    def conditional_response(self, build_response):
+        """
+        Responde 304 sin cuerpo si el If-None-Match del cliente coincide con el
+        ETag vigente; si no, llama a build_response() y le agrega el ETag.
+        Verificar el ETag solo cuesta la consulta de membresía.
+        """
+        etag = self.get_account_etag()
+        if_none_match = parse_etags(self.request.headers.get('If-None-Match', ''))
+        if etag in if_none_match or '*' in if_none_match:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = build_response()
+        response['ETag'] = etag
+        # El cliente puede guardar la respuesta, pero debe revalidarla cada vez
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
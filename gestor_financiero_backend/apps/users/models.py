@@ -1,8 +1,12 @@
-from django.db import models
+from collections import defaultdict
+from django.db import models, transaction as db_transaction
 from django.contrib.auth.models import AbstractUser, BaseUserManager
 from django.conf import settings
 from django.utils.translation import gettext_lazy as _
 
+# Filas por INSERT al escribir en el log de cambios
+CHANGE_LOG_BATCH_SIZE = 1000
+
 
 class CustomUserManager(BaseUserManager):
     def create_user(self, email, password, **extra_fields):
@@ -72,6 +76,14 @@ class Account(models.Model):
         through="Membership"
     )
     created_at = models.DateTimeField(auto_now_add=True)
+    change_version = models.PositiveBigIntegerField(
+        default=0,
+        help_text="Se incrementa con cada escritura en transacciones, categorías o reglas de la cuenta."
+    )
+    category_version = models.PositiveBigIntegerField(
+        default=0,
+        help_text="Versión del catálogo de categorías (globales + propias) de la cuenta."
+    )
     
     class Meta:
         verbose_name = "Cuenta"
@@ -79,4 +91,109 @@ class Account(models.Model):
         ordering = ['-created_at']
  
     def __str__(self):
-        return self.name
\ No newline at end of file
+        return self.name
+
+
+def is_account_deletion(origin):
+    """
+    Indica si un borrado en cascada lo originó el borrado de una cuenta (o de
+    su dueño). En ese caso no tiene sentido registrar cambios: el log de la
+    cuenta se borra con ella.
+    """
+    model = getattr(origin, 'model', type(origin))
+    return model in (Account, CustomUser)
+
+
+class AccountChange(models.Model):
+    """
+    Log de cambios de una cuenta para la sincronización incremental.
+    Guarda una sola fila por objeto: cada escritura la actualiza con la
+    versión de cambios vigente de la cuenta, y las bajas quedan como
+    tombstones (deleted=True).
+    """
+    class Kind(models.TextChoices):
+        TRANSACTION = "transaction", "Transacción"
+        CATEGORY = "category", "Categoría"
+        EVENT_RULE = "event_rule", "Regla de Evento"
+        SCHEDULED_RULE = "scheduled_rule", "Regla Programada"
+
+    account = models.ForeignKey(Account, on_delete=models.CASCADE, related_name='changes')
+    kind = models.CharField(max_length=20, choices=Kind.choices)
+    object_id = models.PositiveBigIntegerField()
+    version = models.PositiveBigIntegerField()
+    deleted = models.BooleanField(default=False)
+    changed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Cambio de Cuenta"
+        verbose_name_plural = "Cambios de Cuenta"
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'kind', 'object_id'], name='accountchange_unique_object'),
+        ]
+        indexes = [
+            # Lectura del endpoint de sincronización: cambios posteriores a un token
+            models.Index(fields=['account', 'version', 'id'], name='accountchange_sync_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id} (v{self.version})"
+
+
+def record_changes(kind, objects=(), deleted=()):
+    """
+    Registra altas/modificaciones ('objects') y bajas ('deleted') de objetos
+    con 'account_id' en el log de cambios, con tres consultas sin importar
+    cuántas cuentas haya. Cada cuenta afectada incrementa su versión una sola
+    vez; el UPDATE bloquea la fila de la cuenta hasta el commit, así las
+    versiones de una cuenta se confirman en orden.
+    """
+    changes = defaultdict(dict)
+    for obj in objects:
+        changes[obj.account_id][obj.pk] = False
+    for obj in deleted:
+        changes[obj.account_id][obj.pk] = True
+    changes.pop(None, None)
+    if not changes:
+        return
+
+    with db_transaction.atomic(savepoint=False):
+        accounts = Account.objects.filter(pk__in=list(changes))
+        accounts.update(change_version=models.F('change_version') + 1)
+        # Las cuentas que se están borrando no aparecen y se omiten
+        versions = dict(accounts.values_list('id', 'change_version'))
+        _upsert_changes([
+            AccountChange(account_id=account_id, kind=kind, object_id=object_id,
+                          version=versions[account_id], deleted=is_deleted)
+            for account_id, objects_by_id in changes.items() if account_id in versions
+            for object_id, is_deleted in objects_by_id.items()
+        ])
+
+
+def record_global_change(kind, object_id, accounts, deleted=False):
+    """
+    Registra el cambio de un objeto compartido entre cuentas (las categorías
+    globales) en el log de las cuentas indicadas ('accounts', un queryset),
+    sin tocar la versión de las demás.
+    """
+    with db_transaction.atomic(savepoint=False):
+        accounts.update(change_version=models.F('change_version') + 1)
+        versions = accounts.order_by().values_list('id', 'change_version')
+        batch = []
+        for account_id, version in versions.iterator(chunk_size=CHANGE_LOG_BATCH_SIZE):
+            batch.append(AccountChange(account_id=account_id, kind=kind, object_id=object_id,
+                                       version=version, deleted=deleted))
+            if len(batch) >= CHANGE_LOG_BATCH_SIZE:
+                _upsert_changes(batch)
+                batch = []
+        _upsert_changes(batch)
+
+
+def _upsert_changes(changes):
+    if changes:
+        AccountChange.objects.bulk_create(
+            changes,
+            batch_size=CHANGE_LOG_BATCH_SIZE,
+            update_conflicts=True,
+            unique_fields=['account', 'kind', 'object_id'],
+            update_fields=['version', 'deleted', 'changed_at'],
+        )
@@ -33,6 +33,10 @@ class AccountSerializer(serializers.ModelSerializer):
         Devuelve el alias del usuario para esta cuenta, o el nombre real de la cuenta.
         """
         # 'obj' es la instancia de la Cuenta que se está serializando
+        # Si la vista ya anotó el alias (AccountViewSet.get_queryset), no consultamos de nuevo
+        if hasattr(obj, 'my_alias'):
+            return obj.my_alias or obj.name
+
         user = self.context['request'].user
         
         try:
@@ -0,0 +1,127 @@
+# apps/users/sync.py
+"""
+Sincronización incremental: a partir del log de cambios (AccountChange)
+devuelve solo lo que se insertó, modificó o borró en una cuenta desde un token.
+
+El token codifica la posición (versión, id) del último cambio entregado.
+Las versiones de una cuenta se confirman en orden (el UPDATE de la versión
+bloquea la fila de la cuenta hasta el commit), así que nunca aparece más tarde
+un cambio con una posición anterior a un token ya entregado.
+
+Los cambios de una categoría global solo se registran en las cuentas que la
+usan. Para las demás, el token lleva además la versión del catálogo de
+categorías (Account.category_version): si cambió, la respuesta trae en
+'global_categories' la lista completa de categorías globales.
+"""
+from base64 import b64decode, b64encode
+from django.db.models import Q
+from .models import AccountChange
+
+SYNC_PAGE_SIZE = 1000
+
+
+class InvalidSyncToken(ValueError):
+    pass
+
+
+def encode_token(version, change_id, category_version):
+    return b64encode(f"{version}.{change_id}.{category_version}".encode()).decode()
+
+
+def decode_token(token):
+    """
+    Devuelve (versión, id de cambio, versión del catálogo). Los tokens
+    anteriores no traen la versión del catálogo: se devuelve None.
+    """
+    try:
+        parts = [int(part) for part in b64decode(token.encode(), validate=True).decode().split('.')]
+    except (ValueError, UnicodeDecodeError):
+        raise InvalidSyncToken("Token inválido.")
+    if len(parts) == 2:
+        parts.append(None)
+    if len(parts) != 3:
+        raise InvalidSyncToken("Token inválido.")
+    return tuple(parts)
+
+
+def _sync_sources(include_rules):
+    """
+    Devuelve {kind: (clave de respuesta, queryset base, serializer)}.
+    Importación diferida: transactions y automation dependen de users.
+    """
+    from apps.transactions.models import Transaction, Category
+    from apps.transactions.serializers import TransactionSerializer, CategorySerializer
+    from apps.automation.models import EventRule, ScheduledRule
+    from apps.automation.serializers import EventRuleSerializer, ScheduledRuleSerializer
+
+    sources = {
+        AccountChange.Kind.TRANSACTION: ('transactions', Transaction.objects.all(), TransactionSerializer),
+        AccountChange.Kind.CATEGORY: ('categories', Category.objects.all(), CategorySerializer),
+    }
+    if include_rules:
+        sources[AccountChange.Kind.EVENT_RULE] = ('event_rules', EventRule.objects.all(), EventRuleSerializer)
+        sources[AccountChange.Kind.SCHEDULED_RULE] = (
+            'scheduled_rules',
+            ScheduledRule.objects.select_related('account', 'created_by'),
+            ScheduledRuleSerializer,
+        )
+    return sources
+
+
+def build_sync_payload(account, since=None, include_rules=True, context=None, page_size=SYNC_PAGE_SIZE):
+    """
+    Arma la respuesta del endpoint de sincronización.
+    Sin 'since' se devuelve la cuenta completa (paginada con has_more).
+    Los cambios se leen con una sola consulta y luego se carga una vez cada
+    tipo de objeto modificado; los borrados solo se informan por id.
+    'global_categories' es None salvo que el catálogo haya cambiado desde el
+    token: entonces reemplaza las categorías globales que tenga el cliente.
+    """
+    from apps.transactions.category_cache import get_category_catalog
+    sources = _sync_sources(include_rules)
+    changes = AccountChange.objects.filter(account=account, kind__in=list(sources))
+    version, change_id, category_version = 0, 0, None
+    if since:
+        version, change_id, category_version = decode_token(since)
+        changes = changes.filter(Q(version__gt=version) | Q(version=version, id__gt=change_id))
+    changes = list(changes.order_by('version', 'id')[:page_size + 1])
+    has_more = len(changes) > page_size
+    changes = changes[:page_size]
+
+    payload = {key: {'upserted': [], 'deleted': []} for key, _, _ in sources.values()}
+    upserted_ids = {kind: [] for kind in sources}
+    for change in changes:
+        if change.deleted:
+            payload[sources[change.kind][0]]['deleted'].append(change.object_id)
+        else:
+            upserted_ids[change.kind].append(change.object_id)
+
+    for kind, ids in upserted_ids.items():
+        if not ids:
+            continue
+        key, queryset, serializer_class = sources[kind]
+        scope = Q(account=account)
+        if kind == AccountChange.Kind.CATEGORY:
+            # Las categorías globales (sin cuenta) también se registran en el log de cada cuenta
+            scope |= Q(account__isnull=True)
+        # Un objeto borrado después de leer el log se informa en la próxima sincronización
+        objects = queryset.filter(scope, id__in=ids).order_by('id')
+        payload[key]['upserted'] = serializer_class(objects, many=True, context=context or {}).data
+
+    global_categories = None
+    if not since:
+        # Las categorías globales solo están en el log de las cuentas que las usan:
+        # la sincronización inicial las incluye siempre (sin repetir las que ya vinieron del log)
+        logged = {category['id'] for category in payload['categories']['upserted']}
+        payload['categories']['upserted'] = [
+            category for category in get_category_catalog(account)
+            if category['account'] is None and category['id'] not in logged
+        ] + list(payload['categories']['upserted'])
+    elif category_version != account.category_version:
+        global_categories = [category for category in get_category_catalog(account) if category['account'] is None]
+
+    if changes:
+        version, change_id = changes[-1].version, changes[-1].id
+    # La versión del catálogo se leyó antes que el log: a lo sumo se reenvían las globales
+    token = encode_token(version, change_id, account.category_version)
+    return {'token': token, 'has_more': has_more, 'global_categories': global_categories, **payload}
@@ -1,3 +1,273 @@
-from django.test import TestCase
+from base64 import b64decode, b64encode
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+from .models import CustomUser, Account, Membership
 
-# Create your tests here.
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class AccountListQueryCountTests(TestCase):
+    """
+    El listado de cuentas debe hacer una cantidad fija de consultas,
+    sin importar cuántas cuentas o miembros tenga el usuario.
+    """
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user('owner@test.com', 'secret', first_name='Owner')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_accounts(self, count):
+        for i in range(count):
+            account = Account.objects.create(name=f'Cuenta {Account.objects.count()}', owner=self.user)
+            Membership.objects.create(user=self.user, account=account, alias=f'Alias {i}' if i % 2 else None)
+            member = CustomUser.objects.create_user(f'member{account.id}@test.com', 'secret', first_name='Miembro')
+            Membership.objects.create(user=member, account=account)
+
+    def test_list_query_count_is_constant(self):
+        self.create_accounts(2)
+        # 1 consulta de cuentas (con alias y dueño) + 1 de miembros precargados
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/accounts/')
+        self.assertEqual(len(response.json()), 2)
+
+        self.create_accounts(10)
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/accounts/')
+        self.assertEqual(len(response.json()), 12)
+
+    def test_display_name_uses_alias_or_name(self):
+        self.create_accounts(2)
+        response = self.client.get('/api/accounts/')
+        display_names = sorted(account['display_name'] for account in response.json())
+        self.assertEqual(display_names, ['Alias 1', 'Cuenta 0'])
+        for account in response.json():
+            self.assertEqual(account['owner']['email'], 'owner@test.com')
+            self.assertEqual(len(account['members']), 2)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class AccountNestedViewMixinTests(TestCase):
+    """
+    Las vistas anidadas verifican la membresía una sola vez por request.
+    """
+
+    def setUp(self):
+        # El catálogo de categorías cacheado sobrevive al rollback de otros tests
+        cache.clear()
+        self.user = CustomUser.objects.create_user(
+            'owner@test.com', 'secret', first_name='Owner', role=CustomUser.Role.PREMIUM
+        )
+        self.account = Account.objects.create(name='Cuenta', owner=self.user)
+        Membership.objects.create(user=self.user, account=self.account)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_membership_is_checked_once_per_request(self):
+        from apps.transactions.models import Category
+        source = Category.objects.create(name='Sueldo')
+        destination = Category.objects.create(name='Ahorro')
+        # 1 membresía + 1 catálogo de categorías + 1 insert + 3 del log de cambios (versión y registro):
+        # vista y serializer no repiten la búsqueda de la cuenta
+        with self.assertNumQueries(6):
+            response = self.client.post(f'/api/accounts/{self.account.id}/scheduled-rules/', {
+                'name': 'Ahorro', 'schedule_day_of_month': 1, 'action_type': 'FIXED',
+                'source_category': source.id, 'action_destination_category': destination.id,
+                'action_fixed_amount': '100.00',
+            }, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+
+    def test_non_member_gets_404(self):
+        other = CustomUser.objects.create_user('other@test.com', 'secret', first_name='Otro')
+        self.client.force_authenticate(other)
+        response = self.client.get(f'/api/accounts/{self.account.id}/transactions/')
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class AccountSyncTests(TestCase):
+    """
+    El endpoint de sincronización devuelve solo los cambios posteriores al token.
+    """
+
+    def setUp(self):
+        from apps.transactions.models import Category
+        # Los ids se reutilizan entre tests: un catálogo cacheado de otro test tendría la misma clave
+        cache.clear()
+        self.user = CustomUser.objects.create_user(
+            'owner@test.com', 'secret', first_name='Owner', role=CustomUser.Role.PREMIUM
+        )
+        self.account = Account.objects.create(name='Cuenta', owner=self.user)
+        Membership.objects.create(user=self.user, account=self.account)
+        self.global_category = Category.objects.create(name='Comida')
+        self.category = Category.objects.create(name='Propia', account=self.account)
+        self.url = f'/api/accounts/{self.account.id}/sync/'
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_transaction(self, description='Almuerzo'):
+        from apps.transactions.models import Transaction
+        return Transaction.objects.create(
+            account=self.account, category=self.category, amount='10.00',
+            description=description, transaction_type='EXPENSE',
+        )
+
+    def test_full_sync_then_deltas(self):
+        first = self.create_transaction()
+        response = self.client.get(self.url).json()
+        self.assertFalse(response['has_more'])
+        self.assertEqual([t['id'] for t in response['transactions']['upserted']], [first.id])
+        self.assertEqual(
+            sorted(c['name'] for c in response['categories']['upserted']), ['Comida', 'Propia']
+        )
+        token = response['token']
+
+        # Sin cambios, el delta viene vacío y el token no cambia
+        response = self.client.get(self.url, {'since': token}).json()
+        self.assertEqual(response['transactions'], {'upserted': [], 'deleted': []})
+        self.assertEqual(response['token'], token)
+
+        second = self.create_transaction('Cena')
+        first.description = 'Almuerzo editado'
+        first.save()
+        deleted_id = second.id
+        second.delete()
+        third = self.create_transaction('Desayuno')
+
+        response = self.client.get(self.url, {'since': token}).json()
+        self.assertEqual(
+            sorted(t['description'] for t in response['transactions']['upserted']),
+            ['Almuerzo editado', 'Desayuno']
+        )
+        self.assertEqual(response['transactions']['deleted'], [deleted_id])
+        self.assertEqual(response['categories'], {'upserted': [], 'deleted': []})
+        self.assertNotEqual(response['token'], token)
+        self.assertIn(third.id, [t['id'] for t in response['transactions']['upserted']])
+
+    def test_rule_and_category_changes(self):
+        from apps.automation.models import EventRule
+        token = self.client.get(self.url).json()['token']
+        rule = EventRule.objects.create(
+            account=self.account, name='Ahorro', created_by=self.user,
+            trigger_category=self.global_category, trigger_transaction_type='INCOME',
+            action_type='FIXED', action_destination_category=self.category, action_fixed_amount='5.00',
+        )
+        response = self.client.get(self.url, {'since': token}).json()
+        self.assertEqual([r['id'] for r in response['event_rules']['upserted']], [rule.id])
+        token = response['token']
+
+        # Borrar la categoría borra en cascada la regla: ambas llegan como tombstones
+        category_id = self.category.id
+        self.category.delete()
+        response = self.client.get(self.url, {'since': token}).json()
+        self.assertEqual(response['categories']['deleted'], [category_id])
+        self.assertEqual(response['event_rules']['deleted'], [rule.id])
+
+    def test_global_category_changes_reach_incremental_sync(self):
+        from apps.transactions.models import Transaction
+        expense = Transaction.objects.create(
+            account=self.account, category=self.global_category, amount='10.00',
+            description='Almuerzo', transaction_type='EXPENSE',
+        )
+        token = self.client.get(self.url).json()['token']
+        self.global_category.name = 'Comida y bebida'
+        self.global_category.save()
+
+        response = self.client.get(self.url, {'since': token}).json()
+        self.assertEqual(
+            [(c['id'], c['name']) for c in response['categories']['upserted']],
+            [(self.global_category.id, 'Comida y bebida')]
+        )
+        self.assertEqual([c['name'] for c in response['global_categories']], ['Comida y bebida'])
+        token = response['token']
+
+        category_id = self.global_category.id
+        self.global_category.delete()
+        response = self.client.get(self.url, {'since': token}).json()
+        self.assertEqual(response['categories'], {'upserted': [], 'deleted': [category_id]})
+        self.assertEqual(response['global_categories'], [])
+        # La transacción quedó sin categoría y llega como modificada
+        self.assertEqual(
+            [(t['id'], t['category']) for t in response['transactions']['upserted']], [(expense.id, None)]
+        )
+
+        response = self.client.get(self.url, {'since': response['token']}).json()
+        self.assertIsNone(response['global_categories'])
+
+    def test_global_category_changes_skip_accounts_that_do_not_use_it(self):
+        other = Account.objects.create(name='Otra', owner=self.user)
+        Membership.objects.create(user=self.user, account=other)
+        url = f'/api/accounts/{other.id}/sync/'
+        token = self.client.get(url).json()['token']
+        other.refresh_from_db()
+        change_version = other.change_version
+
+        self.global_category.name = 'Comida y bebida'
+        self.global_category.save()
+        other.refresh_from_db()
+        self.assertEqual(other.change_version, change_version)
+        self.assertFalse(other.changes.exists())
+
+        # El catálogo cambió: las globales llegan completas fuera del log
+        response = self.client.get(url, {'since': token}).json()
+        self.assertEqual(response['categories'], {'upserted': [], 'deleted': []})
+        self.assertEqual([c['name'] for c in response['global_categories']], ['Comida y bebida'])
+
+        self.global_category.delete()
+        response = self.client.get(url, {'since': response['token']}).json()
+        self.assertEqual(response['global_categories'], [])
+
+    def test_category_deletion_reaches_the_objects_that_used_it(self):
+        from apps.automation.models import ScheduledRule
+        expense = self.create_transaction()
+        rule = ScheduledRule.objects.create(
+            account=self.account, name='Ahorro', created_by=self.user, schedule_day_of_month=1,
+            source_category=self.category, action_type='FIXED',
+            action_destination_category=self.global_category, action_fixed_amount='5.00',
+        )
+        token = self.client.get(self.url).json()['token']
+
+        self.category.delete()
+        response = self.client.get(self.url, {'since': token}).json()
+        self.assertEqual([(t['id'], t['category']) for t in response['transactions']['upserted']], [(expense.id, None)])
+        self.assertEqual(
+            [(r['id'], r['source_category']) for r in response['scheduled_rules']['upserted']], [(rule.id, None)]
+        )
+
+    def test_tokens_without_catalog_version_are_accepted(self):
+        from .sync import build_sync_payload
+        self.create_transaction()
+        token = build_sync_payload(self.account)['token']
+        version, change_id = b64decode(token).decode().split('.')[:2]
+        legacy = b64encode(f"{version}.{change_id}".encode()).decode()
+        response = self.client.get(self.url, {'since': legacy}).json()
+        self.assertEqual(response['transactions'], {'upserted': [], 'deleted': []})
+        self.assertEqual([c['name'] for c in response['global_categories']], ['Comida'])
+
+    def test_pages_with_has_more(self):
+        from .sync import build_sync_payload
+        created = {self.create_transaction(f'Gasto {i}').id for i in range(5)}
+        seen, token, has_more = set(), None, True
+        while has_more:
+            payload = build_sync_payload(self.account, token, page_size=2)
+            seen |= {t['id'] for t in payload['transactions']['upserted']}
+            token, has_more = payload['token'], payload['has_more']
+        self.assertEqual(seen, created)
+
+    def test_non_premium_users_do_not_receive_rules(self):
+        self.user.role = CustomUser.Role.NORMAL
+        self.user.save()
+        response = self.client.get(self.url).json()
+        self.assertNotIn('event_rules', response)
+        self.assertIn('transactions', response)
+
+    def test_invalid_token_and_non_member(self):
+        self.assertEqual(self.client.get(self.url, {'since': 'no-es-un-token'}).status_code, 400)
+        other = CustomUser.objects.create_user('other@test.com', 'secret', first_name='Otro')
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_deleting_account_does_not_log_changes(self):
+        self.create_transaction()
+        self.account.delete()
+        self.assertFalse(Account.objects.filter(pk=self.account.pk).exists())
@@ -1,10 +1,13 @@
 from rest_framework import viewsets, permissions, generics, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from django.db.models import OuterRef, Subquery
+from django.shortcuts import get_object_or_404
 from .models import CustomUser, Account, Membership
+from .sync import build_sync_payload, InvalidSyncToken
 from .serializers import UserSerializer, AccountSerializer, RegisterSerializer, MyTokenObtainPairSerializer, MembershipSerializer
 from rest_framework_simplejwt.views import TokenObtainPairView
-from .permissions import IsAccountOwner
+from .permissions import IsAccountOwner, IsPremiumUser
 
 class RegisterView(generics.CreateAPIView):
     """
@@ -41,7 +44,17 @@ class AccountViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         # Filtramos para que un usuario solo vea las cuentas a las que pertenece
-        return self.request.user.accounts.all().order_by("name")
+        user = self.request.user
+        # El alias del usuario se anota en la misma consulta y los miembros/dueño
+        # se precargan, para que el listado no haga consultas extra por cuenta.
+        my_alias = Membership.objects.filter(account=OuterRef('pk'), user=user).values('alias')[:1]
+        return (
+            user.accounts.all()
+            .annotate(my_alias=Subquery(my_alias))
+            .select_related('owner')
+            .prefetch_related('members')
+            .order_by("name")
+        )
     
     def get_permissions(self):
         """
@@ -124,4 +137,29 @@ class AccountViewSet(viewsets.ModelViewSet):
         # Para el método GET, listamos todos los miembros
         members = account.members.all()
         serializer = UserSerializer(members, many=True)
-        return Response(serializer.data)
\ No newline at end of file
+        return Response(serializer.data)
+
+    @action(detail=True, methods=['get'], url_path='sync')
+    def sync(self, request, pk=None):
+        """
+        Sincronización incremental de la cuenta.
+        URL: GET /api/accounts/{id}/sync/?since=<token>
+        Devuelve las transacciones, categorías y reglas insertadas/modificadas
+        ('upserted') y los ids borrados ('deleted') desde el token, más un
+        nuevo 'token' para la próxima llamada. Sin 'since' devuelve la cuenta
+        completa. Si 'has_more' es true hay que volver a llamar con el token.
+        Las transacciones y reglas que quedan sin la categoría borrada llegan
+        como modificadas. Si cambió el catálogo, 'global_categories' trae la
+        lista completa de categorías globales.
+        """
+        # Para sincronizar no hace falta anotar alias ni precargar miembros
+        account = get_object_or_404(request.user.accounts.all(), pk=pk)
+        # Las reglas son exclusivas de los usuarios Premium, igual que en sus endpoints
+        include_rules = IsPremiumUser().has_permission(request, self)
+        try:
+            payload = build_sync_payload(
+                account, request.query_params.get('since'), include_rules, context={'request': request}
+            )
+        except InvalidSyncToken as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(payload)
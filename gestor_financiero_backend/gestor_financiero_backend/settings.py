@@ -40,6 +40,35 @@ INSTALLED_APPS = [
 env_path = BASE_DIR.parent / '.env'
 dotenv.read_dotenv(env_path)
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+# URL alternativa de la API (un proxy o un servidor local de pruebas)
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL')
+
+# Generación de consejos (apps.insights): modelo, solicitudes simultáneas,
+# límite de solicitudes por minuto y reintentos ante errores transitorios
+INSIGHTS_MODEL = os.getenv('INSIGHTS_MODEL', 'gpt-4o-mini')
+INSIGHTS_CONCURRENCY = int(os.getenv('INSIGHTS_CONCURRENCY', 8))
+INSIGHTS_REQUESTS_PER_MINUTE = int(os.getenv('INSIGHTS_REQUESTS_PER_MINUTE', 500))
+INSIGHTS_MAX_RETRIES = 4
+INSIGHTS_RETRY_BASE_DELAY = 1.0  # segundos; se duplica en cada reintento
+INSIGHTS_REQUEST_TIMEOUT = 30  # segundos por solicitud
+# Tamaño máximo (estimado) del resumen semanal que va en cada prompt y cómo
+# recortarlo: 'collapse' suma las categorías que no entran en "Otras
+# categorías", 'drop' las descarta
+INSIGHTS_PROMPT_TOKEN_BUDGET = 1500
+INSIGHTS_PROMPT_TRUNCATION = 'collapse'
+# Si la huella de gastos de un usuario coincide con la de alguno de sus
+# últimos INSIGHTS_CACHE_MAX_ENTRIES consejos de los últimos
+# INSIGHTS_CACHE_TTL_DAYS días, no se genera uno nuevo (0 desactiva el
+# caché). La huella redondea los totales por categoría a
+# INSIGHTS_FINGERPRINT_DIGITS cifras significativas.
+INSIGHTS_CACHE_TTL_DAYS = 28
+INSIGHTS_CACHE_MAX_ENTRIES = 4
+INSIGHTS_FINGERPRINT_DIGITS = 2
+# 'sync' llama a la API por usuario; 'batch' envía un lote a la Batch API y
+# una tarea posterior consulta cada INSIGHTS_BATCH_POLL_INTERVAL segundos
+# hasta que termina
+INSIGHTS_MODE = os.getenv('INSIGHTS_MODE', 'sync')
+INSIGHTS_BATCH_POLL_INTERVAL = 300
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
@@ -110,6 +139,37 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Cache
+# Por defecto el caché vive en la memoria de cada proceso. Si se levantan
+# varios procesos (gunicorn, django-q), REDIS_URL tiene que apuntar a un
+# Redis compartido para que las invalidaciones lleguen a todos;
+# `manage.py check --deploy` avisa si falta.
+
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'gestor-financiero',
+        }
+    }
+
+# Segundos que se cachea el índice de reglas de evento de cada cuenta.
+# Acota cuánto puede tardar un proceso en ver cambios si el caché no es compartido.
+EVENT_RULES_CACHE_TIMEOUT = 300
+
+# Segundos que se cachea el catálogo de categorías de cada cuenta. Las claves
+# llevan la versión guardada en la cuenta, así que ninguna escritura depende
+# de que venza: el timeout solo libera catálogos que ya no se usan.
+CATEGORY_CACHE_TIMEOUT = 300
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.2/topics/i18n/
 
@@ -152,6 +212,8 @@ Q_CLUSTER = {
     # Evita que se ejecuten tareas programadas perdidas si el servidor 
     # estuvo apagado. Si la regla era para el día 5 y el servidor 
     # se enciende el día 8, no se ejecutará la tarea del día 5.
+    # Las reglas programadas perdidas se recuperan con la tarea
+    # 'apps.automation.tasks.catch_up_scheduled_rules'.
     'catch_up': False, 
     
     # Configuración de logging 